@@ -1,70 +1,95 @@
-from Util import load_embeddings, rerank, vector_retreival
+from knowledge_base import get_knowledge_base
+from retrieval import retrieve
 from default_values_prompts import bot_1_name, bot_2_name, bot_1_knowledge_base, bot_2_knowledge_base
-import numpy as np
+from Util import run_blocking
+from response_cache import RESPONSE_CACHE_ENABLED, lookup_reply, store_reply
+from prompt_builder import assemble_prompt
+from metrics import timed, observe_count, observe_stage
 import random
+import time
+
+
+def record_usage(response, citations: list):
+    """Per-turn sizes for the metrics endpoint, usage is only reported by some providers."""
+    observe_count("turn_chunks", len(citations), help="Knowledge base chunks put in the prompt per turn")
+    usage = getattr(response, "usage", None)
+    if usage is not None:
+        observe_count("turn_prompt_tokens", usage.prompt_tokens or 0, help="Prompt tokens per completion")
+        observe_count("turn_completion_tokens", usage.completion_tokens or 0, help="Completion tokens per completion")
 
 
 class Bot:
-    def __init__(self, name, persona_prompt, model, client, chat_color='#27a348', knowledge_base: str = None):
+    def __init__(self, name, persona_prompt, model, client, chat_color='#27a348', knowledge_base: str = None,
+                 async_client=None):
         self.name = name
         self.persona_prompt = persona_prompt
         self.model = model
         self.client = client
+        self.async_client = async_client  # used by agenerate_response for the completion, optional
         self.history = []
+        self.conversation_history = None  # prompt_builder.ConversationHistory of the conversation being answered
         self.chat_color = chat_color
         if name == bot_1_name:
             knowledge_base = bot_1_knowledge_base
         elif name == bot_2_name:
             knowledge_base = bot_2_knowledge_base
-        self.knowledge_base = load_embeddings(knowledge_base) if knowledge_base else None
+        self.knowledge_base_path = knowledge_base
+
+    @property
+    def knowledge_base(self):
+        # borrowed from the shared registry on every access so a changed file is picked up between turns
+        return get_knowledge_base(self.knowledge_base_path) if self.knowledge_base_path else None
 
     def clean_history(self):
         self.history = []
         return
 
-    def generate_response(self, subject: str, user_prompt: str = None, use_knowledge: bool = True, top_k: int = 5,
-                          cite=False):
+    def build_messages(self, subject: str, user_prompt: str = None, use_knowledge: bool = True, top_k: int = 5,
+                       cite=False) -> (list[dict], str, list[dict]):
+        """
+        Runs the retrieval for the subject and assembles the chat messages for the next completion.
+
+        Returns:
+            (messages, chunks, citations) where chunks is the retrieved context that went into the prompt and
+            citations references the same chunks as {"chunk_id", "score", "rank"} dicts.
+        """
         system_prompt = (f"Continue the conversation naturally.Be conversational, as if you were chatting with a "
                          f"friend Use logical connections and comparisons when changing topic.Use less than 150 "
                          f"words.Be conversational and ask the user their opinion.")
         system_messages = [{"role": "system", "content": self.persona_prompt}]
         system_messages.append({"role": "system", "content": f"Topic: {subject}" + system_prompt})
-        reranked_chunks = ''
-        if use_knowledge and self.knowledge_base:
-            chunks = [d["chunk"] for d in self.knowledge_base]
-            embeddings = np.array([d["embedding"] for d in self.knowledge_base])
-
-            top_k_indices = vector_retreival(client=self.client, query=subject, top_k=top_k, vector_index=embeddings)
-            top_k_chunks = [chunks[i] for i in top_k_indices]
-
-            reranked_indices = rerank(self.client, chunks=top_k_chunks, top_k=top_k, query=subject)
+        rag_header = ''
+        chunk_texts = []
+        citations = []
+        knowledge_base = self.knowledge_base if use_knowledge else None
+        if knowledge_base:
+            retrieved = retrieve(self.client, knowledge_base, query=subject, top_k=top_k)
+            rows = [row for row, _ in retrieved]
+            citations = [{"chunk_id": knowledge_base.records[row]["id"], "score": score, "rank": rank}
+                         for rank, (row, score) in enumerate(retrieved)]
 
             if cite:
-                reranked_articles = [self.knowledge_base[i] for i in reranked_indices]
-                stringed_articles = [f"{article['title']}\nBy:{article['author']}\n{article['chunk']}\n" for article in
-                                     reranked_articles]
-
-                reranked_chunks = "\n\n".join(stringed_articles)
-                rag_prompt = (
-                        "Use the following context extracted from NYT interviews to inform your next response. "
-                        "Reference it only if it's relevant to the topic and always cite the tittle and author:\n\n"
-                        + reranked_chunks.strip()
-                )
+                reranked_articles = [knowledge_base.records[i] for i in rows]
+                chunk_texts = [f"{article['title']}\nBy:{article['author']}\n{article['chunk']}\n" for article in
+                               reranked_articles]
+                rag_header = ("Use the following context extracted from NYT interviews to inform your next response. "
+                              "Reference it only if it's relevant to the topic and always cite the tittle and "
+                              "author:\n\n")
             else:
-                reranked_chunks = "\n\n".join([top_k_chunks[i] for i in reranked_indices])
-
-                rag_prompt = (
-                        "Use the following context extracted from NYT interviews to inform your next response. "
-                        "Reference it only if it's relevant to the topic:\n\n" + reranked_chunks.strip()
-                )
-            system_messages.append({"role": "system", "content": rag_prompt})
+                chunk_texts = [knowledge_base.chunks[i] for i in rows]
+                rag_header = ("Use the following context extracted from NYT interviews to inform your next response. "
+                              "Reference it only if it's relevant to the topic:\n\n")
 
         if user_prompt:
             self.history.append({"role": "user", "content": user_prompt})
 
-        messages = system_messages + self.history
+        # conversation history and chunks are trimmed to the context budget, citations follow the chunks kept
+        messages, kept_chunks = assemble_prompt(system_messages, rag_header, chunk_texts, self.conversation_history,
+                                                self.name, extra_messages=self.history)
+        return messages, "\n\n".join(chunk_texts[:kept_chunks]).strip(), citations[:kept_chunks]
 
-        response = self.client.chat.completions.create(
+    def completion_kwargs(self, messages: list[dict]) -> dict:
+        return dict(
             model=self.model,
             messages=messages,
             temperature=0.2,
@@ -72,7 +97,101 @@ class Bot:
             # repetition_penalty=2,  # arbitrary number?
             frequency_penalty=1,  # [-2,2]
         )
+
+    def generate_response(self, subject: str, user_prompt: str = None, use_knowledge: bool = True, top_k: int = 5,
+                          cite=False, use_cache: bool = False):
+        """
+        Args:
+            use_cache: answer from the response cache when RESPONSE_CACHE is enabled, for turns whose prompt only
+                depends on the topic (e.g. the opening turn of a conversation).
+        """
+        messages, chunks, citations = self.build_messages(subject, user_prompt=user_prompt,
+                                                          use_knowledge=use_knowledge, top_k=top_k, cite=cite)
+        cache_entry = None
+        if use_cache and RESPONSE_CACHE_ENABLED:
+            reply, cache_entry = lookup_reply(self, subject, citations, cite)
+            if reply is not None:
+                return self._cached_response(reply, chunks, citations)
+
+        with timed("llm_completion"):
+            response = self.client.chat.completions.create(**self.completion_kwargs(messages))
+        record_usage(response, citations)
+        reply = response.choices[0].message.content
+        if cache_entry is not None:
+            store_reply(cache_entry, reply)
+        self.history.append({"role": "assistant", "content": reply})
+
+        return {"reply": reply, "chunks": chunks, "citations": citations, "cached": False}
+
+    async def agenerate_response(self, subject: str, user_prompt: str = None, use_knowledge: bool = True,
+                                 top_k: int = 5, cite=False, use_cache: bool = False):
+        """
+        Same as generate_response without blocking the event loop: the retrieval (mostly cache hits) runs on the
+        bounded executor and the completion goes through the async client when there is one.
+        """
+        messages, chunks, citations = await run_blocking(self.build_messages, subject, user_prompt=user_prompt,
+                                                         use_knowledge=use_knowledge, top_k=top_k, cite=cite)
+        cache_entry = None
+        if use_cache and RESPONSE_CACHE_ENABLED:
+            reply, cache_entry = await run_blocking(lookup_reply, self, subject, citations, cite)
+            if reply is not None:
+                return self._cached_response(reply, chunks, citations)
+
+        with timed("llm_completion"):
+            if self.async_client is not None:
+                response = await self.async_client.chat.completions.create(**self.completion_kwargs(messages))
+            else:
+                response = await run_blocking(self.client.chat.completions.create, **self.completion_kwargs(messages))
+        record_usage(response, citations)
         reply = response.choices[0].message.content
+        if cache_entry is not None:
+            store_reply(cache_entry, reply)
+        self.history.append({"role": "assistant", "content": reply})
+
+        return {"reply": reply, "chunks": chunks, "citations": citations, "cached": False}
+
+    def _cached_response(self, reply: str, chunks: str, citations: list[dict]) -> dict:
+        record_usage(None, citations)  # no completion, so no token counts
         self.history.append({"role": "assistant", "content": reply})
+        return {"reply": reply, "chunks": chunks, "citations": citations, "cached": True}
 
-        return {"reply": reply, "chunks": reranked_chunks.strip()}
+    async def astream_response(self, messages: list[dict], citations: list = None):
+        """
+        Streams the completion for messages from build_messages, yielding text deltas as they arrive. The full reply
+        is added to the history and the turn's usage recorded (citations as returned by build_messages) once the
+        stream ends.
+        """
+        parts = []
+        usage_chunk = None  # providers that report usage send it with the last chunk
+        start = time.perf_counter()
+        if self.async_client is not None:
+            stream = await self.async_client.chat.completions.create(**self.completion_kwargs(messages), stream=True)
+            try:
+                async for chunk in stream:
+                    usage_chunk = chunk if getattr(chunk, "usage", None) is not None else usage_chunk
+                    token = chunk.choices[0].delta.content if chunk.choices else None
+                    if token:
+                        if not parts:
+                            observe_stage("llm_first_token", time.perf_counter() - start)
+                        parts.append(token)
+                        yield token
+            finally:
+                # when the SSE client disconnects this generator is closed mid-stream: stop the upstream response too
+                await stream.aclose()
+        else:  # sync client: pull each chunk on the executor
+            stream = iter(await run_blocking(self.client.chat.completions.create, **self.completion_kwargs(messages),
+                                             stream=True))
+            try:
+                while (chunk := await run_blocking(next, stream, None)) is not None:
+                    usage_chunk = chunk if getattr(chunk, "usage", None) is not None else usage_chunk
+                    token = chunk.choices[0].delta.content if chunk.choices else None
+                    if token:
+                        if not parts:
+                            observe_stage("llm_first_token", time.perf_counter() - start)
+                        parts.append(token)
+                        yield token
+            finally:
+                await run_blocking(stream.close)
+        observe_stage("llm_completion", time.perf_counter() - start)
+        record_usage(usage_chunk, citations or [])
+        self.history.append({"role": "assistant", "content": "".join(parts)})
@@ -1,17 +1,31 @@
 from fastapi import FastAPI, Depends, HTTPException, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, PlainTextResponse, JSONResponse
 from pydantic import BaseModel
+import asyncio
+import json
 import os
+import time
 from datetime import datetime
 
-from sqlalchemy.orm import Session
-from sqlalchemy import Select, Join
-from db import initialize_db, get_db, Conversation, Message, Citation, Reaction
+from sqlalchemy.orm import Session, aliased
+from sqlalchemy import Select, Join, and_, or_, func
+from db import initialize_db, get_db, session_scope, increment_reactions, Conversation, Message, Citation, Reaction, \
+    ConversationSummary
 
 from default_values_prompts import bot_2_system, bot_2_persona, bot_2_name, bot_1_system, bot_1_persona, bot_1_name, \
     bot_1_color, bot_2_color
-from together import Together
+from together_client import make_client, make_async_client, UpstreamUnavailable
 from AiA import Bot
+from Util import run_blocking
+from knowledge_base import registry as knowledge_base_registry
+from reaction_buffer import ReactionBuffer
+from prefetcher import TurnPrefetcher
+from prompt_builder import ConversationHistory, load_history, refresh_summary
+from metrics import registry as metrics_registry, timed
+from retrieval import retrieval_cache
+from response_cache import response_cache
+from Util import embedding_cache
 
 if os.path.exists("keys.py"):
     from keys import api_key
@@ -36,10 +50,62 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Together API client
-client = Together(api_key=api_key)
+# Together API clients, the async one serves completions from the async endpoints. Both go through the shared
+# upstream policy (rate limits, in-flight cap, retries, circuit breaker), see together_client.py
+client = make_client(api_key)
+async_client = make_async_client(api_key)
 model_name = "meta-llama/Llama-3.3-70B-Instruct-Turbo"
 
+# Reaction clicks are written through unless REACTION_FLUSH_INTERVAL (seconds) enables the write-behind buffer
+REACTION_FLUSH_INTERVAL = float(os.getenv("REACTION_FLUSH_INTERVAL", 0))
+reaction_buffer = ReactionBuffer(REACTION_FLUSH_INTERVAL) if REACTION_FLUSH_INTERVAL > 0 else None
+
+DEBATE_MAX_TURNS = int(os.getenv("DEBATE_MAX_TURNS", 20))  # upper bound for one /multi-agent-chat/debate request
+
+# PREFETCH_NEXT_TURN=1 generates the other bot's reply in the background as soon as a turn is committed, so the
+# next request for the same topic returns without waiting for the model (at the cost of unclaimed completions)
+prefetcher = TurnPrefetcher(max_pending=int(os.getenv("PREFETCH_MAX_PENDING", 32)),
+                            ttl=float(os.getenv("PREFETCH_TTL", 300))) \
+    if os.getenv("PREFETCH_NEXT_TURN", "0").lower() in ("1", "true", "yes") else None
+
+
+@app.middleware("http")
+async def record_request_latency(request, call_next):
+    start = time.perf_counter()
+    response = await call_next(request)
+    # streaming responses are timed until their headers go out, the stream itself is covered by llm_* stages
+    # labelled by route template, raw paths (scanners, 404s) would each create a series that is never freed
+    route = request.scope.get("route")
+    labels = {"method": request.method, "path": route.path if route is not None else "unmatched",
+              "status": response.status_code}
+    metrics_registry.histogram("http_request_duration_seconds", labels,
+                               help="Request latency per endpoint").observe(time.perf_counter() - start)
+    return response
+
+
+def cache_gauges():
+    gauges = {}
+    for name, stats in (("embedding", embedding_cache.memory.stats()), ("retrieval", retrieval_cache.stats()),
+                        ("response", response_cache.stats())):
+        for key in ("size", "hits", "misses", "evictions"):
+            gauges[(f"cache_{key}", (("cache", name),))] = stats[key]
+    return gauges
+
+
+metrics_registry.add_gauge_callback(cache_gauges)
+if prefetcher is not None:
+    metrics_registry.add_gauge_callback(
+        lambda: {(f"prefetch_{key}", ()): value for key, value in prefetcher.stats().items()})
+
+
+@app.exception_handler(UpstreamUnavailable)
+async def upstream_unavailable_handler(request, exc: UpstreamUnavailable):
+    # an overloaded or failing Together API is a temporary condition for the client, not a server bug
+    print(f"[WARNING] {request.url.path} answered 503: {exc}")
+    headers = {"Retry-After": str(max(1, round(exc.retry_after)))} if exc.retry_after else None
+    return JSONResponse(status_code=503, content={"detail": "The language model service is busy, try again shortly."},
+                        headers=headers)
+
 
 # --------------------------------------- Inputs -------------------------------------------------------------------
 
@@ -50,6 +116,11 @@ class ChatInput(BaseModel):
     conv_name: str | None = None
     bot_1_name: str | None = None
     bot_2_name: str | None = None
+    bypass_cache: bool = False  # always ask the model, even when the response cache has a reply for this topic
+
+
+class DebateInput(ChatInput):
+    turns: int = 4  # replies generated in this request, alternating between the two bots
 
 
 class ReactionInput(BaseModel):
@@ -59,6 +130,9 @@ class ReactionInput(BaseModel):
 
 class ConversationInput(BaseModel):
     conv_id: str
+    before: str | None = None  # message id cursor, page of older messages
+    after: str | None = None  # message id cursor, page of newer messages
+    limit: int | None = None
 
 
 class MessageInput(BaseModel):
@@ -76,11 +150,22 @@ async def startup_event():
     print("FastAPI app starting up. Initializing database...")
     initialize_db()  # Call initialize_db from database.py
     print("Database initialization complete.")
+    if reaction_buffer is not None:
+        reaction_buffer.start()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    if reaction_buffer is not None:
+        reaction_buffer.stop()  # flushes the reactions still in memory
+    if prefetcher is not None:
+        prefetcher.cancel_all()
 
 
 # --------------------------------------- Functions -------------------------------------------------------------------
+@timed("conversation_lookup")
 def get_or_create_conversation(
-        session: Session = get_db(),
+        session: Session,
         conv_id: int = None,
         conv_name: str = 'bot_chat',
         bot_1_name: str = bot_1_name,
@@ -145,39 +230,51 @@ def get_or_create_conversation(
     return new_conversation
 
 
-def recover_messages_from_conversation(conversation: Conversation, get_next_bot=False, get_reacts=False):
-    conn = get_db()
-    info = Select(Message).where(Message.conversation_id == conversation.id)
-    messages = conn.execute(info).scalars().all()
-    messages = sorted(messages, key=lambda msg: msg.created_at, reverse=True)
+def get_last_writer(session: Session, conversation: Conversation) -> str | None:
+    """Writer of the newest message of the conversation, one indexed row instead of the whole history."""
+    info = (Select(Message.writer).where(Message.conversation_id == conversation.id)
+            .order_by(Message.created_at.desc(), Message.id.desc()).limit(1))
+    return session.execute(info).scalar()
 
-    if len(messages) < 1:  # the conversation had no message to recover
-        return {"messages": []}  # nothing to return
-    last_writer_name = messages[0].writer
-    print(f"Last writer detected: {last_writer_name}, finding next one...")
 
-    result = {}
+def _message_cursor(session: Session, message_id: int):
+    return session.execute(Select(Message.created_at, Message.id).where(Message.id == message_id)).first()
 
-    message_result = []
-    color = {True: "#D0F0FD", False: "#C1F0C1"}
-    flag = True
-    message_finder = {}
-    for i, message in enumerate(messages):  # convert message into dict with same structure
-        message_finder[message.id] = i
-        message_result.append({"message_id": message.id, "text": message.message, "bot": message.writer,
-                               "chat_color": color[flag], "reacts": []})
-        flag = not flag
 
-    if get_reacts:
-        info = Select(Reaction).join(Message, Reaction.message_id == Message.id).where(
-            Message.conversation_id == conversation.id)
-        reacts = conn.execute(info).scalars().all()
+def _newer_than(cursor):
+    """Keyset condition on (created_at, id), matching the message ordering and its index."""
+    return or_(Message.created_at > cursor.created_at,
+               and_(Message.created_at == cursor.created_at, Message.id > cursor.id))
+
+
+def _older_than(cursor):
+    return or_(Message.created_at < cursor.created_at,
+               and_(Message.created_at == cursor.created_at, Message.id < cursor.id))
 
-        for react in reacts:  # add the reacts to respective message
-            message_result[message_finder[react.message_id]]['reacts'].append(
-                {"reaction": react.reaction_name, "quantity": react.quantity})
 
+@timed("history_recovery")
+def recover_messages_from_conversation(session: Session, conversation: Conversation, get_next_bot=False,
+                                       get_reacts=False, before: int = None, after: int = None, limit: int = None):
+    """
+    Recovers the messages of a conversation, newest first, optionally one page at a time.
+
+    Args:
+        session: The SQLAlchemy session to use for database operations.
+        conversation: The conversation to read.
+        get_next_bot: also build the bot whose turn is next.
+        get_reacts: attach each message's reactions.
+        before: keyset cursor, only messages older than this message id.
+        after: keyset cursor, only messages newer than this message id.
+        limit: page size, None for the whole (remaining) history.
+
+    Returns:
+        {"messages": [...]} (plus "bot" with get_next_bot). A full page also carries the cursors "next_before", its
+        oldest message id, and "next_after", its newest, to continue in either direction.
+    """
+    result = {}
     if get_next_bot:
+        last_writer_name = get_last_writer(session, conversation)
+        print(f"Last writer detected: {last_writer_name}, finding next one...")
         if last_writer_name == conversation.bot_1_name:
             print(f"Matched bot 1: {conversation.bot_1_name}")
             next_bot = build_bot_from_conversation(conversation, conversation.bot_2_name)
@@ -189,21 +286,95 @@ def recover_messages_from_conversation(conversation: Conversation, get_next_bot=
             next_bot = build_bot_from_conversation(conversation, conversation.bot_1_name)
         print(f"Next bot will be: {next_bot}")
         result['bot'] = next_bot
+
+    info = Select(Message).where(Message.conversation_id == conversation.id)
+    if before is not None and (cursor := _message_cursor(session, before)) is not None:
+        info = info.where(_older_than(cursor))
+    if after is not None and (cursor := _message_cursor(session, after)) is not None:
+        info = info.where(_newer_than(cursor))
+    if after is not None and before is None:
+        # the page closest to the cursor is wanted, so walk forward and flip it back to newest first below
+        info = info.order_by(Message.created_at.asc(), Message.id.asc())
+    else:
+        info = info.order_by(Message.created_at.desc(), Message.id.desc())
+    if limit is not None:
+        info = info.limit(limit)
+    messages = session.execute(info).scalars().all()
+    if after is not None and before is None:
+        messages = list(reversed(messages))
+
+    skipped = 0  # messages newer than the page, keeps the colour alternation stable across pages
+    if (before is not None or after is not None) and messages:
+        skipped = session.execute(Select(func.count(Message.id)).where(
+            Message.conversation_id == conversation.id, _newer_than(messages[0]))).scalar()
+
+    message_result = []
+    color = {True: "#D0F0FD", False: "#C1F0C1"}
+    flag = skipped % 2 == 0
+    message_finder = {}
+    for i, message in enumerate(messages):  # convert message into dict with same structure
+        message_finder[message.id] = i
+        message_result.append({"message_id": message.id, "text": message.message, "bot": message.writer,
+                               "chat_color": color[flag], "reacts": []})
+        flag = not flag
+
+    if get_reacts and message_finder:
+        info = Select(Reaction).where(Reaction.message_id.in_(message_finder.keys()))
+        reacts = session.execute(info).scalars().all()
+
+        for react in reacts:  # add the reacts to respective message
+            message_result[message_finder[react.message_id]]['reacts'].append(
+                {"reaction": react.reaction_name, "quantity": react.quantity})
+
     result['messages'] = message_result
+    if limit is not None and len(messages) == limit:
+        result['next_before'] = messages[-1].id  # cursor for the following (older) page
+        result['next_after'] = messages[0].id  # cursor for the previous (newer) page, when walking forward
     return result
 
 
-def getall_conversations():
-    conn = get_db()
-    info = Select(Conversation)
-    conversations = conn.execute(info).scalars().all()
-    return {"conversations": conversations}
+def list_conversations(session: Session, limit: int = None, offset: int = 0, after: int = None):
+    """
+    One page of conversations with their first topic, message count and last activity, in a single query.
 
+    The page of conversations is picked first and only its messages are aggregated, so the cost follows the page
+    size rather than the total number of messages.
 
-def get_conversation(conversation_id: int):
-    conn = get_db()
+    Args:
+        session: The SQLAlchemy session to use for database operations.
+        limit: page size, None for every conversation.
+        offset: rows to skip, for clients that page by number.
+        after: keyset cursor, only conversations with a higher id (cheaper than offset on deep pages).
+    """
+    page = Select(Conversation.id).order_by(Conversation.id)
+    if after is not None:
+        page = page.where(Conversation.id > after)
+    if offset:
+        page = page.offset(offset)
+    if limit is not None:
+        page = page.limit(limit)
+    page = page.subquery()
+
+    stats = (Select(Message.conversation_id,
+                    func.count(Message.id).label("message_count"),
+                    func.max(Message.created_at).label("last_activity"),
+                    func.min(Message.id).label("first_message_id"))
+             .where(Message.conversation_id.in_(Select(page.c.id)))
+             .group_by(Message.conversation_id)
+             .subquery())
+    first_message = aliased(Message)
+    info = (Select(Conversation.id, Conversation.conversation_name, Conversation.bot_1_name, Conversation.bot_2_name,
+                   first_message.topic, stats.c.message_count, stats.c.last_activity)
+            .join(page, page.c.id == Conversation.id)
+            .outerjoin(stats, stats.c.conversation_id == Conversation.id)
+            .outerjoin(first_message, first_message.id == stats.c.first_message_id)
+            .order_by(Conversation.id))
+    return session.execute(info).all()
+
+
+def get_conversation(session: Session, conversation_id: int):
     info = Select(Conversation).where(Conversation.id == conversation_id)
-    conversations = conn.execute(info).scalars().all()
+    conversations = session.execute(info).scalars().all()
     if len(conversations) == 0:
         return {"Message": "[Error] Conversation not found"}
     elif len(conversations) > 1:
@@ -214,22 +385,25 @@ def get_conversation(conversation_id: int):
     return {"Message": "Retrival successful", "conversation": conv}
 
 
+@timed("db_write")
 def add_response(
+        session: Session,
         conversation_id: int,
         message_content: str,
         writer: str,
         topic: str,
-        citation: str
+        citations: list[dict] = None
 ) -> Message:
     """
-    Adds a new message (response) to the database for a given conversation.
+    Adds a new message (response) and its citations to the database in a single transaction.
 
     Args:
+        session: The SQLAlchemy session to use for database operations.
         conversation_id: The ID of the conversation this message belongs to.
         message_content: The actual text content of the message.
         writer: The name of the bot (or user) who wrote the message.
         topic: The topic associated with this message.
-        citation: the chunk that was cited
+        citations: the chunks that were cited, as {"chunk_id", "score", "rank"} dicts (see Bot.build_messages)
 
     Returns:
         The newly created Message ORM object after it's committed to the DB.
@@ -242,87 +416,78 @@ def add_response(
         topic=topic,
         created_at=datetime.now()  # Use current time for the new message
     )
-    session = get_db()
     session.add(new_message)
+    session.flush()  # assigns the message id without ending the transaction
+    session.add_all([Citation(message_id=new_message.id, chunk_id=c["chunk_id"], score=c["score"], rank=c["rank"])
+                     for c in citations or []])
     session.commit()
-    session.refresh(new_message)  # Get the ID and any default values assigned by DB
-    print(f"Added new message to conversation {conversation_id} by {writer}: {message_content[:50]}...")
-    citation = Citation(message_id=new_message.id, chunk=citation)
-    session = get_db()
-    session.add(citation)
-    session.commit()
-    print(f"Added new citation to conversation {conversation_id}: {citation.chunk[:50]}...")
+    print(f"Added new message to conversation {conversation_id} by {writer} with {len(citations or [])} citations: "
+          f"{message_content[:50]}...")
     return new_message
 
 
+def persist_response(conversation_id: int, message_content: str, writer: str, topic: str,
+                     citations: list[dict] = None) -> Message:
+    """add_response in its own session, for writes that happen after the request's session is gone."""
+    with session_scope() as session:
+        return add_response(session, conversation_id, message_content=message_content, writer=writer, topic=topic,
+                            citations=citations)
+
+
 def build_bot_from_conversation(conversation: Conversation, bot_name=None):
     if (bot_name == conversation.bot_1_name) or (bot_name is None):
         bot = Bot(client=client, name=conversation.bot_1_name, persona_prompt=conversation.bot_1_persona,
-                  chat_color=conversation.bot_1_color, model=model_name)
+                  chat_color=conversation.bot_1_color, model=model_name, async_client=async_client)
     else:
         bot = Bot(client=client, name=conversation.bot_2_name, persona_prompt=conversation.bot_2_persona,
-                  chat_color=conversation.bot_2_color, model=model_name)
+                  chat_color=conversation.bot_2_color, model=model_name, async_client=async_client)
     print(f"New bot constructed to reply: {bot.name}")
     return bot
 
 
-def react_emoji(message: Message.id, emoji):
-    emoji_exist = False
-    conn = get_db()
-    info = Select(Reaction).where(Reaction.message_id == message).where(Reaction.reaction_name == emoji)
-    reacts = conn.execute(info).scalars().all()
-
-    if len(reacts) == 1:
-        emoji_exist = True
-    elif len(reacts) != 0:
-        print(
-            f"[WARNING] More than one log of reaction {emoji} found in message with id {message}, skipping reaction...")
-
-    edited_reaction = None
-    if emoji_exist:
-        react = reacts[0]
-        react.quantity += 1
-        conn.commit()
-        print(f"Added +1 reaction to reaction {react.id}: {emoji}...")
-        edited_reaction = react
-    else:
-        new_reaction = Reaction(
-            message_id=message,
-            reaction_name=emoji,
-            quantity=1,
-            created_at=datetime.now()  # Use current time for the new reaction
-        )
-        session = get_db()
-        session.add(new_reaction)
-        session.commit()
-        session.refresh(new_reaction)
-        print(f"Added new reaction to message {message}: {emoji}...")
-        edited_reaction = new_reaction
-    return edited_reaction
+def react_emoji(session: Session, message: Message.id, emoji):
+    """
+    Adds one to the emoji counter of a message. Goes through the write-behind buffer when it is enabled, otherwise
+    it is a single atomic upsert.
+    """
+    # checked up front: a buffered delta for a missing message would only fail its foreign key at flush time
+    if session.get(Message, int(message)) is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Message {message} not found")
+    if reaction_buffer is not None:
+        reaction_buffer.add(int(message), emoji)
+        return
+    increment_reactions(session, {(int(message), emoji): 1})
+    session.commit()
+    print(f"Added +1 reaction to message {message}: {emoji}...")
 
 
-def get_emojis(message: Message.id):
-    conn = get_db()
+def get_emojis(session: Session, message: Message.id):
     info = Select(Reaction).where(Reaction.message_id == message)
-    reacts = conn.execute(info).scalars().all()
+    reacts = session.execute(info).scalars().all()
 
     return reacts
 
 
-def remove_message(message_id: int):
+def remove_message(session: Session, message_id: int):
     """
     Removes a message
     If the message exists, it is deleted from the database.
     If it doesn't exist, nothing happens.
     """
-    conn = get_db()
+    if reaction_buffer is not None:
+        reaction_buffer.discard(message_id)
     info = Select(Message).where(Message.id == message_id)
-    messages = conn.execute(info).scalars().all()
+    messages = session.execute(info).scalars().all()
 
     if len(messages) == 1:
         message = messages[0]
-        conn.delete(message)
-        conn.commit()
+        if prefetcher is not None:
+            prefetcher.cancel(message.conversation_id)  # it was generated for the conversation with this message
+        summary = session.get(ConversationSummary, message.conversation_id)
+        if summary is not None and message.id <= summary.covered_message_id:
+            session.delete(summary)  # it still tells the deleted message, rebuilt from the remaining ones
+        session.delete(message)
+        session.commit()
         print(f"Deleted message {message}")
         return {"status": "deleted", "message_id": message_id}
     elif len(messages) > 1:
@@ -333,20 +498,21 @@ def remove_message(message_id: int):
         return {"status": "not_found"}
 
 
-def remove_emoji_reaction(message_id: int, emoji: str):
+def remove_emoji_reaction(session: Session, message_id: int, emoji: str):
     """
     Removes an emoji reaction from a specific message.
     If the reaction exists, it is deleted from the database.
     If it doesn't exist, nothing happens.
     """
-    conn = get_db()
+    if reaction_buffer is not None:
+        reaction_buffer.discard(message_id, emoji)
     info = Select(Reaction).where(Reaction.message_id == message_id).where(Reaction.reaction_name == emoji)
-    reacts = conn.execute(info).scalars().all()
+    reacts = session.execute(info).scalars().all()
 
     if len(reacts) == 1:
         react = reacts[0]
-        conn.delete(react)
-        conn.commit()
+        session.delete(react)
+        session.commit()
         print(f"Deleted reaction {emoji} from message {message_id}")
         return {"status": "deleted", "reaction_id": react.id}
     elif len(reacts) > 1:
@@ -357,38 +523,48 @@ def remove_emoji_reaction(message_id: int, emoji: str):
         return {"status": "not_found"}
 
 
-def clear_emojis(message_id: int):
+def clear_emojis(session: Session, message_id: int):
     """
     Removes all emojis reaction from a specific message.
     """
-    conn = get_db()
+    if reaction_buffer is not None:
+        reaction_buffer.discard(message_id)
     info = Select(Reaction).where(Reaction.message_id == message_id)
-    reacts = conn.execute(info).scalars().all()
+    reacts = session.execute(info).scalars().all()
     for react in reacts:
-        conn.delete(react)
-    conn.commit()
+        session.delete(react)
+    session.commit()
 
     return {"status": "deleted"}
 
 
-# --------------------------------------- Endpoints -------------------------------------------------------------------
-@app.post("/multi-agent-chat")
-async def multi_agent_chat(input_data: ChatInput):
-    print("New MAAC request:")
-    print(input_data)
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def prepare_turn(session: Session, input_data: ChatInput):
+    """
+    Finds or creates the conversation of a chat request and builds the bot whose turn it is.
+
+    Returns:
+        (conversation, previous messages, next bot)
+    """
     conversation_id = input_data.session_id
     if (conversation_id == 'None') or (conversation_id == 'undefined'):
         conversation_id = None
     if conversation_id is not None:
         conversation_id = int(conversation_id)
 
-    conversation = get_or_create_conversation(conv_id=conversation_id,
-                                              conv_name=input_data.conv_name,
-                                              bot_1_name=input_data.bot_1_name,
-                                              bot_2_name=input_data.bot_2_name)
+    # database work is synchronous, run it on the executor and keep the event loop free for other conversations
+    conversation = await run_blocking(get_or_create_conversation,
+                                      session=session,
+                                      conv_id=conversation_id,
+                                      conv_name=input_data.conv_name,
+                                      bot_1_name=input_data.bot_1_name,
+                                      bot_2_name=input_data.bot_2_name)
     if conversation.id == conversation_id:
         print("Conversation matched, recovering previous messages...")
-        aux = recover_messages_from_conversation(conversation, get_next_bot=True)
+        aux = await run_blocking(recover_messages_from_conversation, session, conversation, get_next_bot=True)
     else:
         if conversation_id is None:
             print(
@@ -397,15 +573,69 @@ async def multi_agent_chat(input_data: ChatInput):
             print(
                 f"Conversation {conversation.id} not matched with {conversation_id}, falling back to new conversation... ")
         aux = {"messages": [], "bot": build_bot_from_conversation(conversation, conversation.bot_1_name)}
-    messages = aux['messages']
-    next_bot = aux['bot']
-    topic = input_data.topic
-    cite = input_data.cite
-    response = next_bot.generate_response(subject=topic, cite=cite)
-    reply_response = response['reply']
-    chunks = response['chunks']
-    new_message = add_response(int(conversation.id), message_content=reply_response, writer=next_bot.name, topic=topic,
-                               citation=chunks)
+    # the last turns verbatim and a summary of the older ones, trimmed to the context budget by the bot
+    aux['bot'].conversation_history = await run_blocking(load_history, session, conversation.id)
+    return conversation, aux['messages'], aux['bot']
+
+
+async def claim_prefetched_turn(conversation: Conversation, messages: list[dict], next_bot: Bot,
+                                input_data: ChatInput):
+    """The turn the prefetcher generated for this request, or None to generate it now."""
+    if prefetcher is None:
+        return None
+    last_message_id = messages[0]['message_id'] if messages else None  # messages are newest first
+    return await prefetcher.claim(conversation.id, last_message_id, input_data.topic, input_data.cite,
+                                  next_bot.name)
+
+
+def prefetch_following_turn(conversation: Conversation, message: Message, bot: Bot, input_data: ChatInput):
+    """Starts the other bot's reply to message in the background, called once message is committed."""
+    if prefetcher is None:
+        return
+    following = conversation.bot_2_name if bot.name == conversation.bot_1_name else conversation.bot_1_name
+    following_bot = build_bot_from_conversation(conversation, following)
+    following_bot.conversation_history = (bot.conversation_history or ConversationHistory()).appended(
+        message.id, bot.name, message.message)
+    prefetcher.schedule(conversation.id, message.id, input_data.topic, input_data.cite, following_bot)
+
+
+_summary_tasks = set()  # strong references, the event loop only keeps weak ones to running tasks
+
+
+def schedule_summary_refresh(conversation_id: int):
+    """Folds older turns into the conversation's summary in the background, called once a turn is committed."""
+    task = asyncio.get_running_loop().create_task(
+        run_blocking(refresh_summary, client, model_name, conversation_id))
+    _summary_tasks.add(task)
+    task.add_done_callback(_summary_refreshed)
+
+
+def _summary_refreshed(task):
+    _summary_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        print(f"[WARNING] Refreshing a conversation summary failed: {task.exception()}")
+
+
+# --------------------------------------- Endpoints -------------------------------------------------------------------
+@app.post("/multi-agent-chat")
+async def multi_agent_chat(input_data: ChatInput, session: Session = Depends(get_db)):
+    print("New MAAC request:")
+    print(input_data)
+    with timed("turn"):
+        conversation, messages, next_bot = await prepare_turn(session, input_data)
+        topic = input_data.topic
+        cite = input_data.cite
+        response = await claim_prefetched_turn(conversation, messages, next_bot, input_data)
+        prefetched = response is not None
+        if not prefetched:
+            # a cached reply cannot follow up on earlier turns, so only a conversation's opening turn uses the cache
+            response = await next_bot.agenerate_response(subject=topic, cite=cite,
+                                                          use_cache=not messages and not input_data.bypass_cache)
+        reply_response = response['reply']
+        new_message = await run_blocking(add_response, session, int(conversation.id), message_content=reply_response,
+                                         writer=next_bot.name, topic=topic, citations=response['citations'])
+    prefetch_following_turn(conversation, new_message, next_bot, input_data)
+    schedule_summary_refresh(conversation.id)
 
     history = [
         {"name": msg['bot'], "content": msg['text'], "message_id": msg['message_id']}
@@ -418,83 +648,224 @@ async def multi_agent_chat(input_data: ChatInput):
         "text": reply_response,
         "message_id": new_message.id,
         "full_conversation": history,
-        "chat_color": next_bot.chat_color
+        "chat_color": next_bot.chat_color,
+        "cached": response['cached'],
+        "prefetched": prefetched
     }
 
 
+@app.post("/multi-agent-chat/stream")
+async def multi_agent_chat_stream(input_data: ChatInput, session: Session = Depends(get_db)):
+    """
+    Same turn as /multi-agent-chat, sent as server-sent events: a "start" event with the replying bot, one "token"
+    event per completion delta, then a "done" event carrying message_id, citations and chat_color once the message
+    is committed.
+    """
+    print("New streaming MAAC request:")
+    print(input_data)
+    turn_start = time.perf_counter()  # the "turn" stage runs until the reply is committed, as in /multi-agent-chat
+    conversation, messages, next_bot = await prepare_turn(session, input_data)
+    topic = input_data.topic
+    prefetched = await claim_prefetched_turn(conversation, messages, next_bot, input_data)
+    if prefetched is None:
+        prompt, _, citations = await run_blocking(next_bot.build_messages, subject=topic, cite=input_data.cite)
+    else:
+        citations = prefetched['citations']
+
+    async def events():
+        yield sse_event("start", {"conversation_id": conversation.id, "bot": next_bot.name,
+                                  "chat_color": next_bot.chat_color})
+        parts = []
+        failure = "completion failed"
+        try:
+            with timed("turn", start=turn_start):
+                if prefetched is not None:  # already complete, sent as a single delta
+                    parts.append(prefetched['reply'])
+                    yield sse_event("token", {"text": prefetched['reply']})
+                else:
+                    async for token in next_bot.astream_response(prompt, citations=citations):
+                        parts.append(token)
+                        yield sse_event("token", {"text": token})
+                reply_response = "".join(parts)
+                # the client already has the text, it must still learn when the reply could not be saved
+                failure = "saving the reply failed"
+                new_message = await run_blocking(persist_response, int(conversation.id),
+                                                 message_content=reply_response, writer=next_bot.name, topic=topic,
+                                                 citations=citations)
+        except Exception as e:
+            print(f"[WARNING] Streaming turn failed for conversation {conversation.id} ({failure}): {e}")
+            yield sse_event("error", {"message": failure})
+            return
+        prefetch_following_turn(conversation, new_message, next_bot, input_data)
+        schedule_summary_refresh(conversation.id)
+        yield sse_event("done", {
+            "conversation_id": conversation.id,
+            "bot": next_bot.name,
+            "text": reply_response,
+            "message_id": new_message.id,
+            "citations": citations,
+            "full_conversation": [{"name": msg['bot'], "content": msg['text'], "message_id": msg['message_id']}
+                                  for msg in messages],
+            "chat_color": next_bot.chat_color
+        })
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.post("/multi-agent-chat/debate")
+async def multi_agent_debate(input_data: DebateInput, session: Session = Depends(get_db)):
+    """
+    Runs `turns` alternating turns of a conversation in one request, sent as server-sent events: "start", one
+    "turn" event per committed reply (same fields as /multi-agent-chat plus its citations and index), then "done"
+    with the new message ids. The conversation, both bots, their knowledge bases and one database session are set
+    up once for the whole debate instead of once per turn.
+    """
+    print("New MAAC debate request:")
+    print(input_data)
+    if not 1 <= input_data.turns <= DEBATE_MAX_TURNS:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                            detail=f"turns must be between 1 and {DEBATE_MAX_TURNS}")
+    conversation, messages, next_bot = await prepare_turn(session, input_data)
+    following = conversation.bot_2_name if next_bot.name == conversation.bot_1_name else conversation.bot_1_name
+    bots = [next_bot, build_bot_from_conversation(conversation, following)]
+    topic = input_data.topic
+    cite = input_data.cite
+    prefetched = await claim_prefetched_turn(conversation, messages, next_bot, input_data)
+    history = next_bot.conversation_history  # grows with every committed turn, no reload in between
+
+    async def events():
+        nonlocal history
+        yield sse_event("start", {"conversation_id": conversation.id, "turns": input_data.turns,
+                                  "bots": [bot.name for bot in bots]})
+        message_ids = []
+        # the request's session is closed once the response starts, the debate keeps its own for every turn
+        with session_scope() as debate_session:
+            for turn in range(input_data.turns):
+                bot = bots[turn % 2]
+                bot.clean_history()  # same prompt as a /multi-agent-chat turn, the bots only live longer
+                bot.conversation_history = history
+                try:
+                    with timed("turn"):
+                        if turn == 0 and prefetched is not None:
+                            response = prefetched
+                        else:
+                            opening = turn == 0 and not messages and not input_data.bypass_cache
+                            response = await bot.agenerate_response(subject=topic, cite=cite, use_cache=opening)
+                        new_message = await run_blocking(add_response, debate_session, int(conversation.id),
+                                                         message_content=response['reply'], writer=bot.name,
+                                                         topic=topic, citations=response['citations'])
+                except Exception as e:
+                    print(f"[WARNING] Debate turn {turn} failed for conversation {conversation.id}: {e}")
+                    # earlier turns are committed already, a failed flush or commit must not fail the scope's exit
+                    await run_blocking(debate_session.rollback)
+                    yield sse_event("error", {"message": "turn failed", "turn": turn, "message_ids": message_ids})
+                    return
+                message_ids.append(new_message.id)
+                history = history.appended(new_message.id, bot.name, response['reply'])
+                yield sse_event("turn", {
+                    "conversation_id": conversation.id,
+                    "turn": turn,
+                    "bot": bot.name,
+                    "text": response['reply'],
+                    "message_id": new_message.id,
+                    "citations": response['citations'],
+                    "chat_color": bot.chat_color
+                })
+        prefetch_following_turn(conversation, new_message, bot, input_data)
+        schedule_summary_refresh(conversation.id)
+        yield sse_event("done", {"conversation_id": conversation.id, "message_ids": message_ids})
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
 @app.post("/react")
-async def reaction(input_data: ReactionInput):
+def reaction(input_data: ReactionInput, session: Session = Depends(get_db)):
     message_id = input_data.message_id
     emoji = input_data.emoji
-    react_emoji(message_id, emoji)
+    react_emoji(session, message_id, emoji)
 
     return {"message": "reaction logged :)"}
 
 
 @app.get("/react")
-async def reaction(input_data: ConversationInput):
+def reaction(input_data: ConversationInput, session: Session = Depends(get_db)):
     cov_id = input_data.covnersation_id
-    reacts = get_emojis(cov_id)
+    reacts = get_emojis(session, cov_id)
 
     return reacts
 
 
 @app.delete("/react")
-async def reaction(input_data: ReactionInput):
+def reaction(input_data: ReactionInput, session: Session = Depends(get_db)):
     message_id = input_data.message_id
     emoji = input_data.emoji
     if emoji is None:
         return {"message": "[WARNING] No Emoji selected for deletion, did you mean /clearreacts?"}
-    remove_emoji_reaction(int(message_id), emoji)
+    remove_emoji_reaction(session, int(message_id), emoji)
     return {"message": "reaction deleted"}
 
 
 @app.delete("/clearreacts")
-async def reaction(input_data: ReactionInput):
+def reaction(input_data: ReactionInput, session: Session = Depends(get_db)):
     message_id = input_data.message_id
-    clear_emojis(int(message_id))
+    clear_emojis(session, int(message_id))
     return {"message": "reaction deleted"}
 
 
 @app.delete("/message")
-async def del_message(input_data: MessageInput):
+def del_message(input_data: MessageInput, session: Session = Depends(get_db)):
     response = {}
 
     message_id = int(input_data.message_id)
-    remove_message(int(message_id))
+    remove_message(session, int(message_id))
 
     response['message'] = 'message deleted'
     return response
 
 
 @app.get("/conversations")
-async def conversations():
-    convs = getall_conversations()['conversations']
+def conversations(limit: int | None = None, offset: int = 0, after: int | None = None,
+                  session: Session = Depends(get_db)):
+    rows = list_conversations(session, limit=limit, offset=offset, after=after)
     response = {"conversations": []}
-    for conv in convs:
-        _id = conv.id
-        _name = conv.conversation_name
-        _bot1 = conv.bot_1_name
-        _bot2 = conv.bot_2_name
-        _messages = conv.messages
-        _topic = ""
-        if _messages:
-            _topic = _messages[0].topic
-        c = {"id": _id, "name": _name, "bot1": _bot1, "bot2": _bot2, "Topic": _topic}
+    for row in rows:
+        c = {"id": row.id, "name": row.conversation_name, "bot1": row.bot_1_name, "bot2": row.bot_2_name,
+             "Topic": row.topic or "", "message_count": row.message_count or 0,
+             "last_activity": row.last_activity}
         response['conversations'].append(c)
+    if limit is not None and len(rows) == limit:
+        response['next_after'] = rows[-1].id  # cursor for the following page
     return response
 
 
 @app.post("/conversation")
-async def conversation(input_data: ConversationInput):
-    conv = get_conversation(conversation_id=int(input_data.conv_id))
+def conversation(input_data: ConversationInput, session: Session = Depends(get_db)):
+    conv = get_conversation(session, conversation_id=int(input_data.conv_id))
     if "conversation" in conv.keys():
         print(conv['Message'])
         conv = conv['conversation']
-        return recover_messages_from_conversation(conv, get_reacts=True)
+        return recover_messages_from_conversation(session, conv, get_reacts=True,
+                                                  before=int(input_data.before) if input_data.before else None,
+                                                  after=int(input_data.after) if input_data.after else None,
+                                                  limit=input_data.limit)
     else:
         return conv['Message']
 
 
-# recover_messages_from_conversation(Conversation(id=40), get_reacts=True)
+@app.get("/metrics")
+def metrics():
+    """Per-stage latency histograms, per-turn token/chunk counts and cache gauges, Prometheus text format."""
+    return PlainTextResponse(metrics_registry.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.post("/admin/reload-knowledge")
+async def reload_knowledge():
+    loaded = knowledge_base_registry.loaded()
+    knowledge_base_registry.invalidate()
+    return {"message": "knowledge bases will be reloaded on next use", "invalidated": loaded}
+
+
+# recover_messages_from_conversation(next(get_db()), Conversation(id=40), get_reacts=True)
 print("System started...")
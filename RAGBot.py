@@ -1,33 +1,78 @@
-from together import Together
-from chromadb import Client
 import json
+import os
+
+from together import Together
+from chromadb import PersistentClient
+
+from ingest_manifest import file_hash
+
+CHROMA_PATH = os.getenv("CHROMA_PATH", "RAG-chroma")  # where the collections persist between runs
+CHROMA_BATCH_SIZE = int(os.getenv("CHROMA_BATCH_SIZE", 5000))  # records upserted per call
+EMBED_BATCH_SIZE = 64  # texts per embedding request, for records stored without an embedding
 
 
 class RAGBot:
-    def __init__(self, name: str, persona: str, vector_path: str, model_name: str, api_key: str):
+    def __init__(self, name: str, persona: str, vector_path: str, model_name: str, api_key: str,
+                 chroma_path: str = CHROMA_PATH):
         self.name = name
         self.persona = persona
         self.model_name = model_name
         self.client = Together(api_key=api_key)
-        self.db = Client()
-        self.collection = self.db.create_collection(name)
+        self.db = PersistentClient(path=chroma_path)
+        self.collection = self.db.get_or_create_collection(name)
+        self.load(vector_path)
 
-        # Load and index the vector data
+    def load(self, vector_path: str, batch_size: int = CHROMA_BATCH_SIZE):
+        """
+        Indexes the vector data, unless the collection already holds this exact file: its hash is kept in the
+        collection metadata once a load completes. Records are upserted in batches and the ids the file no longer
+        has are deleted, so a changed file updates the collection in place.
+
+        Args:
+            vector_path: JSONL of {"id", "title", "chunk", "embedding"} records, missing embeddings are computed.
+            batch_size: records per upsert, capped by what the chromadb server accepts.
+        """
+        source_hash = file_hash(vector_path)
+        if (self.collection.metadata or {}).get("source_hash") == source_hash:
+            print(f"Collection {self.name} already holds {vector_path}, {self.collection.count()} chunks")
+            return
+        if hasattr(self.db, "get_max_batch_size"):
+            batch_size = min(batch_size, self.db.get_max_batch_size())
+
+        ids = set()
+        batch = []
         with open(vector_path, "r", encoding="utf-8") as f:
             for line in f:
+                if not line.strip():
+                    continue
                 doc = json.loads(line)
-                chunk = doc["chunk"]
-                embedding = doc.get("embedding")
-
-                if not embedding:
-                    embedding = self.embed([chunk])[0]
-
-                self.collection.add(
-                    documents=[chunk],
-                    metadatas=[{"title": doc["title"], "source": doc["id"]}],
-                    ids=[doc["id"]],
-                    embeddings=[embedding]
-                )
+                ids.add(doc["id"])
+                batch.append(doc)
+                if len(batch) >= batch_size:
+                    self._upsert(batch)
+                    batch = []
+        if batch:
+            self._upsert(batch)
+
+        stale = [i for i in self.collection.get(include=[])["ids"] if i not in ids]
+        for start in range(0, len(stale), batch_size):
+            self.collection.delete(ids=stale[start:start + batch_size])
+        self.collection.modify(metadata={"source_hash": source_hash, "source_path": vector_path})
+        print(f"Loaded {len(ids)} chunks from {vector_path} into collection {self.name}"
+              + (f", removed {len(stale)} stale ones" if stale else ""))
+
+    def _upsert(self, docs: list[dict]):
+        missing = [i for i, doc in enumerate(docs) if not doc.get("embedding")]
+        for start in range(0, len(missing), EMBED_BATCH_SIZE):
+            todo = missing[start:start + EMBED_BATCH_SIZE]
+            for i, embedding in zip(todo, self.embed([docs[i]["chunk"] for i in todo])):
+                docs[i]["embedding"] = embedding
+        self.collection.upsert(
+            documents=[doc["chunk"] for doc in docs],
+            metadatas=[{"title": doc["title"], "source": doc["id"]} for doc in docs],
+            ids=[doc["id"] for doc in docs],
+            embeddings=[doc["embedding"] for doc in docs]
+        )
 
     def embed(self, texts):
         result = self.client.embeddings.create(
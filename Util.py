@@ -1,33 +1,66 @@
-from together import Together
 from typing import List
-from keys import api_key
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import asyncio
 import numpy as np
+import random
 from time import sleep
 from tqdm import tqdm
+from embedding_store import save_embedding_store
+from vector_index import VectorIndex, BruteForceIndex, build_index
+from cache import EmbeddingCache
+from metrics import timed
+from together_client import make_client, is_retryable
 import json
 import os
 
+# Blocking work (sync API clients, SQLAlchemy) called from async endpoints runs here so it cannot stall the event
+# loop, and the pool size bounds how many of those calls a single worker makes at once
+blocking_executor = ThreadPoolExecutor(max_workers=int(os.getenv("BLOCKING_WORKERS", 32)),
+                                       thread_name_prefix="blocking")
 
-def vector_retreival(client, query: str, top_k: int = 5, vector_index: np.ndarray = None) -> List[int]:
+
+async def run_blocking(func, *args, **kwargs):
+    """Awaits func(*args, **kwargs) on blocking_executor."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(blocking_executor, partial(func, *args, **kwargs))
+
+
+EMBEDDING_MODEL = 'BAAI/bge-large-en-v1.5'  # the knowledge bases are embedded with it, queries have to match
+
+# Query embeddings are cached by (model, normalized text): a conversation's topic is the same on every turn
+embedding_cache = EmbeddingCache(
+    maxsize=int(os.getenv("EMBEDDING_CACHE_SIZE", 4096)),
+    ttl=float(os.getenv("EMBEDDING_CACHE_TTL")) if os.getenv("EMBEDDING_CACHE_TTL") else None,
+    path=os.getenv("EMBEDDING_CACHE_PATH"),  # sqlite file, leave unset for memory only
+)
+
+
+def vector_retreival(client, query: str, top_k: int = 5, vector_index: VectorIndex | np.ndarray = None) -> List[int]:
     """
     Retrieve the top-k most similar items from an index based on a query.
     Args:
         client : client api object
         query (str): The query string to search for.
         top_k (int, optional): The number of top similar items to retrieve. Defaults to 5.
-        vector_index (np.ndarray, optional): The index array containing embeddings to search against. Defaults to None.
+        vector_index (VectorIndex | np.ndarray, optional): The index to search against. A raw embedding matrix is
+            wrapped in a brute force index on every call, prefer passing a prebuilt VectorIndex. Defaults to None.
     Returns:
         List[int]: A list of indices corresponding to the top-k most similar items in the index.
     """
 
-    query_embedding = np.array(generate_embeddings(client, [query], 'BAAI/bge-large-en-v1.5')[0])
+    with timed("query_embedding"):
+        query_embedding = np.array(generate_embeddings(client, [query], EMBEDDING_MODEL)[0])
 
-    similarity_scores = np.dot(query_embedding, vector_index.T)
+    with timed("vector_search"):
+        if not isinstance(vector_index, VectorIndex):
+            vector_index = BruteForceIndex(vector_index)
 
-    return list(np.argsort(-similarity_scores)[:top_k])
+        return vector_index.search_one(query_embedding, top_k=top_k)
 
 
-def rerank(client, query: str, chunks: List[str], top_k=3) -> List[int]:
+@timed("rerank")
+def rerank_with_scores(client, query: str, chunks: List[str], top_k=3) -> List[tuple[int, float]]:
     response = client.rerank.create(
         model="Salesforce/Llama-Rank-V1",
         query=query,
@@ -35,40 +68,106 @@ def rerank(client, query: str, chunks: List[str], top_k=3) -> List[int]:
         top_n=top_k
     )
 
-    return [result.index for result in response.results]
+    return [(result.index, result.relevance_score) for result in response.results]
+
+
+def rerank(client, query: str, chunks: List[str], top_k=3) -> List[int]:
+    return [index for index, _ in rerank_with_scores(client, query=query, chunks=chunks, top_k=top_k)]
 
 
 def create_chunks(document, chunk_size=300, overlap=50):
     return [document[i: i + chunk_size] for i in range(0, len(document), chunk_size - overlap)]
 
 
-def generate_embeddings(client, input_texts: List[str], model_api_string: str) -> np.ndarray:
+def generate_embeddings(client, input_texts: List[str], model_api_string: str, use_cache: bool = True) -> np.ndarray:
     """Generate embeddings from Together python library.
 
     Args:
         client : client api object
         input_texts: a list of string input texts.
         model_api_string: str. An API string for a specific embedding model of your choice.
+        use_cache: serve repeated texts from embedding_cache and only send the misses to the API.
 
     Returns:
         embeddings_list: a list of embeddings. Each element corresponds to the each input text.
     """
-    outputs = client.embeddings.create(
-        input=input_texts,
-        model=model_api_string,
-    )
-    return np.array([x.embedding for x in outputs.data])
+    if not use_cache:
+        outputs = client.embeddings.create(
+            input=input_texts,
+            model=model_api_string,
+        )
+        return np.array([x.embedding for x in outputs.data])
+
+    embeddings = [embedding_cache.get(model_api_string, text) for text in input_texts]
+    missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+    if missing:
+        outputs = client.embeddings.create(
+            input=[input_texts[i] for i in missing],
+            model=model_api_string,
+        )
+        for i, x in zip(missing, outputs.data):
+            embeddings[i] = np.array(x.embedding, dtype=np.float32)
+            embedding_cache.set(model_api_string, input_texts[i], embeddings[i])
+    return np.array(embeddings)
+
+
+def embed_with_retry(client, input_texts: List[str], model_api_string: str, retries: int = 5,
+                     backoff: float = 1.0) -> np.ndarray:
+    """
+    generate_embeddings for one batch, retried with exponential backoff and jitter on 429s, 5xx and transport
+    errors (see together_client.is_retryable). Other errors, e.g. auth or a bad input, are raised at once, and so
+    is UpstreamUnavailable: a make_client client already spent its own retries on the batch.
+    """
+    for attempt in range(retries + 1):
+        try:
+            return generate_embeddings(client, input_texts, model_api_string, use_cache=False)
+        except Exception as e:
+            if attempt == retries or not is_retryable(e):
+                raise
+            delay = backoff * 2 ** attempt * (0.5 + random.random())
+            print(f"[WARNING] Embedding batch of {len(input_texts)} failed ({e}), retrying in {delay:.1f}s...")
+            sleep(delay)
+
+
+def embed_in_batches(client, input_texts: List[str], model_api_string: str, batch_size: int = 64,
+                     workers: int = 4, retries: int = 5, on_batch=None) -> np.ndarray:
+    """
+    Embeds a large list of texts with batch_size texts per request and at most `workers` requests in flight.
+
+    Args:
+        on_batch: optional callback(start, embeddings) called as each batch completes, e.g. to checkpoint.
+
+    Returns:
+        one embedding per input text, in input order.
+    """
+    starts = list(range(0, len(input_texts), batch_size))
+    results = [None] * len(starts)
+
+    def run(n):
+        embeddings = embed_with_retry(client, input_texts[starts[n]:starts[n] + batch_size], model_api_string,
+                                      retries=retries)
+        if on_batch:
+            on_batch(starts[n], embeddings)
+        return embeddings
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(run, n): n for n in range(len(starts))}
+        for future in tqdm(futures, total=len(futures)):
+            results[futures[future]] = future.result()
+    return np.concatenate(results) if results else np.empty((0, 0))
 
 
-def load_and_embed_jsonl(paths: list[str], embedding_model="BAAI/bge-large-en-v1.5"):
+def load_and_embed_jsonl(paths: list[str], embedding_model=EMBEDDING_MODEL, client=None,
+                         batch_size: int = 64, workers: int = 4):
     enriched = []
     for path in paths:
         with open(path, "r", encoding="utf-8") as f:
-            for line in tqdm(f.readlines()):
-                json_line = json.loads(line)
-                embedding = generate_embeddings(client,[json_line["chunk"]], embedding_model)[0]
-                json_line["embedding"] = embedding.tolist()
-                enriched.append(json_line)
+            enriched.extend(json.loads(line) for line in f if line.strip())
+
+    embeddings = embed_in_batches(client, [d["chunk"] for d in enriched], embedding_model,
+                                  batch_size=batch_size, workers=workers)
+    for json_line, embedding in zip(enriched, embeddings):
+        json_line["embedding"] = embedding.tolist()
 
     return enriched
 
@@ -91,9 +190,14 @@ def load_embeddings(path):
 # EXAMPLE USAGE
 
 if __name__ == "__main__":
+    if os.path.exists("keys.py"):
+        from keys import api_key
+    else:
+        api_key = os.environ['API_KEY']
+
     year = '2024'
 
-    client = Together(api_key=api_key)
+    client = make_client(api_key)
 
     if year == '2024':
         subject = 'the arrival of the generative AI and the effects on journalist'
@@ -104,16 +208,17 @@ if __name__ == "__main__":
     query = f"What did people think of the {subject} in {year}?"
 
     if not os.path.exists(embedding_output):
-        data = load_and_embed_jsonl(jsonl_path)
+        data = load_and_embed_jsonl(jsonl_path, client=client)
         save_embedded_jsonl(embedding_output, data)
+        save_embedding_store(embedding_output, data)
     else:
         data = load_embeddings(embedding_output)
 
     print("---------------- testing the RAG -----------------------------------------")
     chunks = [d["chunk"] for d in data]
-    embeddings = np.array([d["embedding"] for d in data])
+    index = build_index(np.array([d["embedding"] for d in data], dtype=np.float32))
 
-    top_k_indices = vector_retreival(query=query, top_k=6, vector_index=embeddings, client=client)
+    top_k_indices = vector_retreival(query=query, top_k=6, vector_index=index, client=client)
     top_k_chunks = [chunks[i] for i in top_k_indices]
 
     reranked_indices = rerank(query=query, chunks=top_k_chunks, top_k=4, client=client)
@@ -0,0 +1,139 @@
+import asyncio
+import hashlib
+import time
+from types import SimpleNamespace
+
+import numpy as np
+
+# seconds per call, roughly what the hosted endpoints take from a nearby region
+DEFAULT_LATENCY = {
+    "embeddings": 0.03,
+    "rerank": 0.08,
+    "completion": 0.4,  # time to first token when streaming
+    "token": 0.005,  # between streamed tokens
+}
+
+
+def _seed(*parts: str) -> int:
+    return int.from_bytes(hashlib.sha1("\n".join(parts).encode("utf-8")).digest()[:8], "little")
+
+
+def fake_embedding(model: str, text: str, dim: int = 1024) -> list[float]:
+    """Unit vector that only depends on (model, text), so runs are reproducible and repeated texts embed the same."""
+    vector = np.random.default_rng(_seed(model, " ".join(text.split()))).standard_normal(dim)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+def fake_relevance(query: str, document: str) -> float:
+    """Word overlap between query and document, with a tiny hash-based tie breaker."""
+    query_words = set(query.lower().split())
+    document_words = set(document.lower().split())
+    overlap = len(query_words & document_words) / max(1, len(query_words))
+    return 0.9 * overlap + 0.1 * (_seed(query, document) % 1000) / 1000
+
+
+def fake_reply(model: str, messages: list, max_tokens: int = 64) -> str:
+    rng = np.random.default_rng(_seed(model, *(str(m.get("content", "")) for m in messages)))
+    words = ["the", "paper", "reported", "that", "readers", "and", "critics", "argued", "about", "technology",
+             "news", "in", "a", "changing", "world", "while", "editors", "wrote", "on", "trust"]
+    return " ".join(rng.choice(words, size=min(max_tokens, 48)))
+
+
+class FakeTogether:
+    """
+    Offline stand-in for together.Together with the surface this repo uses: embeddings.create, rerank.create and
+    chat.completions.create (plain and stream=True). Outputs are deterministic and every call sleeps for the
+    configured latency, so benchmarks measure our own overhead on top of a predictable API.
+
+    Args:
+        latency: per endpoint seconds, overrides DEFAULT_LATENCY.
+        latency_scale: multiplies every latency, 0 for a zero-latency client.
+        dim: embedding dimension.
+    """
+
+    def __init__(self, latency: dict = None, latency_scale: float = 1.0, dim: int = 1024):
+        latency = {**DEFAULT_LATENCY, **(latency or {})}
+        self.latency = {name: seconds * latency_scale for name, seconds in latency.items()}
+        self.dim = dim
+        self.calls = {"embeddings": 0, "rerank": 0, "completion": 0}
+        self.embeddings = SimpleNamespace(create=self._embed)
+        self.rerank = SimpleNamespace(create=self._rerank)
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._complete))
+
+    def _embeddings_response(self, input, model):
+        texts = [input] if isinstance(input, str) else list(input)
+        self.calls["embeddings"] += 1
+        return SimpleNamespace(data=[SimpleNamespace(index=i, embedding=fake_embedding(model, text, self.dim))
+                                     for i, text in enumerate(texts)])
+
+    def _rerank_response(self, model, query, documents, top_n=None):
+        self.calls["rerank"] += 1
+        scores = [fake_relevance(query, document) for document in documents]
+        order = sorted(range(len(documents)), key=lambda i: -scores[i])[:top_n or len(documents)]
+        return SimpleNamespace(results=[SimpleNamespace(index=i, relevance_score=scores[i]) for i in order])
+
+    def _completion_response(self, model, messages, max_tokens=64):
+        self.calls["completion"] += 1
+        reply = fake_reply(model, messages, max_tokens)
+        prompt_tokens = sum(len(str(m.get("content", "")).split()) for m in messages)
+        usage = SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=len(reply.split()),
+                                total_tokens=prompt_tokens + len(reply.split()))
+        return reply, usage
+
+    @staticmethod
+    def _chunk(token):
+        return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=token))])
+
+    def _embed(self, input, model, **kwargs):
+        time.sleep(self.latency["embeddings"])
+        return self._embeddings_response(input, model)
+
+    def _rerank(self, model, query, documents, top_n=None, **kwargs):
+        time.sleep(self.latency["rerank"])
+        return self._rerank_response(model, query, documents, top_n)
+
+    def _complete(self, model, messages, max_tokens=64, stream=False, **kwargs):
+        reply, usage = self._completion_response(model, messages, max_tokens)
+        time.sleep(self.latency["completion"])
+        if stream:
+            return self._stream(reply)
+        time.sleep(self.latency["token"] * usage.completion_tokens)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=reply))], usage=usage)
+
+    def _stream(self, reply):
+        for i, word in enumerate(reply.split()):
+            if i:
+                time.sleep(self.latency["token"])
+            yield self._chunk(word if i == 0 else " " + word)
+
+
+class AsyncFakeTogether(FakeTogether):
+    """together.AsyncTogether counterpart: same outputs, awaits asyncio.sleep instead of blocking the loop."""
+
+    def __init__(self, latency: dict = None, latency_scale: float = 1.0, dim: int = 1024):
+        super().__init__(latency, latency_scale, dim)
+        self.embeddings = SimpleNamespace(create=self._aembed)
+        self.rerank = SimpleNamespace(create=self._arerank)
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._acomplete))
+
+    async def _aembed(self, input, model, **kwargs):
+        await asyncio.sleep(self.latency["embeddings"])
+        return self._embeddings_response(input, model)
+
+    async def _arerank(self, model, query, documents, top_n=None, **kwargs):
+        await asyncio.sleep(self.latency["rerank"])
+        return self._rerank_response(model, query, documents, top_n)
+
+    async def _acomplete(self, model, messages, max_tokens=64, stream=False, **kwargs):
+        reply, usage = self._completion_response(model, messages, max_tokens)
+        await asyncio.sleep(self.latency["completion"])
+        if stream:
+            return self._astream(reply)
+        await asyncio.sleep(self.latency["token"] * usage.completion_tokens)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=reply))], usage=usage)
+
+    async def _astream(self, reply):
+        for i, word in enumerate(reply.split()):
+            if i:
+                await asyncio.sleep(self.latency["token"])
+            yield self._chunk(word if i == 0 else " " + word)
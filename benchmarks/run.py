@@ -0,0 +1,337 @@
+"""
+Offline benchmarks: every Together call goes to FakeTogether, so the numbers only move when our code does.
+
+    python -m benchmarks.run                                  # all suites, report in benchmarks/results/
+    python -m benchmarks.run --suites retrieval --sizes 10000 100000
+    python -m benchmarks.run --suites e2e --clients 16 --turns 10 --stream
+    python -m benchmarks.run --baseline benchmarks/results/old.json
+
+Suites:
+    retrieval: vector search and full retrieve() latency against corpus size, brute force vs IVF (with recall).
+    kb_load: knowledge base load time and Python heap peak, JSONL vs the memory-mapped store, plus index build.
+    e2e: turns per second through the FastAPI app with concurrent clients, on a temporary sqlite database.
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.fake_together import FakeTogether, AsyncFakeTogether  # noqa: E402
+
+TOPICS = ["artificial intelligence in the newsroom", "climate policy and the economy", "elections and social media",
+          "the future of print journalism", "space exploration budgets", "privacy and big technology companies",
+          "public health after the pandemic", "housing costs in large cities"]
+WORDS = ["policy", "market", "technology", "election", "readers", "climate", "city", "science", "court", "music",
+         "health", "school", "war", "trade", "internet", "privacy", "newsroom", "economy", "space", "housing"]
+
+
+def latency_summary(samples: list[float]) -> dict:
+    """Milliseconds, so reports stay readable next to each other."""
+    if not samples:
+        return {"n": 0}
+    ms = np.asarray(samples) * 1000
+    return {"n": len(samples), "mean_ms": round(float(ms.mean()), 3), "p50_ms": round(float(np.percentile(ms, 50)), 3),
+            "p95_ms": round(float(np.percentile(ms, 95)), 3), "p99_ms": round(float(np.percentile(ms, 99)), 3),
+            "max_ms": round(float(ms.max()), 3)}
+
+
+def synthetic_embeddings(n: int, dim: int, clusters: int = 64, seed: int = 0) -> np.ndarray:
+    """Clustered unit vectors, closer to real sentence embeddings than uniform noise (and fair to IVF)."""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    matrix = centers[rng.integers(0, clusters, n)] + 0.5 * rng.standard_normal((n, dim)).astype(np.float32)
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix
+
+
+def synthetic_records(n: int, prefix: str, seed: int = 0) -> list[dict]:
+    rng = np.random.default_rng(seed)
+    return [{"id": f"{prefix}_{i}", "title": f"Article {i}", "author": "Benchmark",
+             "chunk": " ".join(rng.choice(WORDS, size=60))} for i in range(n)]
+
+
+def write_knowledge_base(path: str, n: int, dim: int, prefix: str, seed: int = 0):
+    """Embedded JSONL in the format build_embeddings writes."""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    embeddings = synthetic_embeddings(n, dim, seed=seed)
+    with open(path, "w", encoding="utf-8") as f:
+        for record, embedding in zip(synthetic_records(n, prefix, seed), embeddings):
+            f.write(json.dumps({**record, "embedding": [round(float(x), 6) for x in embedding]}) + "\n")
+
+
+# --------------------------------------- Suites -------------------------------------------------------------------
+def bench_retrieval(args) -> dict:
+    from vector_index import build_index
+    from knowledge_base import KnowledgeBase
+    from retrieval import retrieve
+
+    client = FakeTogether(latency_scale=0, dim=args.dim)
+    rng = np.random.default_rng(1)
+    results = {}
+    for n in args.sizes:
+        matrix = synthetic_embeddings(n, args.dim)
+        queries = matrix[rng.integers(0, n, args.queries)] + 0.1 * rng.standard_normal((args.queries, args.dim))
+        entry = {}
+        exact = None
+        for kind in ("brute", "ivf"):
+            start = time.perf_counter()
+            index = build_index(matrix, kind=kind)
+            build_seconds = time.perf_counter() - start
+            samples = []
+            found = []
+            for query in queries:
+                start = time.perf_counter()
+                indices, _ = index.search(query, args.top_k)
+                samples.append(time.perf_counter() - start)
+                found.append(set(indices[0].tolist()))
+            entry[kind] = {"build_seconds": round(build_seconds, 4), "search": latency_summary(samples)}
+            if kind == "brute":
+                exact = found
+            else:
+                recall = np.mean([len(a & b) / len(a) for a, b in zip(exact, found)])
+                entry[kind]["recall_at_k"] = round(float(recall), 4)
+
+        # retrieve() end to end with a zero-latency API: embedding, search, rerank plumbing and the result cache
+        records = synthetic_records(n, "bench")
+        knowledge_base = KnowledgeBase(f"bench_{n}", records, matrix, version=(n,))
+        for label, use_cache in (("retrieve_uncached", False), ("retrieve_cached", True)):
+            samples = []
+            for i in range(args.queries):
+                start = time.perf_counter()
+                retrieve(client, knowledge_base, TOPICS[i % len(TOPICS)], top_k=args.top_k, use_cache=use_cache)
+                samples.append(time.perf_counter() - start)
+            entry[label] = latency_summary(samples)
+        results[str(n)] = entry
+        print(f"retrieval n={n}: brute p50 {entry['brute']['search']['p50_ms']} ms, "
+              f"ivf p50 {entry['ivf']['search']['p50_ms']} ms (recall {entry['ivf']['recall_at_k']})")
+    return results
+
+
+def bench_kb_load(args, workdir: str) -> dict:
+    from knowledge_base import load_knowledge_base
+    from embedding_store import convert_jsonl_to_store, store_paths
+
+    results = {}
+    for n in args.sizes:
+        path = os.path.join(workdir, "kb_load", f"kb_{n}.jsonl")
+        write_knowledge_base(path, n, args.dim, "load")
+        entry = {"jsonl_mb": round(os.path.getsize(path) / 2 ** 20, 2)}
+
+        def measure(label):
+            # timed without tracemalloc (it slows allocation heavy parsing down), then loaded again for memory
+            start = time.perf_counter()
+            knowledge_base = load_knowledge_base(path)
+            load_seconds = time.perf_counter() - start
+            start = time.perf_counter()
+            knowledge_base.index.search_one(knowledge_base.embeddings[0], args.top_k)
+            first_search_seconds = time.perf_counter() - start
+            del knowledge_base
+
+            tracemalloc.start()
+            knowledge_base = load_knowledge_base(path)
+            _, load_peak = tracemalloc.get_traced_memory()
+            knowledge_base.index.search_one(knowledge_base.embeddings[0], args.top_k)
+            resident, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            entry[label] = {"load_seconds": round(load_seconds, 4),
+                            "first_search_seconds": round(first_search_seconds, 4),
+                            "load_peak_mb": round(load_peak / 2 ** 20, 2),
+                            "resident_heap_mb": round(resident / 2 ** 20, 2),
+                            "peak_heap_mb": round(peak / 2 ** 20, 2)}
+
+        measure("jsonl")
+        convert_jsonl_to_store(path)
+        entry["store_mb"] = round(sum(os.path.getsize(p) for p in store_paths(path)) / 2 ** 20, 2)
+        measure("store")
+        results[str(n)] = entry
+        print(f"kb_load n={n}: jsonl {entry['jsonl']['load_seconds']} s / {entry['jsonl']['peak_heap_mb']} MB, "
+              f"store {entry['store']['load_seconds']} s / {entry['store']['peak_heap_mb']} MB")
+    return results
+
+
+async def _run_clients(app, args) -> (list[float], int):
+    import httpx
+    from default_values_prompts import bot_1_name, bot_2_name
+
+    latencies = []
+    errors = 0
+
+    async def one_client(c: int, http):
+        nonlocal errors
+        session_id = None
+        for turn in range(args.turns):
+            payload = {"topic": TOPICS[(c + turn) % args.topics], "cite": True}
+            if session_id is not None:
+                payload["session_id"] = str(session_id)
+            else:
+                # bots pick their knowledge base by name
+                payload.update(bot_1_name=bot_1_name, bot_2_name=bot_2_name)
+            start = time.perf_counter()
+            if args.stream:
+                response = await http.post("/multi-agent-chat/stream", json=payload)
+                ok = response.status_code == 200 and "event: done" in response.text
+                if ok and session_id is None:
+                    start_event = response.text.split("\n\n")[0].split("data: ", 1)[1]
+                    session_id = json.loads(start_event)["conversation_id"]
+            else:
+                response = await http.post("/multi-agent-chat", json=payload)
+                ok = response.status_code == 200
+                if ok:
+                    session_id = response.json()["conversation_id"]
+            latencies.append(time.perf_counter() - start)
+            errors += not ok
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as http:
+        await asyncio.gather(*(one_client(c, http) for c in range(args.clients)))
+    return latencies, errors
+
+
+def bench_e2e(args, workdir: str) -> dict:
+    # MAAC reads its database, API key and knowledge base paths at import time, all relative to the working directory
+    e2e_dir = os.path.join(workdir, "e2e")
+    os.makedirs(e2e_dir, exist_ok=True)
+    os.chdir(e2e_dir)
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(e2e_dir, 'bench.db')}"
+    os.environ.setdefault("API_KEY", "offline")
+
+    from default_values_prompts import bot_1_knowledge_base, bot_2_knowledge_base
+    for seed, path in enumerate((bot_1_knowledge_base, bot_2_knowledge_base)):
+        write_knowledge_base(path, args.e2e_kb_size, args.dim, os.path.basename(path), seed=seed)
+
+    import MAAC
+    from metrics import registry as metrics_registry
+    from together_client import ResilientTogether, AsyncResilientTogether, UpstreamPolicy, default_policy
+
+    # the fakes sit behind the same wrapper as production, rate limits only apply when asked for so that turns/s
+    # measures our code rather than the configured quota
+    policy = default_policy
+    if not args.upstream_limits:
+        policy = UpstreamPolicy(rate_limits=dict.fromkeys(default_policy.buckets, 0))
+    fake = FakeTogether(latency_scale=args.latency_scale, dim=args.dim)
+    async_fake = AsyncFakeTogether(latency_scale=args.latency_scale, dim=args.dim)
+    MAAC.client = ResilientTogether(fake, policy)
+    MAAC.async_client = AsyncResilientTogether(async_fake, policy)
+    MAAC.initialize_db()  # ASGITransport does not send lifespan events
+
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output if not args.verbose else sys.stdout):
+        start = time.perf_counter()
+        latencies, errors = asyncio.run(_run_clients(MAAC.app, args))
+        elapsed = time.perf_counter() - start
+
+    stages = {}
+    for (name, labels), histogram in metrics_registry._histograms.items():
+        if name == "stage_latency_seconds":
+            _, total, count = histogram.snapshot()
+            stages[dict(labels)["stage"]] = {"count": count, "mean_ms": round(total / count * 1000, 3) if count else 0}
+
+    calls = {name: fake.calls[name] + async_fake.calls[name] for name in fake.calls}
+    result = {"clients": args.clients, "turns_per_client": args.turns, "stream": args.stream,
+              "latency_scale": args.latency_scale, "upstream_limits": args.upstream_limits,
+              "elapsed_seconds": round(elapsed, 3),
+              "turns_per_second": round(len(latencies) / elapsed, 3), "errors": errors,
+              "turn_latency": latency_summary(latencies), "api_calls": calls, "stages": dict(sorted(stages.items()))}
+    print(f"e2e: {result['turns_per_second']} turns/s with {args.clients} clients, "
+          f"p95 {result['turn_latency']['p95_ms']} ms, {errors} errors")
+    return result
+
+
+# --------------------------------------- Reports -------------------------------------------------------------------
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def flatten(report: dict, prefix: str = "") -> dict:
+    flat = {}
+    for key, value in report.items():
+        name = f"{prefix}.{key}" if prefix else str(key)
+        if isinstance(value, dict):
+            flat.update(flatten(value, name))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def compare(baseline: dict, report: dict):
+    """Prints every numeric result both reports share, with the relative change."""
+    before, after = flatten(baseline["results"]), flatten(report["results"])
+    for name in sorted(before.keys() & after.keys()):
+        change = f"{(after[name] - before[name]) / before[name] * 100:+.1f}%" if before[name] else "n/a"
+        print(f"{name:<60} {before[name]:>12} -> {after[name]:>12}  {change}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmarks against a fake Together API.")
+    parser.add_argument("--suites", nargs="*", default=["retrieval", "kb_load", "e2e"],
+                        choices=["retrieval", "kb_load", "e2e"])
+    parser.add_argument("--sizes", nargs="*", type=int, default=[1000, 10000, 50000], help="corpus sizes (rows)")
+    parser.add_argument("--dim", type=int, default=1024, help="embedding dimension")
+    parser.add_argument("--queries", type=int, default=100, help="queries per retrieval measurement")
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--clients", type=int, default=8, help="concurrent clients in the e2e suite")
+    parser.add_argument("--turns", type=int, default=5, help="turns per e2e client")
+    parser.add_argument("--topics", type=int, default=4,
+                        help=f"distinct e2e topics (max {len(TOPICS)}), fewer means more cache hits")
+    parser.add_argument("--e2e-kb-size", type=int, default=5000, help="rows in each bot knowledge base")
+    parser.add_argument("--latency-scale", type=float, default=1.0, help="multiplies the fake API latencies")
+    parser.add_argument("--stream", action="store_true", help="drive /multi-agent-chat/stream instead")
+    parser.add_argument("--upstream-limits", action="store_true",
+                        help="apply the TOGETHER_*_PER_SECOND rate limits to the fake API in the e2e suite")
+    parser.add_argument("--output", help="report path, defaults to benchmarks/results/<timestamp>.json")
+    parser.add_argument("--baseline", help="earlier report to compare against")
+    parser.add_argument("--verbose", action="store_true", help="keep the app's request logging")
+    args = parser.parse_args()
+    args.topics = max(1, min(args.topics, len(TOPICS)))
+
+    started = datetime.now()
+    report = {"meta": {"timestamp": started.isoformat(timespec="seconds"), "commit": git_commit(),
+                       "python": platform.python_version(), "numpy": np.__version__, "platform": platform.platform(),
+                       "cpu_count": os.cpu_count(), "args": vars(args)},
+              "results": {}}
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix="maac-bench-") as workdir:
+        try:
+            for suite in args.suites:
+                if suite == "retrieval":
+                    report["results"]["retrieval"] = bench_retrieval(args)
+                elif suite == "kb_load":
+                    report["results"]["kb_load"] = bench_kb_load(args, workdir)
+                else:
+                    report["results"]["e2e"] = bench_e2e(args, workdir)
+        finally:
+            os.chdir(cwd)
+    report["meta"]["peak_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+    output = args.output or os.path.join(ROOT, "benchmarks", "results", f"{started:%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Saved benchmark report to {output}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            compare(json.load(f), report)
+
+
+if __name__ == "__main__":
+    main()
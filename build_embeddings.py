@@ -0,0 +1,144 @@
+import argparse
+import hashlib
+import json
+import os
+import threading
+
+from Util import embed_in_batches
+from embedding_store import has_store, load_store_ids, patch_embedding_store, save_embedding_store, store_paths
+from ingest_manifest import IngestManifest, MANIFEST_PATH
+from together_client import make_client
+
+
+def content_hash(model: str, text: str) -> str:
+    return hashlib.sha1(f"{model}\n{text}".encode("utf-8")).hexdigest()
+
+
+def read_records(paths: list[str]):
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def unique_records(records) -> list[dict]:
+    """Ids are content hashes, a chunk present in several inputs (overlapping export batches) is kept once."""
+    seen = {}
+    for record in records:
+        seen.setdefault(record["id"], record)
+    return list(seen.values())
+
+
+def load_checkpoint(path: str) -> dict:
+    """Reads the append-only checkpoint into {content hash: embedding}. A torn last line from a crash is ignored."""
+    done = {}
+    if not os.path.exists(path):
+        return done
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            done[entry["hash"]] = entry["embedding"]
+    return done
+
+
+def build_embeddings(inputs: list[str], output: str, client, model: str = "BAAI/bge-large-en-v1.5",
+                     checkpoint: str = None, batch_size: int = 64, workers: int = 4, retries: int = 5,
+                     store: bool = True, manifest: IngestManifest = None, rebuild: bool = False) -> dict:
+    """
+    Embeds every chunk of the processed JSONL inputs and writes the embedded knowledge base.
+
+    Finished batches are appended to a checkpoint file keyed by the hash of (model, chunk text), so a rerun after
+    a crash, or after the inputs changed, only sends the chunks that are missing or whose text changed.
+
+    With a manifest that says the binary store was built with the same model, nothing is written at all when the
+    store already holds exactly the input chunks, otherwise it is replaced (never modified in place, servers may
+    have it mapped) in the dtype it had. rebuild rewrites it regardless.
+
+    Returns:
+        counts of total chunks, chunks reused from the checkpoint, unique texts newly embedded and store rows
+        added and removed.
+    """
+    checkpoint = checkpoint or output + ".checkpoint.jsonl"
+    os.makedirs(os.path.dirname(os.path.abspath(checkpoint)), exist_ok=True)
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+
+    records = unique_records(read_records(inputs))
+    previous = manifest.knowledge_base(output) if manifest else None
+    patch = store and not rebuild and previous is not None and previous["model"] == model and has_store(output)
+    if patch and os.path.exists(output) and set(load_store_ids(output)) == {r["id"] for r in records}:
+        print(f"{output} already holds the {len(records)} chunks of its inputs, nothing to do")
+        return {"total": len(records), "reused": len(records), "embedded": 0, "added": 0, "removed": 0}
+
+    done = load_checkpoint(checkpoint)
+    hashes = [content_hash(model, r["chunk"]) for r in records]
+    reused = sum(h in done for h in hashes)
+    todo = {}
+    for h, record in zip(hashes, records):
+        if h not in done:
+            todo.setdefault(h, record["chunk"])  # identical chunks are only embedded once
+    print(f"{len(records)} chunks, {reused} already embedded, {len(todo)} unique chunks to embed")
+
+    if todo:
+        todo_hashes = list(todo)
+        lock = threading.Lock()
+
+        with open(checkpoint, "a", encoding="utf-8") as checkpoint_file:
+            def save_batch(start, embeddings):
+                with lock:
+                    for h, embedding in zip(todo_hashes[start:start + len(embeddings)], embeddings):
+                        done[h] = embedding.tolist()
+                        checkpoint_file.write(json.dumps({"hash": h, "embedding": done[h]}) + "\n")
+                    checkpoint_file.flush()
+
+            embed_in_batches(client, list(todo.values()), model, batch_size=batch_size, workers=workers,
+                             retries=retries, on_batch=save_batch)
+
+    with open(output, "w", encoding="utf-8") as f:
+        for h, record in zip(hashes, records):
+            record["embedding"] = done[h]
+            f.write(json.dumps(record) + "\n")
+    added, removed = len(records), 0
+    if patch:
+        added, removed = patch_embedding_store(output, records)
+        for path in store_paths(output):
+            os.utime(path)  # the store must stay newer than the JSONL just written or it would be ignored
+        print(f"Updated the store of {output}: {added} rows added, {removed} removed")
+    elif store:
+        save_embedding_store(output, records)
+    if manifest:
+        manifest.record_knowledge_base(output, model, inputs, len(records))
+        manifest.save()
+    print(f"Saved {len(records)} embedded chunks to {output}")
+    return {"total": len(records), "reused": reused, "embedded": len(todo), "added": added, "removed": removed}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Embed processed NYT chunks into a knowledge base.")
+    parser.add_argument("--year", default="2024", help="shortcut for the default RAG-processed/RAG-embeddings paths")
+    parser.add_argument("--inputs", nargs="*", help="processed JSONL files, overrides --year")
+    parser.add_argument("--output", help="embedded JSONL to write, overrides --year")
+    parser.add_argument("--model", default="BAAI/bge-large-en-v1.5")
+    parser.add_argument("--checkpoint", help="defaults to <output>.checkpoint.jsonl")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--retries", type=int, default=5)
+    parser.add_argument("--no-store", action="store_true", help="skip writing the binary .npy store")
+    parser.add_argument("--manifest", default=MANIFEST_PATH, help="record of what was already embedded")
+    parser.add_argument("--rebuild", action="store_true", help="rewrite the store instead of patching it")
+    args = parser.parse_args()
+
+    if os.path.exists("keys.py"):
+        from keys import api_key
+    else:
+        api_key = os.environ['API_KEY']
+
+    inputs = args.inputs or [f"RAG-processed/nyt_{args.year}_full_clean.jsonl",
+                             f"RAG-processed/nyt_{args.year}_full_clean-2.jsonl"]
+    output = args.output or f"RAG-embeddings/nyt_{args.year}_embedded.jsonl"
+    build_embeddings(inputs, output, make_client(api_key), model=args.model, checkpoint=args.checkpoint,
+                     batch_size=args.batch_size, workers=args.workers, retries=args.retries,
+                     store=not args.no_store, manifest=IngestManifest(args.manifest), rebuild=args.rebuild)
@@ -0,0 +1,267 @@
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+_MISSING = object()
+
+
+class LRUCache:
+    """
+    Thread-safe in-memory LRU cache with an optional time-to-live.
+
+    Args:
+        maxsize: entries kept before the least recently used one is evicted.
+        ttl: seconds an entry stays valid, None for no expiry.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is not _MISSING:
+                value, expires_at = entry
+                if expires_at is None or expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, _MISSING)
+        return default if entry is _MISSING else entry[0]
+
+    def discard_where(self, predicate) -> int:
+        """Removes every entry whose key matches predicate, returns how many were dropped."""
+        with self._lock:
+            keys = [k for k in self._data if predicate(k)]
+            for k in keys:
+                del self._data[k]
+        return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def keys(self) -> list:
+        """Snapshot of the current keys (expired ones included until they are next read)."""
+        with self._lock:
+            return list(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def stats(self) -> dict:
+        return {"size": len(self), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses,
+                "evictions": self.evictions}
+
+
+class SqliteCache:
+    """
+    Persistent cache in a local sqlite file, for values worth keeping across restarts.
+
+    Keys are stored by repr() so they should be tuples/strings of plain values. Values are pickled.
+    """
+
+    def __init__(self, path: str, maxsize: int = 100000, ttl: float = None):
+        self.path = path
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS cache "
+                           "(key TEXT PRIMARY KEY, value BLOB, expires_at REAL, accessed_at REAL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS cache_accessed_at ON cache (accessed_at)")
+        self._conn.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT value, expires_at FROM cache WHERE key = ?", (repr(key),)).fetchone()
+            if row is None or (row[1] is not None and row[1] <= now):
+                self.misses += 1
+                return default
+            self._conn.execute("UPDATE cache SET accessed_at = ? WHERE key = ?", (now, repr(key)))
+            self._conn.commit()
+            self.hits += 1
+        return pickle.loads(row[0])
+
+    def set(self, key, value):
+        now = time.time()
+        expires_at = now + self.ttl if self.ttl else None
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO cache (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                               (repr(key), pickle.dumps(value), expires_at, now))
+            self._conn.execute("DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY accessed_at DESC "
+                               "LIMIT -1 OFFSET ?)", (self.maxsize,))
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM cache")
+            self._conn.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+    def stats(self) -> dict:
+        return {"size": len(self), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses}
+
+
+class EmbeddingCache:
+    """
+    Embeddings keyed by (model, normalized text): an in-memory LRU, optionally backed by a sqlite file so repeated
+    topics survive restarts and are shared between workers on the same host.
+    """
+
+    def __init__(self, maxsize: int = 4096, ttl: float = None, path: str = None, disk_maxsize: int = 100000):
+        self.memory = LRUCache(maxsize=maxsize, ttl=ttl)
+        self.disk = SqliteCache(path, maxsize=disk_maxsize, ttl=ttl) if path else None
+
+    @staticmethod
+    def key(model: str, text: str) -> tuple:
+        return model, " ".join(text.split())
+
+    def get(self, model: str, text: str):
+        key = self.key(model, text)
+        value = self.memory.get(key)
+        if value is None and self.disk is not None:
+            value = self.disk.get(key)
+            if value is not None:
+                self.memory.set(key, value)
+        return value
+
+    def set(self, model: str, text: str, embedding):
+        key = self.key(model, text)
+        self.memory.set(key, embedding)
+        if self.disk is not None:
+            self.disk.set(key, embedding)
+
+    def clear(self):
+        self.memory.clear()
+        if self.disk is not None:
+            self.disk.clear()
+
+    def stats(self) -> dict:
+        stats = {"memory": self.memory.stats()}
+        if self.disk is not None:
+            stats["disk"] = self.disk.stats()
+        return stats
+
+
+class SemanticCache:
+    """
+    Values looked up by an exact key plus an embedding: a lookup hits when an entry with the same key has an
+    embedding whose cosine similarity to the query embedding is at least `threshold`, so paraphrased queries share
+    an entry. Entries expire and are evicted like in LRUCache.
+
+    Args:
+        maxsize: entries kept before the least recently used one is evicted.
+        ttl: seconds an entry stays valid, None for no expiry.
+        threshold: minimum cosine similarity for a hit, 1.0 only matches identical embeddings.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = None, threshold: float = 0.95):
+        self.entries = LRUCache(maxsize=maxsize, ttl=ttl)
+        self.threshold = threshold
+        self._groups = {}  # exact key -> entry keys, pruned lazily when entries expire or get evicted
+        self._lock = threading.Lock()
+        self._next_id = 0
+        self._tracked = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _unit(embedding) -> np.ndarray:
+        embedding = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(embedding)
+        return embedding / norm if norm else embedding
+
+    def get(self, key, embedding, default=None):
+        query = self._unit(embedding)
+        best, best_score = default, self.threshold
+        with self._lock:
+            entry_keys = list(self._groups.get(key, ()))
+        for entry_key in entry_keys:
+            entry = self.entries.get(entry_key)
+            if entry is None:
+                self._forget(key, entry_key)
+                continue
+            score = float(entry[0] @ query)
+            if score >= best_score:
+                best, best_score = entry[1], score
+        with self._lock:
+            if best is default:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return best
+
+    def set(self, key, embedding, value):
+        with self._lock:
+            entry_key = (key, self._next_id)
+            self._next_id += 1
+        self.entries.set(entry_key, (self._unit(embedding), value))
+        with self._lock:
+            self._groups.setdefault(key, set()).add(entry_key)
+            self._tracked += 1
+            if self._tracked > 2 * self.entries.maxsize:
+                self._reindex()
+
+    def _reindex(self):
+        """Drops index entries whose value the LRU already evicted, called with the lock held."""
+        self._groups = {}
+        for entry_key in self.entries.keys():
+            self._groups.setdefault(entry_key[0], set()).add(entry_key)
+        self._tracked = len(self.entries)
+
+    def _forget(self, key, entry_key):
+        with self._lock:
+            group = self._groups.get(key)
+            if group is not None and entry_key in group:
+                group.discard(entry_key)
+                self._tracked -= 1
+                if not group:
+                    del self._groups[key]
+
+    def clear(self):
+        with self._lock:
+            self._groups.clear()
+        self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def stats(self) -> dict:
+        return {"size": len(self), "maxsize": self.entries.maxsize, "hits": self.hits, "misses": self.misses,
+                "evictions": self.entries.evictions}
@@ -1,8 +1,9 @@
 import os
-from sqlalchemy import create_engine
+from contextlib import contextmanager
+from sqlalchemy import create_engine, event, select, func, delete
 from sqlalchemy.orm import sessionmaker, declarative_base
 
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Index, Float, inspect, text
 from sqlalchemy.orm import relationship
 from datetime import datetime
 
@@ -14,9 +15,36 @@ if os.path.exists("env_config.py"):
 else:
     DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///data.db")
 
-engine = create_engine(DATABASE_URL, echo=False)
+# Pool settings only apply to server databases (Postgres), SQLite gets its pragmas below instead
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 10))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 20))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", 30))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")  # NORMAL is safe with WAL and much cheaper than FULL
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", 5000))
 
-Session = sessionmaker(bind=engine)
+
+def _engine_kwargs(url: str) -> dict:
+    if url.startswith("sqlite"):
+        # sessions are handed between the event loop's executor threads, one at a time
+        return {"connect_args": {"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000}}
+    return {"pool_size": DB_POOL_SIZE, "max_overflow": DB_MAX_OVERFLOW, "pool_timeout": DB_POOL_TIMEOUT,
+            "pool_recycle": DB_POOL_RECYCLE, "pool_pre_ping": True}
+
+
+engine = create_engine(DATABASE_URL, echo=False, **_engine_kwargs(DATABASE_URL))
+
+if engine.dialect.name == "sqlite":
+    @event.listens_for(engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")  # readers no longer block the writer
+        cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        cursor.close()
+
+# objects stay readable after commit so helpers can return them once their session is closed
+Session = sessionmaker(bind=engine, expire_on_commit=False)
 Base = declarative_base()
 
 
@@ -43,6 +71,9 @@ class Conversation(Base):
 
 class Message(Base):
     __tablename__ = 'message'
+    __table_args__ = (
+        Index('ix_message_conversation_created', 'conversation_id', 'created_at'),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True, unique=True)
     conversation_id = Column(Integer, ForeignKey('conversation.id'))
@@ -64,8 +95,11 @@ class Citation(Base):
     __tablename__ = 'citation'
 
     id = Column(Integer, primary_key=True, autoincrement=True, unique=True)
-    message_id = Column(Integer, ForeignKey('message.id'))
-    chunk = Column(String)
+    message_id = Column(Integer, ForeignKey('message.id'), index=True)
+    chunk = Column(String)  # full chunk text, only on rows written before chunk_id existed
+    chunk_id = Column(String)  # id of the knowledge base record that was cited
+    score = Column(Float)  # rerank relevance score
+    rank = Column(Integer)  # position after the rerank, 0 is the best match
 
     message = relationship("Message", back_populates="citations")
 
@@ -75,6 +109,10 @@ class Citation(Base):
 
 class Reaction(Base):
     __tablename__ = 'reactions'
+    __table_args__ = (
+        # one counter row per (message, emoji), this is what increment_reactions upserts against
+        Index('uq_reactions_message_reaction', 'message_id', 'reaction_name', unique=True),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True, unique=True)
     message_id = Column(Integer, ForeignKey('message.id'))
@@ -88,13 +126,124 @@ class Reaction(Base):
         return f"<Reaction(id={self.id}, reaction_name='{self.reaction_name}', quantity={self.quantity})>"
 
 
+class ConversationSummary(Base):
+    __tablename__ = 'conversation_summary'
+
+    conversation_id = Column(Integer, ForeignKey('conversation.id'), primary_key=True)
+    summary = Column(String)  # rolling summary of every message up to covered_message_id
+    covered_message_id = Column(Integer)  # newest message folded into the summary
+    covered_count = Column(Integer, default=0)  # how many messages the summary covers
+    updated_at = Column(DateTime, default=datetime.now)
+
+    def __repr__(self):
+        return (f"<ConversationSummary(conversation_id={self.conversation_id}, "
+                f"covered_message_id={self.covered_message_id})>")
+
+
 def get_db():
     """
     Dependency function to get a database session.
     It yields a session and ensures it's closed after the request.
     """
     db = Session()
-    return db
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+@contextmanager
+def session_scope():
+    """
+    Session for work outside a request (background tasks, scripts, streaming responses that outlive the request
+    dependencies). Commits on success, rolls back on error and always returns the connection to the pool.
+    """
+    session = Session()
+    try:
+        yield session
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+
+def increment_reactions(session, deltas: dict) -> None:
+    """
+    Atomically adds quantities to reaction counters, creating the rows that do not exist yet.
+
+    Uses INSERT ... ON CONFLICT DO UPDATE on Postgres and SQLite so concurrent clicks cannot lose updates, and
+    sends every (message, emoji) pair in one executemany. The caller commits.
+
+    Args:
+        session: The SQLAlchemy session to use for database operations.
+        deltas: {(message_id, reaction_name): quantity to add}
+    """
+    if not deltas:
+        return
+    now = datetime.now()
+    rows = [{"message_id": message_id, "reaction_name": reaction_name, "quantity": quantity, "created_at": now}
+            for (message_id, reaction_name), quantity in deltas.items()]
+
+    dialect = session.get_bind().dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        if dialect == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        stmt = insert(Reaction)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[Reaction.message_id, Reaction.reaction_name],
+            set_={"quantity": Reaction.quantity + stmt.excluded.quantity},
+        )
+        session.execute(stmt, rows)
+        return
+
+    # other databases: lock the counter row, then update or insert it
+    for row in rows:
+        reaction = session.execute(
+            select(Reaction).where(Reaction.message_id == row["message_id"],
+                                   Reaction.reaction_name == row["reaction_name"]).with_for_update()
+        ).scalars().first()
+        if reaction:
+            reaction.quantity += row["quantity"]
+        else:
+            session.add(Reaction(**row))
+
+
+def _merge_duplicate_reactions():
+    """Folds duplicate (message, emoji) rows left by the old select-then-insert path so the unique index fits."""
+    with Session() as session:
+        duplicates = session.execute(
+            select(Reaction.message_id, Reaction.reaction_name, func.sum(Reaction.quantity), func.min(Reaction.id))
+            .group_by(Reaction.message_id, Reaction.reaction_name)
+            .having(func.count(Reaction.id) > 1)
+        ).all()
+        for message_id, reaction_name, quantity, keep_id in duplicates:
+            session.execute(delete(Reaction).where(Reaction.message_id == message_id,
+                                                   Reaction.reaction_name == reaction_name,
+                                                   Reaction.id != keep_id))
+            session.get(Reaction, keep_id).quantity = quantity
+        session.commit()
+        if duplicates:
+            print(f"Merged {len(duplicates)} duplicated reaction counters")
+
+
+def _add_missing_columns():
+    """Adds columns introduced after a table was created, create_all never alters existing tables."""
+    inspector = inspect(engine)
+    existing_tables = inspector.get_table_names()
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            existing = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    column_type = column.type.compile(dialect=engine.dialect)
+                    conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+                    print(f"Added column {table.name}.{column.name}")
 
 
 def initialize_db():
@@ -104,4 +253,10 @@ def initialize_db():
     """
     print(f"Attempting to create database tables on: {engine.url}")
     Base.metadata.create_all(bind=engine)
+    _add_missing_columns()
+    _merge_duplicate_reactions()
+    # create_all skips the indexes of tables that already exist, add any that are missing
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
     print("Database tables created or already exist.")
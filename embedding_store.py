@@ -0,0 +1,179 @@
+import argparse
+import json
+import os
+
+import numpy as np
+
+METADATA_SUFFIX = ".meta.jsonl"
+METADATA_FIELDS = ("id", "title", "author", "chunk")
+
+
+def store_paths(path: str) -> (str, str):
+    """
+    Maps any knowledge base path (JSONL, .npy or extensionless) to its binary store files.
+
+    Returns:
+        (matrix_path, metadata_path), e.g. ("RAG-embeddings/nyt_1999_embedded.npy",
+        "RAG-embeddings/nyt_1999_embedded.meta.jsonl").
+    """
+    base, _ = os.path.splitext(path)
+    return base + ".npy", base + METADATA_SUFFIX
+
+
+def has_store(path: str) -> bool:
+    return all(os.path.exists(p) for p in store_paths(path))
+
+
+def _write_metadata(metadata_path: str, records):
+    with open(metadata_path, "w", encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps({k: record.get(k) for k in METADATA_FIELDS}) + "\n")
+
+
+def _tmp_path(path: str) -> str:
+    return path + ".tmp"
+
+
+def _replace_store(matrix_path: str, metadata_path: str):
+    """
+    Swaps freshly written temporary store files in. A running server may have the old matrix mapped: truncating or
+    rewriting that file in place would crash its workers (SIGBUS), os.replace gives the new one another inode and
+    the old mapping stays valid until it is dropped. The matrix goes first, a reader catching the store in between
+    sees mismatching row counts and fails loudly rather than serving wrong metadata.
+    """
+    os.replace(_tmp_path(matrix_path), matrix_path)
+    os.replace(_tmp_path(metadata_path), metadata_path)
+
+
+def save_embedding_store(path: str, records: list[dict], dtype: str = "float32", normalize: bool = True):
+    """
+    Writes records holding an "embedding" list as a contiguous matrix plus a metadata sidecar.
+
+    Args:
+        path: knowledge base path, see store_paths.
+        records: dicts with id/title/author/chunk and embedding keys, in index order.
+        dtype: "float32" or "float16" for the matrix on disk.
+        normalize: store unit-length rows so dot products are cosine similarities.
+    """
+    matrix_path, metadata_path = store_paths(path)
+    matrix = np.array([r["embedding"] for r in records], dtype=np.float32)
+    if normalize:
+        matrix = _normalize_rows(matrix)
+    with open(_tmp_path(matrix_path), "wb") as f:
+        np.save(f, matrix.astype(dtype))
+    _write_metadata(_tmp_path(metadata_path), records)
+    _replace_store(matrix_path, metadata_path)
+
+
+def load_embedding_store(path: str, mmap: bool = True) -> (np.ndarray, list[dict]):
+    """
+    Loads a binary store. With mmap the matrix is a read-only view of the page cache, so every worker
+    process on the host shares the same physical memory and nothing is parsed.
+
+    Returns:
+        (embeddings, metadata) where metadata[i] describes embeddings[i].
+    """
+    matrix_path, metadata_path = store_paths(path)
+    embeddings = np.load(matrix_path, mmap_mode="r" if mmap else None)
+    with open(metadata_path, "r", encoding="utf-8") as f:
+        metadata = [json.loads(line) for line in f if line.strip()]
+    if len(metadata) != embeddings.shape[0]:
+        raise ValueError(f"Embedding store {matrix_path} has {embeddings.shape[0]} rows "
+                         f"but {len(metadata)} metadata records")
+    return embeddings, metadata
+
+
+def load_store_ids(path: str) -> list[str]:
+    """Chunk ids of a binary store, in row order, without touching the matrix."""
+    _, metadata_path = store_paths(path)
+    with open(metadata_path, "r", encoding="utf-8") as f:
+        return [json.loads(line)["id"] for line in f if line.strip()]
+
+
+def patch_embedding_store(path: str, records: list[dict], normalize: bool = True) -> (int, int):
+    """
+    Brings an existing binary store in line with records, matched by id. Nothing is written when the ids did not
+    change, otherwise the store is rewritten from the records' embeddings (the caller's checkpoint already holds
+    them, nothing is embedded again) in the dtype the store has, and swapped in like save_embedding_store does so
+    servers that have the old matrix mapped keep reading it.
+
+    Args:
+        path: knowledge base path, see store_paths.
+        records: every record the store should hold, with its "embedding", in index order.
+        normalize: as in save_embedding_store.
+
+    Returns:
+        (rows added, rows removed)
+    """
+    matrix_path, _ = store_paths(path)
+    existing = set(load_store_ids(path))
+    wanted = {record["id"] for record in records}
+    added, removed = len(wanted - existing), len(existing - wanted)
+    if not added and not removed:
+        return 0, 0
+    dtype = np.load(matrix_path, mmap_mode="r").dtype
+    save_embedding_store(path, records, dtype=dtype.name, normalize=normalize)
+    return added, removed
+
+
+def convert_jsonl_to_store(jsonl_path: str, output_path: str = None, dtype: str = "float32",
+                           normalize: bool = True) -> int:
+    """
+    Converts an embedded JSONL file (as written by Util.save_embedded_jsonl) to the binary store.
+
+    The JSONL is streamed twice (once to size the matrix, once to fill it) so the conversion never holds more
+    than one parsed line in memory.
+
+    Returns:
+        the number of converted records.
+    """
+    output_path = output_path or jsonl_path
+    matrix_path, metadata_path = store_paths(output_path)
+
+    rows, dim = 0, None
+    with open(jsonl_path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            if dim is None:
+                dim = len(json.loads(line)["embedding"])
+            rows += 1
+    if rows == 0:
+        raise ValueError(f"No records found in {jsonl_path}")
+
+    matrix = np.lib.format.open_memmap(_tmp_path(matrix_path), mode="w+", dtype=dtype, shape=(rows, dim))
+    with open(jsonl_path, "r", encoding="utf-8") as f, open(_tmp_path(metadata_path), "w", encoding="utf-8") as meta:
+        i = 0
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            row = np.asarray(record["embedding"], dtype=np.float32)
+            if normalize:
+                row = _normalize_rows(row[None, :])[0]
+            matrix[i] = row
+            meta.write(json.dumps({k: record.get(k) for k in METADATA_FIELDS}) + "\n")
+            i += 1
+    matrix.flush()
+    del matrix
+    _replace_store(matrix_path, metadata_path)
+    print(f"Converted {rows} embeddings ({dim}-d, {dtype}) from {jsonl_path} to {matrix_path}")
+    return rows
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return matrix / norms
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert embedded JSONL knowledge bases to the binary store.")
+    parser.add_argument("paths", nargs="*", default=["RAG-embeddings/nyt_1999_embedded.jsonl",
+                                                     "RAG-embeddings/nyt_2024_embedded.jsonl"])
+    parser.add_argument("--dtype", choices=["float32", "float16"], default="float32")
+    parser.add_argument("--no-normalize", action="store_true", help="keep the raw embedding norms")
+    args = parser.parse_args()
+
+    for jsonl in args.paths:
+        convert_jsonl_to_store(jsonl, dtype=args.dtype, normalize=not args.no_normalize)
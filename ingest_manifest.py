@@ -0,0 +1,73 @@
+import hashlib
+import json
+import os
+from datetime import datetime
+
+MANIFEST_PATH = "RAG-processed/manifest.json"
+
+
+def file_hash(path: str, block_size: int = 1 << 20) -> str:
+    """sha1 of a file's bytes, read block by block."""
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def text_hash(text: str, length: int = 12) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:length]
+
+
+class IngestManifest:
+    """
+    What the ingestion already did, so a rerun only redoes what changed:
+
+    - sources: per raw export, the hash of the file that was processed, the JSONL it produced and the chunk ids of
+      every article in it (article hash -> chunk ids).
+    - knowledge_bases: per embedded knowledge base, the embedding model, its inputs and how many chunks it holds.
+      The chunk ids themselves are in the store's metadata sidecar.
+
+    Chunk ids are content hashes (see process_nyt_files.chunk_articles), so the same text always gets the same id.
+    """
+
+    def __init__(self, path: str = MANIFEST_PATH):
+        self.path = path
+        self.data = {"sources": {}, "knowledge_bases": {}}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.data.update(json.load(f))
+
+    @staticmethod
+    def _key(path: str) -> str:
+        return os.path.normpath(path).replace(os.sep, "/")
+
+    def source(self, path: str) -> dict:
+        return self.data["sources"].get(self._key(path))
+
+    def record_source(self, path: str, source_hash: str, output: str, articles: dict):
+        self.data["sources"][self._key(path)] = {
+            "hash": source_hash,
+            "output": self._key(output),
+            "articles": articles,
+            "processed_at": datetime.now().isoformat(timespec="seconds"),
+        }
+
+    def knowledge_base(self, path: str) -> dict:
+        return self.data["knowledge_bases"].get(self._key(path))
+
+    def record_knowledge_base(self, path: str, model: str, inputs: list[str], chunks: int):
+        self.data["knowledge_bases"][self._key(path)] = {
+            "model": model,
+            "inputs": [self._key(p) for p in inputs],
+            "chunks": chunks,
+            "embedded_at": datetime.now().isoformat(timespec="seconds"),
+        }
+
+    def save(self):
+        """Written to a temporary file first, an interrupted save keeps the previous manifest."""
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.data, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
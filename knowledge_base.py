@@ -0,0 +1,143 @@
+import hashlib
+import os
+import threading
+
+import numpy as np
+
+from Util import load_embeddings
+from embedding_store import has_store, load_embedding_store, store_paths
+from vector_index import VectorIndex, build_index
+from metrics import timed
+
+VECTOR_INDEX_KIND = os.getenv("VECTOR_INDEX", "auto")  # brute | ivf | auto
+
+
+class KnowledgeBase:
+    """
+    Parsed, read-only view of an embedded knowledge base file.
+
+    Instances are owned by the registry and shared by every bot that points at the same file, so nothing here
+    should be mutated after construction.
+    """
+
+    def __init__(self, path: str, records: list[dict], embeddings: np.ndarray, version: tuple):
+        self.path = path
+        self.version = version
+        self.version_hash = hashlib.sha1(repr((path, version)).encode()).hexdigest()[:16]
+        self.embeddings = embeddings
+        self.records = records
+        self.chunks = [d["chunk"] for d in records]
+        self._index = None
+        self._index_lock = threading.Lock()
+
+    @property
+    def index(self) -> VectorIndex:
+        """Search index over the embeddings, built on first use and shared like the rest of the knowledge base."""
+        if self._index is None:
+            with self._index_lock:
+                if self._index is None:
+                    self._index = build_index(self.embeddings, kind=VECTOR_INDEX_KIND)
+        return self._index
+
+    def __len__(self):
+        return len(self.records)
+
+    def __repr__(self):
+        return f"<KnowledgeBase(path='{self.path}', size={len(self)})>"
+
+
+def file_version(path: str) -> tuple:
+    """Cheap change detector for a file: (mtime in ns, size in bytes)."""
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _uses_store(path: str) -> bool:
+    """The binary store wins over the JSONL unless the JSONL was rewritten after the conversion."""
+    if not has_store(path):
+        return False
+    matrix_path, _ = store_paths(path)
+    if os.path.abspath(path) == os.path.abspath(matrix_path) or not os.path.exists(path):
+        return True
+    return os.path.getmtime(matrix_path) >= os.path.getmtime(path)
+
+
+def knowledge_base_version(path: str) -> tuple:
+    if _uses_store(path):
+        return tuple(file_version(p) for p in store_paths(path))
+    return (file_version(path),)
+
+
+@timed("kb_load")
+def load_knowledge_base(path: str) -> KnowledgeBase:
+    """
+    Loads a knowledge base from its memory-mapped binary store when one exists next to the path, falling back to
+    parsing the embedded JSONL.
+    """
+    version = knowledge_base_version(path)
+    if _uses_store(path):
+        embeddings, records = load_embedding_store(path)
+    else:
+        records = load_embeddings(path)
+        embeddings = np.array([d["embedding"] for d in records], dtype=np.float32)
+        # the float lists are now in the matrix, keep only the metadata around
+        records = [{k: v for k, v in d.items() if k != "embedding"} for d in records]
+    return KnowledgeBase(path, records, embeddings, version)
+
+
+class KnowledgeBaseRegistry:
+    """
+    Process-wide cache of loaded knowledge bases, keyed by absolute path.
+
+    Knowledge bases are loaded lazily on first use and reloaded when the file on disk changes.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._listeners = []
+
+    def add_listener(self, callback):
+        """Registers callback(path) to be told when a knowledge base is reloaded or invalidated."""
+        self._listeners.append(callback)
+
+    def _notify(self, path: str):
+        for callback in self._listeners:
+            callback(path)
+
+    def get(self, path: str) -> KnowledgeBase:
+        key = os.path.abspath(path)
+        version = knowledge_base_version(key)
+        kb = self._entries.get(key)
+        if kb is not None and kb.version == version:
+            return kb
+
+        with self._lock:  # only one thread parses a given file, the others wait and reuse it
+            kb = self._entries.get(key)
+            if kb is None or kb.version != version:
+                if kb is not None:
+                    print(f"Knowledge base {path} changed on disk, reloading...")
+                    self._notify(key)
+                kb = load_knowledge_base(key)
+                self._entries[key] = kb
+                print(f"Loaded knowledge base {path} with {len(kb)} chunks")
+        return kb
+
+    def invalidate(self, path: str = None):
+        """Drops one knowledge base (or all of them if no path is given) so the next get() reloads it."""
+        with self._lock:
+            paths = list(self._entries) if path is None else [os.path.abspath(path)]
+            for key in paths:
+                self._entries.pop(key, None)
+        for key in paths:
+            self._notify(key)
+
+    def loaded(self) -> list[str]:
+        return list(self._entries.keys())
+
+
+registry = KnowledgeBaseRegistry()
+
+
+def get_knowledge_base(path: str) -> KnowledgeBase:
+    return registry.get(path)
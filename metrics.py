@@ -0,0 +1,145 @@
+import threading
+import time
+from bisect import bisect_left
+from functools import wraps
+
+# seconds, spans a cache hit (sub-millisecond) up to a slow completion
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+COUNT_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus sense (each bucket counts observations <= its bound)."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        with self._lock:
+            self.counts[bisect_left(self.buckets, value)] += 1
+            self.sum += value
+            self.count += 1
+
+    def snapshot(self):
+        with self._lock:
+            return list(self.counts), self.sum, self.count
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._histograms = {}
+        self._counters = {}
+        self._help = {}
+        self._gauge_callbacks = []
+        self._lock = threading.Lock()
+
+    def histogram(self, name: str, labels: dict = None, buckets=LATENCY_BUCKETS, help: str = None) -> Histogram:
+        key = (name, tuple(sorted((labels or {}).items())))
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(key, Histogram(buckets))
+                if help:
+                    self._help.setdefault(name, help)
+        return histogram
+
+    def inc(self, name: str, value: float = 1, labels: dict = None, help: str = None):
+        key = (name, tuple(sorted((labels or {}).items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+            if help:
+                self._help.setdefault(name, help)
+
+    def add_gauge_callback(self, callback):
+        """callback() -> {(name, labels tuple): value}, evaluated on every scrape (e.g. cache sizes)."""
+        self._gauge_callbacks.append(callback)
+
+    def render(self) -> str:
+        """Prometheus text exposition format."""
+        lines = []
+        seen = set()
+
+        def header(name, kind):
+            if name not in seen:
+                seen.add(name)
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), histogram in sorted(self._histograms.items()):
+            header(name, "histogram")
+            counts, total, count = histogram.snapshot()
+            cumulative = 0
+            for bound, bucket_count in zip(histogram.buckets + ("+Inf",), counts):
+                cumulative += bucket_count
+                lines.append(f"{name}_bucket{_labels(labels + (('le', bound),))} {cumulative}")
+            lines.append(f"{name}_sum{_labels(labels)} {total}")
+            lines.append(f"{name}_count{_labels(labels)} {count}")
+        for (name, labels), value in sorted(self._counters.items()):
+            header(name, "counter")
+            lines.append(f"{name}{_labels(labels)} {value}")
+        for callback in self._gauge_callbacks:
+            for (name, labels), value in sorted(callback().items()):
+                header(name, "gauge")
+                lines.append(f"{name}{_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+
+registry = MetricsRegistry()
+
+
+class timed:
+    """
+    Records the wall time of a block or a (sync) function as stage_latency_seconds{stage=...}.
+
+        with timed("vector_search"):
+            ...
+
+        @timed("rerank")
+        def rerank(...):
+            ...
+
+    Inside async code use it as a plain `with` around the awaits. start (a time.perf_counter() value) times a span
+    that began before the block, e.g. a streamed turn whose setup ran before its response generator.
+    """
+
+    def __init__(self, stage: str, start: float = None):
+        self.stage = stage
+        self.start = start
+
+    def __call__(self, func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with timed(self.stage):  # a fresh timer per call, the decorator instance is shared between threads
+                return func(*args, **kwargs)
+        return wrapper
+
+    def __enter__(self):
+        self._start = self.start if self.start is not None else time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        observe_stage(self.stage, time.perf_counter() - self._start)
+        if exc_type is not None:
+            registry.inc("stage_errors_total", labels={"stage": self.stage}, help="Stages that raised")
+        return False
+
+
+def observe_stage(stage: str, seconds: float):
+    """Same histogram as timed, for spans that do not fit a with block (e.g. time to first streamed token)."""
+    registry.histogram("stage_latency_seconds", {"stage": stage}, help="Wall time per turn stage").observe(seconds)
+
+
+def observe_count(name: str, value: float, help: str = None):
+    """Per-request sizes (tokens, chunks) go into histograms with count-sized buckets."""
+    registry.histogram(name, buckets=COUNT_BUCKETS, help=help).observe(value)
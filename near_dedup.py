@@ -0,0 +1,85 @@
+import re
+import zlib
+
+import numpy as np
+
+NUM_PERM = 128  # signature length, the similarity estimate has a standard error of about 1 / sqrt(NUM_PERM)
+SHINGLE_WORDS = 5
+_PRIME = 4294967311  # smallest prime above 2 ** 32, the permutations are (a * x + b) mod _PRIME
+_WORD = re.compile(r"\w+")
+
+
+def shingles(text: str, k: int = SHINGLE_WORDS) -> np.ndarray:
+    """32-bit hashes of the text's overlapping k-word shingles, case and punctuation insensitive."""
+    words = _WORD.findall(text.lower())
+    grams = [" ".join(words[i:i + k]) for i in range(max(1, len(words) - k + 1))]
+    return np.unique(np.fromiter((zlib.crc32(g.encode("utf-8")) for g in grams), dtype=np.uint64, count=len(grams)))
+
+
+def lsh_params(threshold: float, num_perm: int) -> (int, int):
+    """
+    Splits the signature into bands of rows so that the LSH collision curve rises just below the threshold
+    (about (1 / bands) ** (1 / rows)): pairs above it almost always share a band, far below it rarely do.
+
+    Returns:
+        (bands, rows)
+    """
+    candidates = [(num_perm // rows, rows) for rows in range(1, num_perm + 1) if num_perm % rows == 0]
+    below = [(bands, rows) for bands, rows in candidates if (1 / bands) ** (1 / rows) <= threshold]
+    return max(below, key=lambda p: (1 / p[0]) ** (1 / p[1])) if below else candidates[0]
+
+
+class NearDuplicateIndex:
+    """
+    MinHash signatures indexed with locality sensitive hashing, to find texts whose shingle sets have a Jaccard
+    similarity of at least `threshold` with one already added. Adding and querying cost O(signature) plus the few
+    candidates sharing a band, so deduplicating n texts is roughly linear instead of n² comparisons.
+
+    Args:
+        threshold: estimated Jaccard similarity from which two texts are duplicates.
+        num_perm: MinHash permutations, a multiple of the band count.
+        seed: the permutations, fixed so reruns find the same duplicates.
+    """
+
+    def __init__(self, threshold: float = 0.85, num_perm: int = NUM_PERM, seed: int = 1):
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands, self.rows = lsh_params(threshold, num_perm)
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, 1 << 31, size=(num_perm, 1), dtype=np.uint64)
+        self._b = rng.integers(0, 1 << 31, size=(num_perm, 1), dtype=np.uint64)
+        self._buckets = [{} for _ in range(self.bands)]
+        self._keys = []
+        self._signatures = []
+
+    def signature(self, text: str) -> np.ndarray:
+        return ((self._a * shingles(text)[None, :] + self._b) % _PRIME).min(axis=1)
+
+    def _bands(self, signature: np.ndarray):
+        for band in range(self.bands):
+            yield self._buckets[band], signature[band * self.rows:(band + 1) * self.rows].tobytes()
+
+    def query(self, signature: np.ndarray) -> (object, float):
+        """
+        Returns:
+            (key, similarity) of the most similar added text at or above the threshold, or (None, 0.0).
+        """
+        candidates = set()
+        for buckets, band in self._bands(signature):
+            candidates.update(buckets.get(band, ()))
+        best, best_similarity = None, 0.0
+        for candidate in candidates:
+            similarity = float(np.mean(self._signatures[candidate] == signature))
+            if similarity >= self.threshold and similarity > best_similarity:
+                best, best_similarity = self._keys[candidate], similarity
+        return best, best_similarity
+
+    def add(self, key, signature: np.ndarray):
+        position = len(self._keys)
+        self._keys.append(key)
+        self._signatures.append(signature)
+        for buckets, band in self._bands(signature):
+            buckets.setdefault(band, []).append(position)
+
+    def __len__(self):
+        return len(self._keys)
@@ -1,14 +1,18 @@
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from together import Together
 from resp_evaluator import Evaluator
+import os
+import sys
 import uuid
 from keys import api_key, db_password
 import psycopg2
 from psycopg2.extras import RealDictCursor
 import random
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # shared modules live in the repo root
+from together_client import make_client
+
 # Database connection settings
 DB_SETTINGS = {
     "user": "rafael",
@@ -38,7 +42,7 @@ user_data = ['age', 'is_journalist', 'years_of_practice', 'internet_opinion', 'i
              'gpt_opinion_score']
 model_name = "meta-llama/Llama-3.3-70B-Instruct-Turbo-Free"
 
-client = Together(api_key=api_key)
+client = make_client(api_key)  # shared with every session's Evaluator, so they share its limits
 sessions = {}  # Store user sessions
 
 
@@ -0,0 +1,125 @@
+import asyncio
+import threading
+import time
+
+
+class _Prefetch:
+    def __init__(self, task: asyncio.Task, after_message_id: int, topic: str, cite: bool, bot_name: str):
+        self.task = task
+        self.after_message_id = after_message_id
+        self.topic = topic
+        self.cite = cite
+        self.bot_name = bot_name
+        self.created = time.monotonic()
+
+    def matches(self, after_message_id: int, topic: str, cite: bool, bot_name: str) -> bool:
+        return (self.after_message_id == after_message_id and self.topic == topic and self.cite == cite
+                and self.bot_name == bot_name)
+
+
+class TurnPrefetcher:
+    """
+    Speculatively generates the next turn of a conversation as soon as the current one is committed: the bots
+    alternate and the topic rarely changes, so the following request usually asks for exactly that turn.
+
+    At most one prefetch per conversation and `max_pending` overall are kept, further ones are skipped. A prefetch
+    is only handed out when the conversation is still where it was (same last message, topic, citation mode and
+    bot), anything else cancels it, as do cancel() and results left unclaimed for `ttl` seconds.
+
+    Args:
+        max_pending: prefetches running or waiting to be claimed at once.
+        ttl: seconds an unclaimed prefetch is kept.
+    """
+
+    def __init__(self, max_pending: int = 32, ttl: float = 300):
+        self.max_pending = max_pending
+        self.ttl = ttl
+        self._pending = {}  # conversation id -> _Prefetch
+        self._lock = threading.Lock()  # cancel() is also called from the sync endpoints' threads
+        self._loop = None
+        self.hits = 0
+        self.misses = 0
+        self.skipped = 0
+
+    def schedule(self, conversation_id: int, after_message_id: int, topic: str, cite: bool, bot) -> bool:
+        """
+        Starts generating bot's reply to the conversation right after message after_message_id. Must be called
+        from the event loop.
+
+        Returns:
+            whether a prefetch was started.
+        """
+        self._loop = asyncio.get_running_loop()
+        self._expire()
+        with self._lock:
+            if conversation_id not in self._pending and len(self._pending) >= self.max_pending:
+                self.skipped += 1
+                return False
+        task = self._loop.create_task(bot.agenerate_response(subject=topic, cite=cite))
+        task.add_done_callback(_log_failure)
+        with self._lock:
+            previous = self._pending.pop(conversation_id, None)
+            self._pending[conversation_id] = _Prefetch(task, after_message_id, topic, cite, bot.name)
+        if previous is not None:
+            previous.task.cancel()
+        return True
+
+    async def claim(self, conversation_id: int, after_message_id: int, topic: str, cite: bool,
+                    bot_name: str) -> dict:
+        """
+        Returns:
+            the prefetched agenerate_response result for this exact turn (waiting for it if it is still running),
+            or None when there is none or it no longer applies.
+        """
+        with self._lock:
+            prefetch = self._pending.pop(conversation_id, None)
+        if prefetch is None or not prefetch.matches(after_message_id, topic, cite, bot_name):
+            if prefetch is not None:
+                prefetch.task.cancel()
+                print(f"Discarded the prefetched turn of conversation {conversation_id}, the conversation moved on")
+            self.misses += 1
+            return None
+        try:
+            response = await prefetch.task
+        except asyncio.CancelledError:
+            if not prefetch.task.cancelled():
+                raise  # the request itself was cancelled
+            response = None
+        except Exception:
+            response = None  # already logged by _log_failure, the caller generates the turn itself
+        if response is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return response
+
+    def cancel(self, conversation_id: int):
+        """Drops the conversation's prefetch, e.g. because one of its messages was deleted. Thread safe."""
+        with self._lock:
+            prefetch = self._pending.pop(conversation_id, None)
+        if prefetch is not None and self._loop is not None:
+            self._loop.call_soon_threadsafe(prefetch.task.cancel)
+            print(f"Cancelled the prefetched turn of conversation {conversation_id}")
+
+    def cancel_all(self):
+        with self._lock:
+            conversation_ids = list(self._pending)
+        for conversation_id in conversation_ids:
+            self.cancel(conversation_id)
+
+    def _expire(self):
+        now = time.monotonic()
+        with self._lock:
+            expired = [c for c, p in self._pending.items() if now - p.created > self.ttl]
+            stale = [self._pending.pop(c) for c in expired]
+        for prefetch in stale:
+            prefetch.task.cancel()
+
+    def stats(self) -> dict:
+        return {"pending": len(self._pending), "max_pending": self.max_pending, "hits": self.hits,
+                "misses": self.misses, "skipped": self.skipped}
+
+
+def _log_failure(task: asyncio.Task):
+    if not task.cancelled() and task.exception() is not None:
+        print(f"[WARNING] Prefetching a turn failed: {task.exception()}")
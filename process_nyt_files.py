@@ -1,45 +1,90 @@
-from pathlib import Path
-import re
+import argparse
 import json
+import os
+import re
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+from ingest_manifest import IngestManifest, MANIFEST_PATH, file_hash, text_hash
+from near_dedup import NearDuplicateIndex
 
 # ---- SETTINGS ----
 CHUNK_SIZE = 350
 STEP_SIZE = 300
+READ_SIZE = 1 << 16  # characters read from a raw file at a time, articles are streamed out of these reads
+DEDUP_THRESHOLD = 0.85  # estimated Jaccard similarity (5-word shingles) from which a chunk is a near-duplicate
+DEDUP_REPORT = "RAG-processed/dedup_report.json"
 
 # Define your source files
 source_files = [
-    {"path": "RAG-source/nyt_1999_raw.txt", "output": "RAG-processed/nyt_1999_full_clean.jsonl", "year": "1999",
-     "batch": "1"},
-    {"path": "RAG-source/nyt_2024_raw.txt", "output": "RAG-processed/nyt_2024_full_clean.jsonl", "year": "2024",
-     "batch": "1"},
-    {"path": "RAG-source/nyt_1999_raw-2.txt", "output": "RAG-processed/nyt_1999_full_clean-2.jsonl", "year": "1999",
-     "batch": "2"},
-    {"path": "RAG-source/nyt_2024_raw-2.txt", "output": "RAG-processed/nyt_2024_full_clean-2.jsonl", "year": "2024",
-     "batch": "2"},
+    {"path": "RAG-source/nyt_1999_raw.txt", "output": "RAG-processed/nyt_1999_full_clean.jsonl", "year": "1999"},
+    {"path": "RAG-source/nyt_2024_raw.txt", "output": "RAG-processed/nyt_2024_full_clean.jsonl", "year": "2024"},
+    {"path": "RAG-source/nyt_1999_raw-2.txt", "output": "RAG-processed/nyt_1999_full_clean-2.jsonl", "year": "1999"},
+    {"path": "RAG-source/nyt_2024_raw-2.txt", "output": "RAG-processed/nyt_2024_full_clean-2.jsonl", "year": "2024"},
 ]
 
+# The same exports as Factiva PDFs, read directly (--pdf) instead of going through a manual .txt conversion
+pdf_source_files = [
+    {"path": "RAG-source/pdfs-raw/NYT_1999_Factiva-1.pdf", "output": "RAG-processed/nyt_1999_pdf_clean.jsonl",
+     "year": "1999"},
+    {"path": "RAG-source/pdfs-raw/NYT_2024_Factiva-1.pdf", "output": "RAG-processed/nyt_2024_pdf_clean.jsonl",
+     "year": "2024"},
+]
 
 # number of articles : 80/88
 
+# Factiva exports end every article with a "Document nyt..." line (v1 of the documents) or, in the later exports,
+# an id containing 0000 (v2). A file with fewer than MIN_V1_ARTICLES v1 markers is a v2 export.
+V1_DELIMITER = "\nDocument nyt"
+V2_DELIMITER = "0000"
+MIN_V1_ARTICLES = 10
+# in the PDFs every article ends with its Factiva document id on a line of its own, e.g. "Document
+# nytf000020010828dvck01ybe"
+PDF_DELIMITER = re.compile(r"\nDocument [A-Za-z0-9]{16,40}(?=\n)")
+PDF_DELIMITER_LOOKBACK = 64  # longest text a delimiter can span, searched again when the next page arrives
+
+PDF_PAGES_PER_TASK = 16  # pages extracted per process pool task
+PDF_FURNITURE_SAMPLE = 12  # pages sampled to learn the running header and footer of a PDF
+PDF_MARGIN = 0.15  # share of the page height at the top and bottom where running headers and footers can sit
+PDF_WORD_GAP = 150  # TJ offset (thousandths of an em) from which the gap between two glyph runs is a word space
+# spaces the word gaps leave where a highlighted search term touches punctuation: "technology ." or "technology ’s",
+# "“ Artificial", "high- technology", "technology -driven"
+PDF_STRAY_SPACE = re.compile(r"(?<=\w) (?=[.,;:!?)”’](?!\w)|’s\b|-\w)|(?<=[“‘(]) (?=\w)|(?<=\w-) (?=\w)")
+
+# compiled once, they run over every article of every file
+CLEANUP_PATTERNS = [
+    (re.compile(r'Page \d+ of \d+ © 2025 Factiva, Inc. All rights reserved\.'), ''),
+    (re.compile(r'© \d{4} The New York Times Company\. All Rights Reserved\.'), ''),
+    (re.compile(r'Document TOR'), 'Document tor'),
+    (re.compile(r'NYTimes\.com Feed|NYTFEED|English'), ''),
+    (re.compile("'"), ''),
+    (re.compile(r'\nFactiva\n'), ''),
+    (re.compile(r'\d{1,4}/\d{1,4}\n'), ''),
+    (re.compile(r'\d{1,2}/\d{1,2}/\d{1,2},\s\d{1,2}:\d{1,2}\s(PM|AM)'), ''),
+    (re.compile(r'https://.*'), ''),
+    # (re.compile('\(c\) 1999 New York Times Company'), '\n'),
+    # (re.compile(r'Copyright ... 1999 The Toronto Star'), ''),
+    # (re.compile(r'"All material copyright Bell Globemedia Publishing Inc. and its licensors. All rights reserved. "'),
+    #  '\n'),
+    # (re.compile(r'\s+'), ' '),
+]
+
+# the copyright line closes an article's headers, the body starts right after it
+BODY_START = re.compile(
+    r".*?(Copyright\s....\.{0,1}\sThe\sNew\sYork\sTimes\sCompany\..{0,1}All\sRights\sReserved\.{0,1}|\d{4} New York "
+    r"Times Company|Copyright ... .... The Toronto Star|Copyright . .... Montreal Gazette|..... The Globe and Mail "
+    r"Inc\. All Rights Reserved\.|International New York Times|All material copyright Bell Globemedia Publishing "
+    r"Inc\. and its licensors\. All rights reserved\.)")
+
+
 # ---- UTILITY FUNCTIONS ----
 
 def clean_text(text: str) -> str:
     """Remove unwanted headers, footers, etc."""
-    text = re.sub(r'Page \d+ of \d+ © 2025 Factiva, Inc. All rights reserved\.', '', text)
-    text = re.sub(r'© \d{4} The New York Times Company\. All Rights Reserved\.', '', text)
-    text = re.sub(r'Document TOR', 'Document tor', text)
-    text = re.sub(r'NYTimes\.com Feed|NYTFEED|English', '', text)
-    text = re.sub("'", '', text)
-    text = re.sub(r'\nFactiva\n', '', text).strip()
-    text = re.sub(r'\d{1,4}/\d{1,4}\n', '', text).strip()
-    text = re.sub(r'\d{1,2}/\d{1,2}/\d{1,2},\s\d{1,2}:\d{1,2}\s(PM|AM)', '', text).strip()
-    text = re.sub(r'https://.*', '', text).strip()
-    # text = re.sub('\(c\) 1999 New York Times Company', '\n', text)
-    # text = re.sub(r'Copyright ... 1999 The Toronto Star', '', text)
-    # text = re.sub(r'"All material copyright Bell Globemedia Publishing Inc. and its licensors. All rights reserved. "', '\n', text)
-
-    # text = re.sub(r'\s+', ' ', text).strip()
-    return text
+    for pattern, replacement in CLEANUP_PATTERNS:
+        text = pattern.sub(replacement, text)
+    return text.strip()
 
 
 def get_author_title(Headers: list[str]) -> (str, str):
@@ -81,51 +126,51 @@ def scrub_header(h: str) -> str:
     return h
 
 
-def split_articles_by_author(text: str, font='nyt'):
-    """Split text into articles using 'By [AUTHOR]' as markers."""
-    parts = re.split(r'\nDocument nyt', text)[:-1]  # for the v1 of the documents
-    if len(parts) < 10:  # now we are in the version 2 of documents
-        parts = re.split(r'0000', text)[:-1]
+def parse_article(article: str) -> dict:
+    """
+    Separates one article of a Factiva export into its author, title and body.
 
-    articles = []
+    Returns:
+        {"author", "title", "body"}, or None when the article has to be skipped.
+    """
+    if len(article) < 100:  # sometimes articles incredbly short or simply a bug of the split by 0000, skip
+        return None
+    if '\n\n\n\n\x0c' in article[:100]:
+        article = article.split('\n\n\n\n\x0c')[1]
 
-    for i in range(0, len(parts)):
+    body_start = BODY_START.search(article)
+    if body_start is None:
+        print("Copyright line not found, skipping...")
+        return None
+    body = article[body_start.end():]
+    headers = [header for header in article[:body_start.end()].split("\n") if header != '']
 
-        article = parts[i]
-        if len(article) < 100:  # sometimes articles incredbly short or simply a bug of the split by 0000, skip
-            continue
-        if '\n\n\n\n\x0c' in article[:100]:
-            article = article.split('\n\n\n\n\x0c')[1]
+    author, title = get_author_title(headers)
 
-        body_start = re.search(
-            r".*?(Copyright\s....\.{0,1}\sThe\sNew\sYork\sTimes\sCompany\..{0,1}All\sRights\sReserved\.{0,1}|\d{4} New York Times Company|Copyright ... .... The Toronto Star|Copyright . .... Montreal Gazette|..... The Globe and Mail Inc\. All Rights Reserved\.|International New York Times|All material copyright Bell Globemedia Publishing Inc\. and its licensors\. All rights reserved\.)",
-            article).end()
-        body = article[body_start:]
-        headers = article[:body_start].split("\n")
+    if (author == 'BUSINESS DIGEST') or (not author and title == 'BUSINESS DIGEST'):
+        title = 'BUSINESS DIGEST'
+        author = 'BUSINESS DIGEST'
 
-        while '' in headers:
-            headers.remove('')
+    if not (author and title):
+        print("Author or title not found, skipping...")
+        return None
 
-        author, title = get_author_title(headers)
+    if body == '':
+        print(f'Error on article {title}, skipping....')
+        return None
+    return {
+        "author": author,
+        "title": title,
+        "body": body
+    }
 
-        if (author == 'BUSINESS DIGEST') or (not author and title == 'BUSINESS DIGEST'):
-            title = 'BUSINESS DIGEST'
-            author = 'BUSINESS DIGEST'
 
-        if not (author and title):
-            print("Author or title not found, skipping...")
-            continue
-
-        if body == '':
-            print(f'Error on article {title}, skipping....')
-            continue
-        articles.append({
-            "author": author,
-            "title": title,
-            "body": body
-        })
-
-    return articles
+def split_articles_by_author(text: str, font='nyt'):
+    """Split text into articles using 'By [AUTHOR]' as markers."""
+    parts = text.split(V1_DELIMITER)[:-1]  # for the v1 of the documents
+    if len(parts) < MIN_V1_ARTICLES:  # now we are in the version 2 of documents
+        parts = text.split(V2_DELIMITER)[:-1]
+    return [article for article in (parse_article(part) for part in parts) if article]
 
 
 def chunk_text(text: str):
@@ -148,32 +193,436 @@ def chunk_text(text: str):
     return chunks
 
 
-# ---- MAIN PROCESSING ----
+# ---- PIPELINE STAGES ----
+# Each stage is a generator over the previous one, so only the article being processed (plus one read buffer) is in
+# memory whatever the size of the export.
+
+def read_pieces(path: str, read_size: int = READ_SIZE):
+    with open(path, "r", encoding="utf-8") as f:
+        while True:
+            piece = f.read(read_size)
+            if not piece:
+                return
+            yield piece
+
+
+def split_stream(pieces, delimiter):
+    """
+    Splits streamed text on delimiter, like str.split, except that the text after the last delimiter is dropped.
+
+    Args:
+        pieces: the text, in pieces.
+        delimiter: a string, or a compiled pattern matching at most PDF_DELIMITER_LOOKBACK characters.
+    """
+    if isinstance(delimiter, str):
+        pattern, lookback = re.compile(re.escape(delimiter)), len(delimiter) - 1
+    else:
+        pattern, lookback = delimiter, PDF_DELIMITER_LOOKBACK
+    buffer = ''
+    for piece in pieces:
+        start = max(0, len(buffer) - lookback)  # a delimiter can straddle two pieces
+        buffer += piece
+        parts_start = 0
+        for match in pattern.finditer(buffer, start):
+            yield buffer[parts_start:match.start()]
+            parts_start = match.end()
+        buffer = buffer[parts_start:]
+
+
+def detect_delimiter(path: str) -> str:
+    """The article delimiter of a raw export, without reading further than the first MIN_V1_ARTICLES articles."""
+    for count, _ in enumerate(split_stream(read_pieces(path), V1_DELIMITER), start=1):
+        if count >= MIN_V1_ARTICLES:
+            return V1_DELIMITER
+    return V2_DELIMITER
+
+
+def read_articles(path: str, workers: int = 1):
+    """Streams the raw text of each article of a Factiva export, .txt or .pdf."""
+    if path.lower().endswith(".pdf"):
+        yield from split_stream(read_pdf_pages(path, workers=workers), PDF_DELIMITER)
+    else:
+        yield from split_stream(read_pieces(path), detect_delimiter(path))
+
+
+# ---- PDF PAGES ----
+# PDFs are read page by page with PyPDF2. The running header and footer ("Page 3 of 249 © 2025 Factiva...") are
+# dropped by position rather than by pattern: text fragments that sit in the page margins at the same height, with
+# the same text up to numbers, on most pages.
+
+def _mark_word_gaps(page):
+    """
+    Factiva PDFs draw no space glyphs, words are separated by TJ offsets of about a space width (-278). PyPDF2
+    turns an offset into a space when it reaches the font's space width, which it has to guess for these subset
+    fonts (anywhere from 138 to 388), so whole lines came out without spaces. The offsets of the page's content
+    stream are replaced, in memory only, by 0 for kerning and by an offset no guess can miss for word gaps.
+
+    Highlighted search terms are drawn as separate text objects further along the same line, the run before one of
+    them gets a trailing word gap too.
+    """
+    from PyPDF2.generic import ArrayObject, ContentStream, FloatObject, NameObject, NumberObject
+
+    contents = page.get_contents()
+    if contents is None:
+        return
+    stream = ContentStream(contents, page.pdf)
+    gap = FloatObject(-100 * PDF_WORD_GAP)
+    cm_y, tm = 0.0, (0.0, 0.0)
+    previous = None  # (baseline, operands) of the last TJ
+    for operands, operator in stream.operations:
+        if operator == b"cm":
+            cm_y = float(operands[5])
+        elif operator == b"Tm":
+            tm = (float(operands[4]), float(operands[5]))
+        elif operator == b"TJ":
+            operands[0] = ArrayObject(
+                (gap if float(op) <= -PDF_WORD_GAP else NumberObject(0))
+                if isinstance(op, (NumberObject, FloatObject)) else op for op in operands[0])
+            baseline = round(cm_y + tm[1], 1)
+            if previous is not None and tm[0] > 0 and previous[0] == baseline:
+                previous[1][0].append(gap)
+            previous = baseline, operands
+    page[NameObject("/Contents")] = stream
+
+
+def _extract(page) -> (str, list[tuple[float, str]]):
+    """
+    Returns:
+        (text of the page, (height on the page, text) of every text fragment PyPDF2 extracted it from)
+    """
+    _mark_word_gaps(page)
+    fragments = []
+
+    def visit(text, cm, tm, font, size):
+        if text.strip():
+            fragments.append((tm[4] * cm[1] + tm[5] * cm[3] + cm[5], text))
+
+    return page.extract_text(visitor_text=visit), fragments
+
+
+def _furniture_key(page_height: float, y: float, text: str):
+    """Identifies a fragment that could be a running header or footer, None for the body of the page."""
+    if PDF_MARGIN * page_height < y < (1 - PDF_MARGIN) * page_height:
+        return None
+    return round(y), re.sub(r"\d+", "#", "".join(text.split()))
+
+
+def learn_furniture(path: str, sample: int = PDF_FURNITURE_SAMPLE) -> set:
+    """
+    Returns:
+        keys (see _furniture_key) of the fragments found in the margins of at least half of the sampled pages.
+    """
+    from PyPDF2 import PdfReader
+
+    reader = PdfReader(path)
+    pages = len(reader.pages)
+    sampled = sorted({round(i * (pages - 1) / max(1, sample - 1)) for i in range(min(sample, pages))})
+    counts = Counter()
+    for number in sampled:
+        page = reader.pages[number]
+        height = float(page.mediabox.height)
+        counts.update({_furniture_key(height, y, text) for y, text in _extract(page)[1]} - {None})
+    return {key for key, count in counts.items() if count >= max(2, len(sampled) / 2)}
+
+
+def extract_pdf_pages(path: str, start: int, stop: int, furniture: set) -> list[str]:
+    """Text of pages [start, stop) without their running header and footer, one process pool task."""
+    from PyPDF2 import PdfReader
+
+    reader = PdfReader(path)
+    texts = []
+    for number in range(start, min(stop, len(reader.pages))):
+        page = reader.pages[number]
+        height = float(page.mediabox.height)
+        text, fragments = _extract(page)
+        # longest first: PyPDF2 reports text of form XObjects both piece by piece and as a whole
+        for y, fragment in sorted(fragments, key=lambda f: -len(f[1])):
+            if _furniture_key(height, y, fragment) in furniture:
+                text = text.replace(fragment.strip(), "", 1)
+        texts.append(PDF_STRAY_SPACE.sub("", text))
+    return texts
+
+
+def read_pdf_pages(path: str, workers: int = 1, pages_per_task: int = PDF_PAGES_PER_TASK):
+    """
+    Streams the text of a PDF page by page, in order, each page ending with a newline. With several workers the
+    page ranges are extracted in a process pool, at most 2 tasks per worker ahead of the consumer.
+    """
+    from PyPDF2 import PdfReader
+
+    pages = len(PdfReader(path).pages)
+    furniture = learn_furniture(path)
+    ranges = [(start, start + pages_per_task) for start in range(0, pages, pages_per_task)]
+    if workers <= 1:
+        for start, stop in ranges:
+            for text in extract_pdf_pages(path, start, stop, furniture):
+                yield text + "\n"
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = []
+        for start, stop in ranges:
+            pending.append(executor.submit(extract_pdf_pages, path, start, stop, furniture))
+            if len(pending) >= 2 * workers:
+                yield from (text + "\n" for text in pending.pop(0).result())
+        for future in pending:
+            yield from (text + "\n" for text in future.result())
+
+
+def clean_articles(articles):
+    """clean_text per article, the first one also loses its leading whitespace as when cleaning the whole export."""
+    for i, article in enumerate(articles):
+        for pattern, replacement in CLEANUP_PATTERNS:
+            article = pattern.sub(replacement, article)
+        yield article.lstrip() if i == 0 else article
+
+
+def parse_articles(articles):
+    for article in articles:
+        parsed = parse_article(article)
+        if parsed:
+            yield parsed
+
+
+def article_hash(article: dict) -> str:
+    """Content hash of an article, insensitive to how the export wrapped its lines."""
+    return text_hash(f"{article['title']}\n{article['author']}\n{' '.join(article['body'].split())}")
+
+
+def chunk_articles(articles, year: str, chunk_ids: dict = None):
+    """
+    Yields the knowledge base records of the articles. Ids are nyt_<year>_<article hash>_<chunk hash>, so they do
+    not move when articles are added or removed around them, and an article seen twice is only emitted once.
+
+    Args:
+        chunk_ids: filled with article hash -> chunk ids of the article, for the manifest.
+    """
+    chunk_ids = {} if chunk_ids is None else chunk_ids
+    for article in articles:
+        article_id = article_hash(article)
+        if article_id in chunk_ids:
+            print(f"Article {article['title']} seen twice, skipping...")
+            continue
+        chunk_ids[article_id] = []
+        for chunk in chunk_text(article["body"]):
+            record_id = f"nyt_{year}_{article_id}_{text_hash(chunk)}"
+            if record_id in chunk_ids[article_id]:
+                continue
+            chunk_ids[article_id].append(record_id)
+            yield {
+                "id": record_id,
+                "title": article["title"],
+                "author": article["author"],
+                "chunk": chunk
+            }
+
+
+def write_jsonl(records, output: str, allow_empty: bool = True) -> int:
+    """
+    Writes records one line at a time to a temporary file that replaces output at the end, so an interrupted run
+    never leaves a truncated knowledge base behind.
+
+    Args:
+        allow_empty: with False, no records raises ValueError and output is left as it was.
+
+    Returns:
+        number of records written.
+    """
+    output_path = Path(output)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = output_path.with_name(output_path.name + ".tmp")
+    count = 0
+    with tmp_path.open("w", encoding="utf-8") as f:
+        for record in records:
+            json.dump(record, f)
+            f.write("\n")
+            count += 1
+    if count == 0 and not allow_empty:
+        tmp_path.unlink()
+        raise ValueError(f"No records to write to {output}, the previous file was kept")
+    os.replace(tmp_path, output_path)
+    return count
+
+
+def read_jsonl(path: str):
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def process_source(source: dict, workers: int = 1) -> dict:
+    """
+    Runs the whole pipeline (read, clean, parse, chunk, write) for one raw export.
+
+    Args:
+        source: {"path", "output", "year"} as in source_files.
+        workers: processes extracting the pages of a PDF.
+
+    Returns:
+        {"path", "output", "articles", "chunks", "chunk_ids"} where chunk_ids maps article hash -> chunk ids.
+    """
+    chunk_ids = {}
+    articles = parse_articles(clean_articles(read_articles(source["path"], workers=workers)))
+    # an export none of whose articles parse (e.g. a PDF whose text did not extract) is an error, an empty output
+    # would silently drop it from the knowledge base
+    chunks = write_jsonl(chunk_articles(articles, source["year"], chunk_ids), source["output"], allow_empty=False)
+    return {"path": source["path"], "output": source["output"], "articles": len(chunk_ids), "chunks": chunks,
+            "chunk_ids": chunk_ids}
+
+
+def _report(result: dict, previous: dict):
+    old = previous["articles"] if previous else {}
+    new = result["chunk_ids"]
+    changed = sum(article not in old for article in new)
+    removed = sum(article not in new for article in old)
+    print(f"✅ Saved {result['articles']} articles to {result['output']} "
+          f"({changed} new or changed, {removed} gone since the last run)")
+
+
+def process_sources(sources: list[dict], workers: int = None, manifest: IngestManifest = None,
+                    force: bool = False) -> list[dict]:
+    """
+    Processes the exports in a process pool, one file per worker (regex work is CPU bound, threads would not help).
+    PDFs are processed one after the other instead, each spread over the pool by page range.
+
+    With a manifest, exports whose bytes did not change since they were last processed (and whose output is still
+    there) are skipped, and the manifest is updated with what was processed.
+
+    Returns:
+        process_source stats of every source that was processed, in the order they finished.
+    """
+    todo = []
+    for source in sources:
+        source = dict(source, hash=file_hash(source["path"]))
+        previous = manifest.source(source["path"]) if manifest else None
+        if (not force and previous and previous["hash"] == source["hash"]
+                and os.path.exists(source["output"])):
+            print(f"{source['path']} unchanged since {previous['processed_at']}, skipping...")
+            continue
+        todo.append(source)
+    if not todo:
+        return []
+    results = []
+
+    def finished(source, result):
+        _report(result, manifest.source(source["path"]) if manifest else None)
+        if manifest:
+            manifest.record_source(source["path"], source["hash"], source["output"], result["chunk_ids"])
+        results.append(result)
+
+    workers = workers or os.cpu_count() or 1
+    pdfs = [source for source in todo if source["path"].lower().endswith(".pdf")]
+    for source in pdfs:
+        print(f"Processing {source['path']} with {workers} workers...")
+        finished(source, process_source(source, workers=workers))
+    todo = [source for source in todo if source not in pdfs]
+    file_workers = min(workers, len(todo))
+    if file_workers == 1:
+        for source in todo:
+            print(f"Processing {source['path']}...")
+            finished(source, process_source(source))
+    elif file_workers > 1:
+        print(f"Processing {len(todo)} files with {file_workers} workers...")
+        with ProcessPoolExecutor(max_workers=file_workers) as executor:
+            futures = {executor.submit(process_source, source): source for source in todo}
+            for future in as_completed(futures):
+                finished(futures[future], future.result())
+    if manifest:
+        manifest.save()
+    return results
+
+
+def dedup_sources(sources: list[dict], threshold: float = DEDUP_THRESHOLD, report: str = DEDUP_REPORT) -> dict:
+    """
+    Drops near-duplicate chunks from the outputs of the sources, found with MinHash/LSH in roughly linear time.
+    Sources of the same year feed the same knowledge base (the export batches overlap), so they are deduplicated
+    together in source order: the first occurrence of a chunk is kept, later ones are dropped. Only outputs that
+    lose chunks are rewritten.
+
+    Args:
+        sources: {"path", "output", "year"} of already processed sources.
+        threshold: see DEDUP_THRESHOLD.
+        report: JSON file updated with what was dropped, per year, or None.
+
+    Returns:
+        {year: {"chunks", "duplicates", "outputs", "pairs"}} for the years of the sources.
+    """
+    groups = {}
+    for source in sources:
+        groups.setdefault(source["year"], []).append(source["output"])
+
+    results = {}
+    for year, outputs in groups.items():
+        index = NearDuplicateIndex(threshold)
+        dropped = {output: {} for output in outputs}
+        chunks = 0
+        for output in outputs:
+            for record in read_jsonl(output):
+                chunks += 1
+                signature = index.signature(record["chunk"])
+                kept, similarity = index.query(signature)
+                if kept is None:
+                    index.add(record["id"], signature)
+                else:
+                    dropped[output][record["id"]] = (kept, similarity)
+        for output, ids in dropped.items():
+            if ids:
+                write_jsonl((record for record in read_jsonl(output) if record["id"] not in ids), output)
+        duplicates = sum(len(ids) for ids in dropped.values())
+        print(f"🧹 Dropped {duplicates} near-duplicate chunks out of {chunks} for {year}")
+        results[year] = {
+            "chunks": chunks,
+            "duplicates": duplicates,
+            "outputs": {output: len(ids) for output, ids in dropped.items()},
+            "pairs": [{"dropped": dropped_id, "kept": kept, "similarity": round(similarity, 3)}
+                      for ids in dropped.values() for dropped_id, (kept, similarity) in ids.items()],
+        }
+
+    if report:
+        previous = {}
+        if os.path.exists(report):
+            with open(report, "r", encoding="utf-8") as f:
+                previous = json.load(f).get("years", {})
+        Path(report).parent.mkdir(parents=True, exist_ok=True)
+        with open(report, "w", encoding="utf-8") as f:
+            json.dump({"threshold": threshold, "years": {**previous, **results}}, f, indent=1)
+    return results
 
-for source in source_files:
-    print(f"Processing {source['path']}...")
 
-    path = Path(source["path"])
-    output_path = Path(source["output"])
-    output_path.parent.mkdir(parents=True, exist_ok=True)
+# ---- MAIN PROCESSING ----
 
-    raw_text = path.read_text(encoding="utf-8")
-    cleaned = clean_text(raw_text)
-
-    articles_info = split_articles_by_author(cleaned)
-
-    # Save
-    with output_path.open("w", encoding="utf-8") as f:
-        for idx, article in enumerate(articles_info):
-            chunks = chunk_text(article["body"])
-            for chunk_idx, chunk in enumerate(chunks):
-                record = {
-                    "id": f"nyt_{source['year']}_{idx + 1:04}_chunk_{chunk_idx + 1}_{source['batch']}",
-                    "title": article["title"],
-                    "author": article["author"],
-                    "chunk": chunk
-                }
-                json.dump(record, f)
-                f.write("\n")
-
-    print(f"✅ Saved {len(articles_info)} articles to {output_path}")
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Clean, split and chunk raw Factiva NYT exports into JSONL.")
+    parser.add_argument("--input", help="raw export (.txt or .pdf) to process instead of the default source files")
+    parser.add_argument("--pdf", action="store_true", help="process the default PDF exports instead of the .txt ones")
+    parser.add_argument("--output", help="JSONL to write, required with --input")
+    parser.add_argument("--year", help="year used in the chunk ids, with --input; otherwise only process that year")
+    parser.add_argument("--workers", type=int, help="processes, defaults to one per CPU")
+    parser.add_argument("--manifest", default=MANIFEST_PATH, help="record of what was already processed")
+    parser.add_argument("--force", action="store_true", help="reprocess sources even if they did not change")
+    parser.add_argument("--dedup-threshold", type=float, default=DEDUP_THRESHOLD,
+                        help="similarity from which chunks are near-duplicates")
+    parser.add_argument("--dedup-report", default=DEDUP_REPORT)
+    parser.add_argument("--no-dedup", action="store_true", help="keep near-duplicate chunks")
+    args = parser.parse_args()
+
+    if args.input:
+        if not (args.output and args.year):
+            parser.error("--input needs --output and --year")
+        sources = [{"path": args.input, "output": args.output, "year": args.year}]
+    else:
+        defaults = pdf_source_files if args.pdf else source_files
+        sources = [source for source in defaults if args.year in (None, source["year"])]
+    manifest = IngestManifest(args.manifest)
+    processed = {result["path"] for result in process_sources(sources, workers=args.workers, manifest=manifest,
+                                                               force=args.force)}
+    if not args.no_dedup:
+        # unchanged years were deduplicated when they were processed. In a year that changed, the skipped sources
+        # are redone too: chunks they lost to an article that has changed since have to come back
+        years = {source["year"] for source in sources if source["path"] in processed}
+        group = [source for source in sources if source["year"] in years]
+        redo = [source for source in group if source["path"] not in processed]
+        if redo:
+            process_sources(redo, workers=args.workers, manifest=manifest, force=True)
+        dedup_sources(group, threshold=args.dedup_threshold, report=args.dedup_report)
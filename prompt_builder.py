@@ -0,0 +1,196 @@
+import os
+import threading
+from datetime import datetime
+
+from sqlalchemy import Select, func
+
+from db import Message, ConversationSummary, session_scope
+from metrics import timed
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 4000))  # prompt tokens per completion, all included
+RAG_TOKEN_SHARE = float(os.getenv("RAG_TOKEN_SHARE", 0.5))  # of the room the system prompts leave, with history
+HISTORY_TURNS = int(os.getenv("HISTORY_TURNS", 6))  # most recent turns always sent verbatim (budget permitting)
+SUMMARY_BATCH = int(os.getenv("SUMMARY_BATCH", 4))  # older turns folded into the summary per refresh, at least
+SUMMARY_MAX_FOLD = 4 * SUMMARY_BATCH  # and at most, so a long conversation catches up over several refreshes
+SUMMARY_MAX_WORDS = int(os.getenv("SUMMARY_MAX_WORDS", 200))
+
+MESSAGE_OVERHEAD = 4  # role and separators of a chat message
+
+
+def count_tokens(text: str) -> int:
+    """Approximate token count (about 4 characters per token for English), close enough for budgeting."""
+    return (len(text) + 3) // 4 if text else 0
+
+
+def count_message_tokens(messages: list[dict]) -> int:
+    return sum(count_tokens(m["content"]) + MESSAGE_OVERHEAD for m in messages)
+
+
+class ConversationHistory:
+    """
+    What a bot knows of the conversation so far: the rolling summary of older messages and the more recent turns
+    verbatim, oldest first, as {"id", "writer", "text"} dicts.
+    """
+
+    def __init__(self, summary: str = None, turns: list[dict] = None):
+        self.summary = summary
+        self.turns = turns or []
+
+    def __bool__(self):
+        return bool(self.summary or self.turns)
+
+    def appended(self, message_id: int, writer: str, text: str) -> "ConversationHistory":
+        """The history one committed message later, without going back to the database."""
+        return ConversationHistory(self.summary, self.turns + [{"id": message_id, "writer": writer, "text": text}])
+
+    def turn_messages(self, bot_name: str, turns: list[dict]) -> list[dict]:
+        """Chat messages from the replying bot's point of view: its own turns are the assistant's."""
+        return [{"role": "assistant", "content": t["text"]} if t["writer"] == bot_name else
+                {"role": "user", "content": f"{t['writer']}: {t['text']}"} for t in turns]
+
+
+@timed("history_load")
+def load_history(session, conversation_id: int) -> ConversationHistory:
+    """
+    Loads the stored summary and the messages it does not cover yet, at most HISTORY_TURNS + SUMMARY_MAX_FOLD of
+    them (the newest), so the cost stays flat however long the conversation gets.
+    """
+    summary = session.get(ConversationSummary, conversation_id)
+    query = Select(Message.id, Message.writer, Message.message).where(Message.conversation_id == conversation_id)
+    if summary is not None:
+        query = query.where(Message.id > summary.covered_message_id)
+    rows = session.execute(query.order_by(Message.created_at.desc(), Message.id.desc())
+                           .limit(HISTORY_TURNS + SUMMARY_MAX_FOLD)).all()
+    turns = [{"id": row.id, "writer": row.writer, "text": row.message or ""} for row in reversed(rows)]
+    return ConversationHistory(summary.summary if summary is not None else None, turns)
+
+
+def assemble_prompt(system_messages: list[dict], rag_header: str, chunks: list[str],
+                    history: ConversationHistory, bot_name: str, extra_messages: list[dict] = None,
+                    budget: int = CONTEXT_TOKEN_BUDGET) -> (list[dict], int):
+    """
+    Fits the prompt into `budget` tokens. The system prompts and extra_messages are always sent, the rest is
+    filled in by priority: retrieved chunks (best first, up to RAG_TOKEN_SHARE of the room when there is history),
+    the last HISTORY_TURNS turns (newest first), the summary, then older turns not summarized yet.
+
+    Args:
+        system_messages: persona and instructions.
+        rag_header: instruction placed before the chunks.
+        chunks: retrieved context, best first.
+        history: the conversation so far, or None.
+        bot_name: the replying bot, its own turns become assistant messages.
+        extra_messages: messages of the current request, appended last.
+        budget: total prompt tokens.
+
+    Returns:
+        (messages, number of chunks that made it into the prompt)
+    """
+    extra_messages = extra_messages or []
+    history = history or ConversationHistory()
+    room = budget - count_message_tokens(system_messages) - count_message_tokens(extra_messages)
+    if room < 0:
+        print(f"[WARNING] System prompts alone take {budget - room} tokens, over the {budget} token budget")
+
+    rag_room = room * RAG_TOKEN_SHARE if history else room
+    rag_tokens = count_tokens(rag_header) + MESSAGE_OVERHEAD
+    kept_chunks = 0
+    for chunk in chunks:
+        chunk_tokens = count_tokens(chunk) + 1
+        if rag_tokens + chunk_tokens > rag_room:
+            break
+        rag_tokens += chunk_tokens
+        kept_chunks += 1
+    rag_messages = []
+    if kept_chunks:
+        rag_messages = [{"role": "system", "content": rag_header + "\n\n".join(chunks[:kept_chunks]).strip()}]
+        room -= rag_tokens
+
+    turn_messages = history.turn_messages(bot_name, history.turns)
+    recent = len(turn_messages) - min(HISTORY_TURNS, len(turn_messages))
+    kept_from = len(turn_messages)  # index of the oldest turn sent
+    for i in range(len(turn_messages) - 1, recent - 1, -1):
+        tokens = count_message_tokens(turn_messages[i:i + 1])
+        if tokens > room:
+            break
+        room -= tokens
+        kept_from = i
+
+    summary_messages = []
+    if history.summary and kept_from == recent:
+        summary_message = {"role": "system", "content": "Summary of the earlier conversation: " + history.summary}
+        if count_message_tokens([summary_message]) <= room:
+            summary_messages = [summary_message]
+            room -= count_message_tokens(summary_messages)
+    if kept_from == recent:
+        for i in range(recent - 1, -1, -1):  # not summarized yet, only if there is room left
+            tokens = count_message_tokens(turn_messages[i:i + 1])
+            if tokens > room:
+                break
+            room -= tokens
+            kept_from = i
+
+    messages = system_messages + rag_messages + summary_messages + turn_messages[kept_from:] + extra_messages
+    return messages, kept_chunks
+
+
+_refreshing = set()
+_refreshing_lock = threading.Lock()
+
+
+@timed("summary_refresh")
+def refresh_summary(client, model: str, conversation_id: int) -> bool:
+    """
+    Folds the turns that fell out of the verbatim window into the conversation's stored summary, once at least
+    SUMMARY_BATCH of them piled up. Meant to run in the background after a reply is committed.
+
+    Returns:
+        whether the summary was updated.
+    """
+    with _refreshing_lock:
+        if conversation_id in _refreshing:
+            return False
+        _refreshing.add(conversation_id)
+    try:
+        with session_scope() as session:
+            stored = session.get(ConversationSummary, conversation_id)
+            previous = stored.summary if stored is not None else None
+            covered_count = (stored.covered_count or 0) if stored is not None else 0
+            condition = [Message.conversation_id == conversation_id]
+            if stored is not None:
+                condition.append(Message.id > stored.covered_message_id)
+            pending = session.execute(Select(func.count(Message.id)).where(*condition)).scalar()
+            fold = min(SUMMARY_MAX_FOLD, pending - HISTORY_TURNS)  # the newest HISTORY_TURNS stay verbatim
+            if fold < SUMMARY_BATCH:
+                return False
+            to_fold = session.execute(Select(Message.id, Message.writer, Message.message).where(*condition)
+                                      .order_by(Message.created_at, Message.id).limit(fold)).all()
+
+        # no session is held while the model writes the summary
+        turns = "\n".join(f"{row.writer}: {row.message}" for row in to_fold)
+        response = client.chat.completions.create(
+            model=model,
+            messages=[
+                {"role": "system", "content": f"You maintain the running summary of a debate between two chatbots. "
+                                              f"Rewrite the summary so it also covers the new turns: who argued "
+                                              f"what, in less than {SUMMARY_MAX_WORDS} words."},
+                {"role": "user", "content": f"Current summary:\n{previous or '(nothing yet)'}\n\nNew turns:\n{turns}"},
+            ],
+            temperature=0,
+        )
+
+        with session_scope() as session:
+            stored = session.get(ConversationSummary, conversation_id)
+            if (stored.summary if stored is not None else None) != previous:
+                return False  # reset or rewritten meanwhile (a message was deleted), the next refresh starts over
+            if stored is None:
+                stored = ConversationSummary(conversation_id=conversation_id)
+                session.add(stored)
+            stored.summary = response.choices[0].message.content.strip()
+            stored.covered_message_id = to_fold[-1].id
+            stored.covered_count = covered_count + len(to_fold)
+            stored.updated_at = datetime.now()
+        print(f"Summarized {len(to_fold)} more messages of conversation {conversation_id}")
+        return True
+    finally:
+        with _refreshing_lock:
+            _refreshing.discard(conversation_id)
@@ -0,0 +1,91 @@
+import threading
+from collections import defaultdict
+
+from sqlalchemy.exc import IntegrityError
+
+from db import increment_reactions, session_scope
+
+
+class ReactionBuffer:
+    """
+    Write-behind buffer for reaction clicks.
+
+    Deltas are coalesced in memory per (message, emoji) and written with one bulk upsert every `interval` seconds
+    and on stop(), so a burst of clicks on a popular message costs one statement instead of one transaction each.
+    Counts read from the database lag by at most one interval.
+    """
+
+    def __init__(self, interval: float = 1.0):
+        self.interval = interval
+        self._pending = defaultdict(int)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def add(self, message_id: int, emoji: str, delta: int = 1):
+        with self._lock:
+            self._pending[(message_id, emoji)] += delta
+
+    def discard(self, message_id: int, emoji: str = None):
+        """Drops pending deltas for a message (or one of its emojis) that is being deleted."""
+        with self._lock:
+            for key in [k for k in self._pending if k[0] == message_id and (emoji is None or k[1] == emoji)]:
+                del self._pending[key]
+
+    def flush(self) -> int:
+        with self._lock:
+            pending, self._pending = self._pending, defaultdict(int)
+        if not pending:
+            return 0
+        try:
+            with session_scope() as session:
+                increment_reactions(session, pending)
+        except IntegrityError:
+            return self._flush_one_by_one(pending)
+        except Exception as e:
+            print(f"[WARNING] Reaction flush failed, keeping {len(pending)} counters for the next one: {e}")
+            self._requeue(pending)
+            return 0
+        return len(pending)
+
+    def _flush_one_by_one(self, pending: dict) -> int:
+        """
+        Writes each counter on its own after the bulk upsert hit a constraint, so the deltas of a message that no
+        longer exists are dropped instead of failing every later flush.
+        """
+        written = 0
+        items = list(pending.items())
+        for i, (key, delta) in enumerate(items):
+            try:
+                with session_scope() as session:
+                    increment_reactions(session, {key: delta})
+                written += 1
+            except IntegrityError as e:
+                print(f"[WARNING] Dropping {delta} {key[1]} reactions to message {key[0]}: {e.orig}")
+            except Exception as e:
+                print(f"[WARNING] Reaction flush failed, keeping {len(items) - i} counters for the next one: {e}")
+                self._requeue(dict(items[i:]))
+                break
+        return written
+
+    def _requeue(self, pending: dict):
+        with self._lock:
+            for key, delta in pending.items():
+                self._pending[key] += delta
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.flush()
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="reaction-buffer", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        self.flush()
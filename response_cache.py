@@ -0,0 +1,52 @@
+import hashlib
+import os
+
+from Util import EMBEDDING_MODEL, generate_embeddings
+from cache import SemanticCache
+
+# Opt-in: a cached first turn is a fixed reply, which is only wanted when many debates open on the same topics
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE", "0").lower() in ("1", "true", "yes")
+
+# Replies keyed on everything that shapes the prompt besides the topic wording: persona, model, retrieved chunks,
+# citation mode and whether there is history. Topics only have to be similar, "AI and journalism" and "AI and
+# journalists" share an entry above the threshold.
+response_cache = SemanticCache(
+    maxsize=int(os.getenv("RESPONSE_CACHE_SIZE", 1024)),
+    ttl=float(os.getenv("RESPONSE_CACHE_TTL", 6 * 3600)),
+    threshold=float(os.getenv("RESPONSE_CACHE_THRESHOLD", 0.95)),
+)
+
+
+def response_key(bot, citations: list[dict], cite: bool) -> tuple:
+    knowledge_base = bot.knowledge_base
+    return (
+        bot.model,
+        hashlib.sha1(bot.persona_prompt.encode("utf-8")).hexdigest(),
+        knowledge_base.version_hash if knowledge_base else None,
+        tuple(citation["chunk_id"] for citation in citations),
+        cite,
+        not bot.history and not bot.conversation_history,
+    )
+
+
+def lookup_reply(bot, subject: str, citations: list[dict], cite: bool) -> (str, tuple):
+    """
+    Args:
+        bot: the bot about to reply.
+        subject: the conversation topic.
+        citations: the chunks build_messages retrieved for it.
+        cite: whether the prompt asks for titles and authors.
+
+    Returns:
+        (cached reply or None, entry), entry goes to store_reply once a miss has been answered.
+    """
+    key = response_key(bot, citations, cite)
+    # the retrieval embedded the same topic a moment ago, so this is an embedding cache hit
+    embedding = generate_embeddings(bot.client, [subject], EMBEDDING_MODEL)[0]
+    return response_cache.get(key, embedding), (key, embedding)
+
+
+def store_reply(entry: tuple, reply: str):
+    key, embedding = entry
+    if reply:
+        response_cache.set(key, embedding, reply)
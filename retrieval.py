@@ -0,0 +1,54 @@
+import os
+
+from Util import rerank_with_scores, vector_retreival
+from cache import LRUCache
+from metrics import timed
+from knowledge_base import KnowledgeBase, registry
+
+# Memoized retrieve-then-rerank results. Keys carry the knowledge base version hash, so a rebuilt embeddings file
+# can never serve stale rows, and the registry listener below drops the old entries as soon as it reloads.
+retrieval_cache = LRUCache(
+    maxsize=int(os.getenv("RETRIEVAL_CACHE_SIZE", 1024)),
+    ttl=float(os.getenv("RETRIEVAL_CACHE_TTL")) if os.getenv("RETRIEVAL_CACHE_TTL") else None,
+)
+
+
+def _drop_knowledge_base(path: str):
+    dropped = retrieval_cache.discard_where(lambda key: key[0] == path)
+    if dropped:
+        print(f"Dropped {dropped} cached retrievals for {path}")
+
+
+registry.add_listener(_drop_knowledge_base)
+
+
+@timed("retrieval")
+def retrieve(client, knowledge_base: KnowledgeBase, query: str, top_k: int = 5,
+             use_cache: bool = True) -> list[tuple[int, float]]:
+    """
+    Vector search followed by a rerank of the candidates.
+
+    Args:
+        client: client api object
+        knowledge_base: the knowledge base to search.
+        query: the query string, normally the conversation topic.
+        top_k: candidates taken from the vector index and kept after the rerank.
+        use_cache: look the result up in retrieval_cache before calling the embedding and rerank APIs.
+
+    Returns:
+        (knowledge base row, rerank relevance score) pairs, best first.
+    """
+    key = (knowledge_base.path, knowledge_base.version_hash, " ".join(query.split()), top_k)
+    if use_cache:
+        cached = retrieval_cache.get(key)
+        if cached is not None:
+            return list(cached)
+
+    top_k_indices = vector_retreival(client=client, query=query, top_k=top_k, vector_index=knowledge_base.index)
+    top_k_chunks = [knowledge_base.chunks[i] for i in top_k_indices]
+    reranked = rerank_with_scores(client, chunks=top_k_chunks, top_k=top_k, query=query)
+    rows = [(top_k_indices[i], score) for i, score in reranked]
+
+    if use_cache:
+        retrieval_cache.set(key, tuple(rows))
+    return rows
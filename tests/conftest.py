@@ -0,0 +1,42 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# db.py and MAAC.py read the database URL, the API key and the knowledge base paths at import time, relative to the
+# working directory: the tests run in a scratch directory so they never touch data.db, keys.py or the real corpus
+WORKDIR = tempfile.mkdtemp(prefix="maac-tests-")
+os.chdir(WORKDIR)
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(WORKDIR, 'test.db')}"
+os.environ.setdefault("API_KEY", "offline")
+
+KB_SIZE = 200
+DIM = 32
+
+
+@pytest.fixture(scope="session")
+def maac():
+    """MAAC with small synthetic knowledge bases and the offline fakes behind the production client wrappers."""
+    from benchmarks.fake_together import FakeTogether, AsyncFakeTogether
+    from benchmarks.run import write_knowledge_base
+    from default_values_prompts import bot_1_knowledge_base, bot_2_knowledge_base
+    for seed, path in enumerate((bot_1_knowledge_base, bot_2_knowledge_base)):
+        write_knowledge_base(path, KB_SIZE, DIM, os.path.basename(path), seed=seed)
+
+    import MAAC
+    from together_client import ResilientTogether, AsyncResilientTogether, UpstreamPolicy, default_policy
+    policy = UpstreamPolicy(rate_limits=dict.fromkeys(default_policy.buckets, 0))
+    MAAC.client = ResilientTogether(FakeTogether(latency_scale=0, dim=DIM), policy)
+    MAAC.async_client = AsyncResilientTogether(AsyncFakeTogether(latency_scale=0, dim=DIM), policy)
+    MAAC.initialize_db()
+    return MAAC
+
+
+@pytest.fixture
+def client(maac):
+    from fastapi.testclient import TestClient
+    return TestClient(maac.app)
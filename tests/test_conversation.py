@@ -0,0 +1,55 @@
+import pytest
+
+from test_debate import start_debate
+
+
+@pytest.fixture
+def conversation(client):
+    """A conversation of 7 messages, returned with its message ids newest first."""
+    events = start_debate(client, 7)
+    ids = [data["message_id"] for name, data in events if name == "turn"]
+    return events[0][1]["conversation_id"], ids[::-1]
+
+
+def page(client, conversation_id, **cursor):
+    response = client.post("/conversation", json={"conv_id": str(conversation_id), "limit": 3,
+                                                  **{key: str(value) for key, value in cursor.items()}})
+    assert response.status_code == 200
+    body = response.json()
+    return [m["message_id"] for m in body["messages"]], body
+
+
+def test_pages_backwards_with_next_before(client, conversation):
+    conversation_id, ids = conversation
+    seen, cursor = [], {}
+    while True:
+        page_ids, body = page(client, conversation_id, **cursor)
+        seen += page_ids
+        if "next_before" not in body:
+            break
+        assert body["next_after"] == page_ids[0]
+        cursor = {"before": body["next_before"]}
+    assert seen == ids
+
+
+def test_pages_forwards_with_next_after(client, conversation):
+    conversation_id, ids = conversation
+    oldest = ids[-1]
+    pages, cursor = [], {"after": oldest}
+    while True:
+        page_ids, body = page(client, conversation_id, **cursor)
+        pages.append(page_ids)
+        if "next_after" not in body:
+            break
+        assert body["next_before"] == page_ids[-1]
+        cursor = {"after": body["next_after"]}
+    # every page is newest first, the pages themselves come oldest first
+    assert pages == [ids[-4:-1], ids[-7:-4], []]
+    assert [i for p in reversed(pages) for i in p] == ids[:-1]
+
+
+def test_partial_page_has_no_cursors(client, conversation):
+    conversation_id, ids = conversation
+    page_ids, body = page(client, conversation_id, before=ids[4])
+    assert page_ids == ids[5:]
+    assert "next_before" not in body and "next_after" not in body
@@ -0,0 +1,58 @@
+import json
+
+from sqlalchemy import select
+
+from db import Message, Reaction, session_scope
+
+
+def parse_events(body: str) -> list[tuple[str, dict]]:
+    events = []
+    for block in body.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+def start_debate(client, turns):
+    response = client.post("/multi-agent-chat/debate",
+                           json={"topic": "ai", "turns": turns, "bot_1_name": "1999 Bot", "bot_2_name": "2024 Bot"})
+    assert response.status_code == 200
+    return parse_events(response.text)
+
+
+def test_debate_runs_all_turns(client):
+    events = start_debate(client, 3)
+    assert [name for name, _ in events] == ["start", "turn", "turn", "turn", "done"]
+    assert events[-1][1]["message_ids"] == [data["message_id"] for name, data in events if name == "turn"]
+
+
+def test_debate_failed_turn_keeps_earlier_turns(client, maac, monkeypatch):
+    add_response = maac.add_response
+    saved_ids = []
+
+    def add_response_then_fail(session, conversation_id, **kwargs):
+        if not saved_ids:
+            message = add_response(session, conversation_id, **kwargs)
+            saved_ids.append(message.id)
+            return message
+        # a unique violation fails the flush and leaves the session's transaction unusable
+        session.add_all([Reaction(message_id=saved_ids[0], reaction_name="+1", quantity=1) for _ in range(2)])
+        session.flush()
+
+    monkeypatch.setattr(maac, "add_response", add_response_then_fail)
+    events = start_debate(client, 3)
+
+    assert [name for name, _ in events] == ["start", "turn", "error"]
+    error = events[-1][1]
+    assert error["turn"] == 1
+    assert error["message_ids"] == [events[1][1]["message_id"]]
+    with session_scope() as session:
+        saved = session.scalars(select(Message.id).where(Message.id.in_(error["message_ids"]))).all()
+    assert saved == error["message_ids"]
+
+
+def test_debate_rejects_turn_count(client, maac):
+    response = client.post("/multi-agent-chat/debate", json={"topic": "ai", "turns": 0})
+    assert response.status_code == 422
+    response = client.post("/multi-agent-chat/debate", json={"topic": "ai", "turns": maac.DEBATE_MAX_TURNS + 1})
+    assert response.status_code == 422
@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+
+from embedding_store import load_embedding_store, patch_embedding_store, save_embedding_store, store_paths
+
+
+def make_records(ids, dim=8, seed=0):
+    rng = np.random.default_rng(seed)
+    return [{"id": i, "title": f"title {i}", "author": "a", "chunk": f"chunk {i}",
+             "embedding": rng.random(dim).tolist()} for i in ids]
+
+
+def assert_store_holds(path, records):
+    embeddings, metadata = load_embedding_store(path, mmap=False)
+    assert [m["id"] for m in metadata] == [r["id"] for r in records]
+    expected = np.array([r["embedding"] for r in records], dtype=np.float32)
+    expected /= np.linalg.norm(expected, axis=1, keepdims=True)
+    np.testing.assert_allclose(embeddings, expected, rtol=1e-5)
+
+
+@pytest.fixture
+def store(tmp_path):
+    path = str(tmp_path / "kb.jsonl")
+    records = make_records([f"c{i}" for i in range(200)])
+    save_embedding_store(path, records)
+    return path, records
+
+
+def test_patch_adds(store):
+    path, records = store
+    patched = records + make_records(["n1", "n2"], seed=1)
+    assert patch_embedding_store(path, patched) == (2, 0)
+    assert_store_holds(path, patched)
+
+
+def test_patch_removes_and_adds(store):
+    path, records = store
+    patched = records[10:] + make_records(["n1"], seed=1)
+    assert patch_embedding_store(path, patched) == (1, 10)
+    assert_store_holds(path, patched)
+
+
+def test_patch_without_changes_writes_nothing(store):
+    path, records = store
+    matrix_path, metadata_path = store_paths(path)
+    before = [np.load(matrix_path).tobytes(), open(metadata_path, encoding="utf-8").read()]
+    assert patch_embedding_store(path, records) == (0, 0)
+    assert [np.load(matrix_path).tobytes(), open(metadata_path, encoding="utf-8").read()] == before
+
+
+def test_shrink_keeps_mapped_store_readable(store):
+    path, records = store
+    mapped, metadata = load_embedding_store(path, mmap=True)
+    snapshot = np.array(mapped)
+    assert patch_embedding_store(path, records[:5]) == (0, 195)
+    assert_store_holds(path, records[:5])
+    # a worker still holding the old mapping reads the old rows, the file under it was replaced, not truncated
+    np.testing.assert_array_equal(mapped, snapshot)
+    assert len(metadata) == mapped.shape[0] == 200
+
+
+def test_patch_keeps_dtype(tmp_path):
+    path = str(tmp_path / "kb.jsonl")
+    records = make_records(["a", "b"])
+    save_embedding_store(path, records, dtype="float16")
+    patch_embedding_store(path, records[:1])
+    assert load_embedding_store(path)[0].dtype == np.float16
@@ -0,0 +1,65 @@
+import pytest
+from sqlalchemy.exc import IntegrityError
+
+import reaction_buffer
+from reaction_buffer import ReactionBuffer
+
+MISSING_MESSAGE = 999
+
+
+class FakeCounters:
+    """Stands in for increment_reactions: rejects a message that does not exist, fails once on `flaky` keys."""
+
+    def __init__(self, flaky=()):
+        self.written = {}
+        self.flaky = set(flaky)
+
+    def __call__(self, session, pending):
+        if any(message_id == MISSING_MESSAGE for message_id, _ in pending):
+            raise IntegrityError("INSERT INTO reactions", {}, Exception("FOREIGN KEY constraint failed"))
+        if self.flaky & set(pending):
+            self.flaky -= set(pending)
+            raise ConnectionError("database went away")
+        for key, delta in pending.items():
+            self.written[key] = self.written.get(key, 0) + delta
+
+
+@pytest.fixture
+def counters(monkeypatch):
+    fake = FakeCounters()
+    monkeypatch.setattr(reaction_buffer, "increment_reactions", fake)
+    return fake
+
+
+def test_bulk_flush(counters):
+    buffer = ReactionBuffer()
+    for _ in range(3):
+        buffer.add(1, "+1")
+    buffer.add(2, "heart")
+    assert buffer.flush() == 2
+    assert counters.written == {(1, "+1"): 3, (2, "heart"): 1}
+    assert buffer.flush() == 0
+
+
+def test_constraint_error_drops_only_the_bad_counter(counters):
+    buffer = ReactionBuffer()
+    buffer.add(1, "+1")
+    buffer.add(MISSING_MESSAGE, "+1", 5)
+    buffer.add(2, "heart", 2)
+    assert buffer.flush() == 2
+    assert counters.written == {(1, "+1"): 1, (2, "heart"): 2}
+    assert buffer.flush() == 0  # the dropped counter does not come back to fail the next flush
+
+
+def test_transient_error_while_flushing_one_by_one_requeues_the_rest(counters):
+    counters.flaky = {(2, "heart")}
+    buffer = ReactionBuffer()
+    buffer.add(1, "+1")
+    buffer.add(MISSING_MESSAGE, "+1")
+    buffer.add(2, "heart", 2)
+    buffer.add(3, "laugh")
+    assert buffer.flush() == 1
+    # everything from the failed counter on is kept for the next flush, the written one is not counted twice
+    assert dict(buffer._pending) == {(2, "heart"): 2, (3, "laugh"): 1}
+    assert buffer.flush() == 2
+    assert counters.written == {(1, "+1"): 1, (2, "heart"): 2, (3, "laugh"): 1}
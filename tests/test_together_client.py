@@ -0,0 +1,123 @@
+import asyncio
+import gc
+from types import SimpleNamespace
+
+from AiA import Bot
+from together_client import AsyncResilientTogether, ResilientTogether, UpstreamPolicy
+
+
+def chunk(text):
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text))], usage=None)
+
+
+class StreamingClient:
+    """Minimal client whose streams record whether they were closed before the end."""
+
+    def __init__(self, words=("a", "b", "c")):
+        self.words = words
+        self.closed = []
+        self.embeddings = self.rerank = SimpleNamespace(create=None)
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, stream=False, **kwargs):
+        return self._stream()
+
+    def _stream(self):
+        try:
+            for word in self.words:
+                yield chunk(word)
+        finally:
+            self.closed.append(True)
+
+
+class AsyncStreamingClient(StreamingClient):
+    async def create(self, stream=False, **kwargs):
+        return self._astream()
+
+    async def _astream(self):
+        try:
+            for word in self.words:
+                yield chunk(word)
+        finally:
+            self.closed.append(True)
+
+
+def make_policy():
+    return UpstreamPolicy(rate_limits={"completions": 0, "embeddings": 0, "rerank": 0}, max_in_flight=2, timeout=1)
+
+
+def test_stream_releases_slot_when_exhausted():
+    policy = make_policy()
+    client = ResilientTogether(StreamingClient(), policy)
+    stream = client.chat.completions.create(model="m", messages=[], stream=True)
+    assert policy.in_flight.in_flight == 1
+    assert [c.choices[0].delta.content for c in stream] == ["a", "b", "c"]
+    assert policy.in_flight.in_flight == 0
+    stream.close()
+    del stream
+    gc.collect()
+    assert policy.in_flight.in_flight == 0  # released once, not once per way out
+
+
+def test_stream_never_started_releases_slot():
+    policy = make_policy()
+    client = ResilientTogether(StreamingClient(), policy)
+    for _ in range(3):  # more than max_in_flight, a leaked slot would make the third call wait for its budget
+        stream = client.chat.completions.create(model="m", messages=[], stream=True)
+        del stream
+    gc.collect()
+    assert policy.in_flight.in_flight == 0
+
+
+def test_stream_close_mid_stream_closes_upstream():
+    policy = make_policy()
+    upstream = StreamingClient()
+    stream = ResilientTogether(upstream, policy).chat.completions.create(model="m", messages=[], stream=True)
+    next(stream)
+    stream.close()
+    assert upstream.closed == [True]
+    assert policy.in_flight.in_flight == 0
+    assert list(stream) == []
+
+
+def test_async_stream_never_started_releases_slot():
+    policy = make_policy()
+    client = AsyncResilientTogether(AsyncStreamingClient(), policy)
+
+    async def open_streams():
+        for _ in range(3):
+            stream = await client.chat.completions.create(model="m", messages=[], stream=True)
+            del stream
+            gc.collect()
+
+    asyncio.run(open_streams())
+    assert policy.in_flight.in_flight == 0
+
+
+def test_astream_response_closed_early_closes_upstream():
+    policy = make_policy()
+    upstream = AsyncStreamingClient()
+    bot = Bot("bot", "persona", "model", client=None, async_client=AsyncResilientTogether(upstream, policy))
+
+    async def read_first_token():
+        tokens = bot.astream_response([{"role": "user", "content": "hi"}])
+        first = await tokens.__anext__()
+        await tokens.aclose()  # what the SSE response does when the client disconnects
+        # checked before asyncio.run finalizes leftover generators on its own
+        return first, list(upstream.closed), policy.in_flight.in_flight
+
+    assert asyncio.run(read_first_token()) == ("a", [True], 0)
+
+
+def test_sync_astream_response_closed_early_closes_upstream():
+    policy = make_policy()
+    upstream = StreamingClient()
+    bot = Bot("bot", "persona", "model", client=ResilientTogether(upstream, policy))
+
+    async def read_first_token():
+        tokens = bot.astream_response([{"role": "user", "content": "hi"}])
+        first = await tokens.__anext__()
+        await tokens.aclose()
+        return first, list(upstream.closed), policy.in_flight.in_flight
+
+    assert asyncio.run(read_first_token()) == ("a", [True], 0)
@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+
+from vector_index import BruteForceIndex, IVFIndex
+
+
+def clustered(n=2000, dim=16, clusters=40, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    matrix = centers[rng.integers(0, clusters, n)] + 0.3 * rng.standard_normal((n, dim)).astype(np.float32)
+    return matrix / np.linalg.norm(matrix, axis=1, keepdims=True)
+
+
+@pytest.mark.parametrize("top_k", [5, 150, 2000, 5000])
+def test_ivf_returns_top_k_real_rows(top_k):
+    matrix = clustered()
+    index = IVFIndex(matrix, n_lists=40, n_probe=1)
+    assert np.diff(index.offsets).max() < 150  # one probed list cannot hold the larger pages on its own
+    indices, scores = index.search(matrix[:20], top_k=top_k)
+    k = min(top_k, len(matrix))
+    assert indices.shape == scores.shape == (20, k)
+    for row, row_scores in zip(indices, scores):
+        assert row.min() >= 0 and row.max() < len(matrix)
+        assert len(set(row.tolist())) == k  # no padding, no duplicates
+        assert np.all(np.diff(row_scores) <= 1e-6)
+
+
+def test_ivf_probing_every_list_is_exact():
+    matrix = clustered()
+    queries = matrix[:10] + 0.05
+    ivf = IVFIndex(matrix, n_lists=40, n_probe=40)
+    exact, _ = BruteForceIndex(matrix).search(queries, top_k=10)
+    approximate, _ = ivf.search(queries, top_k=10)
+    np.testing.assert_array_equal(approximate, exact)
+
+
+@pytest.mark.parametrize("dtype", [np.float32, np.float16])
+def test_ivf_searches_a_normalized_memmap_in_place(tmp_path, dtype):
+    matrix = clustered().astype(dtype)
+    path = tmp_path / "embeddings.npy"
+    np.save(path, matrix)
+    mapped = np.load(path, mmap_mode="r")
+    index = IVFIndex(mapped, n_lists=40, n_probe=2)
+    assert index.matrix is mapped
+    assert index.search_one(np.asarray(mapped[7], dtype=np.float32), top_k=1) == [7]
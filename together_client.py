@@ -0,0 +1,438 @@
+import asyncio
+import inspect
+import os
+import random
+import threading
+import time
+from collections import deque
+from functools import partial
+from types import SimpleNamespace
+
+from metrics import registry as metrics_registry
+
+ENDPOINTS = ("completions", "embeddings", "rerank")
+
+# Requests per second per endpoint type (0 disables the limit), bursts up to twice the rate are let through
+TOGETHER_RATE_LIMITS = {
+    "completions": float(os.getenv("TOGETHER_COMPLETIONS_PER_SECOND", 10)),
+    "embeddings": float(os.getenv("TOGETHER_EMBEDDINGS_PER_SECOND", 20)),
+    "rerank": float(os.getenv("TOGETHER_RERANK_PER_SECOND", 20)),
+}
+TOGETHER_MAX_IN_FLIGHT = int(os.getenv("TOGETHER_MAX_IN_FLIGHT", 16))  # calls open at once, shared by all endpoints
+TOGETHER_RETRIES = int(os.getenv("TOGETHER_RETRIES", 3))
+TOGETHER_BACKOFF = float(os.getenv("TOGETHER_BACKOFF", 0.5))  # seconds, doubled on every retry and jittered
+TOGETHER_TIMEOUT = float(os.getenv("TOGETHER_TIMEOUT", 60))  # budget for one call, waits and retries included
+TOGETHER_BREAKER_FAILURES = int(os.getenv("TOGETHER_BREAKER_FAILURES", 5))  # consecutive failures that open it
+TOGETHER_BREAKER_RESET = float(os.getenv("TOGETHER_BREAKER_RESET", 30))  # seconds open before a trial call
+
+RETRYABLE_ERRORS = {"RateLimitError", "ServiceUnavailableError", "InternalServerError", "Timeout", "APITimeoutError",
+                    "APIConnectionError", "TimeoutError"}
+
+
+class UpstreamUnavailable(Exception):
+    """The Together API could not serve the call within its budget, callers should answer 503 rather than 500."""
+
+    def __init__(self, message: str, retry_after: float = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(UpstreamUnavailable):
+    pass
+
+
+def is_retryable(error: Exception) -> bool:
+    """429s, 5xx and transport errors are worth another attempt, 4xx (bad request, auth) are not."""
+    status = getattr(error, "status_code", None) or getattr(error, "http_status", None)
+    if status is not None:
+        return status == 429 or status >= 500
+    return type(error).__name__ in RETRYABLE_ERRORS or isinstance(error, (TimeoutError, ConnectionError))
+
+
+class TokenBucket:
+    """
+    Rate limiter shared by threads and event loops: reserve() takes a token and returns how long the caller has to
+    wait before it may use it, so the waiting happens outside the lock with time.sleep or asyncio.sleep.
+    """
+
+    def __init__(self, rate: float, burst: float = None):
+        self.rate = rate
+        self.capacity = burst or max(1.0, 2 * rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return max(0.0, -self.tokens / self.rate)
+
+    def refund(self):
+        if self.rate > 0:
+            with self._lock:
+                self.tokens = min(self.capacity, self.tokens + 1)
+
+
+class _Waiter:
+    def __init__(self, wake):
+        self.wake = wake
+        self.granted = False
+
+
+class InFlightLimiter:
+    """
+    Counting semaphore usable from threads (acquire) and from coroutines (aacquire) at the same time, so the sync
+    client in the executor and the async client share one cap. Released slots are handed to waiters in FIFO order.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.in_flight = 0
+        self._waiters = deque()
+        self._lock = threading.Lock()
+
+    def _try_acquire(self) -> bool:
+        if self.in_flight < self.limit and not self._waiters:
+            self.in_flight += 1
+            return True
+        return False
+
+    def acquire(self, timeout: float = None) -> bool:
+        event = threading.Event()
+        with self._lock:
+            if self._try_acquire():
+                return True
+            waiter = _Waiter(event.set)
+            self._waiters.append(waiter)
+        event.wait(timeout)
+        with self._lock:
+            if not waiter.granted:
+                self._waiters.remove(waiter)
+            return waiter.granted
+
+    async def aacquire(self, timeout: float = None) -> bool:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def wake():
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(True))
+
+        with self._lock:
+            if self._try_acquire():
+                return True
+            waiter = _Waiter(wake)
+            self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            pass
+        except asyncio.CancelledError:
+            with self._lock:
+                if not waiter.granted:
+                    self._waiters.remove(waiter)
+                    raise
+            self.release()  # the slot arrived together with the cancellation, pass it on
+            raise
+        with self._lock:
+            if not waiter.granted:
+                self._waiters.remove(waiter)
+            return waiter.granted
+
+    def release(self):
+        with self._lock:
+            if self._waiters:
+                waiter = self._waiters.popleft()
+                waiter.granted = True  # the slot moves to the waiter, in_flight stays the same
+                waiter.wake()
+            else:
+                self.in_flight -= 1
+
+
+class CircuitBreaker:
+    """
+    Opens after `failures` consecutive retryable errors and rejects calls for `reset_timeout` seconds, then lets a
+    single trial call through (half open): its success closes the circuit, its failure opens it again.
+    """
+
+    def __init__(self, name: str, failures: int = 5, reset_timeout: float = 30):
+        self.name = name
+        self.failures = failures
+        self.reset_timeout = reset_timeout
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half_open" if time.monotonic() - self.opened_at >= self.reset_timeout else "open"
+
+    def before_call(self):
+        with self._lock:
+            if self.opened_at is None:
+                return
+            remaining = self.reset_timeout - (time.monotonic() - self.opened_at)
+            if remaining > 0 or self.trial_running:
+                metrics_registry.inc("upstream_rejected_total", labels={"endpoint": self.name},
+                                     help="Calls rejected by an open circuit")
+                raise CircuitOpenError(f"Together {self.name} circuit is open", retry_after=max(remaining, 1))
+            self.trial_running = True
+
+    def record_success(self):
+        with self._lock:
+            self.consecutive_failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.trial_running or self.consecutive_failures >= self.failures:
+                if self.opened_at is None or self.trial_running:
+                    print(f"[WARNING] Opening the Together {self.name} circuit after "
+                          f"{self.consecutive_failures} consecutive failures")
+                    metrics_registry.inc("upstream_circuit_opened_total", labels={"endpoint": self.name},
+                                         help="Times a circuit breaker opened")
+                self.opened_at = time.monotonic()
+            self.trial_running = False
+
+    def release_trial(self):
+        """A trial call that failed with a non-retryable error says nothing about the upstream, let another try."""
+        with self._lock:
+            self.trial_running = False
+
+
+class UpstreamPolicy:
+    """
+    Limits shared by every client wrapped with it: one token bucket and one circuit breaker per endpoint type, one
+    in-flight cap for all of them, and the retry/timeout settings.
+    """
+
+    def __init__(self, rate_limits: dict = None, max_in_flight: int = TOGETHER_MAX_IN_FLIGHT,
+                 retries: int = TOGETHER_RETRIES, backoff: float = TOGETHER_BACKOFF, timeout: float = TOGETHER_TIMEOUT,
+                 breaker_failures: int = TOGETHER_BREAKER_FAILURES, breaker_reset: float = TOGETHER_BREAKER_RESET):
+        rate_limits = {**TOGETHER_RATE_LIMITS, **(rate_limits or {})}
+        self.buckets = {endpoint: TokenBucket(rate_limits[endpoint]) for endpoint in ENDPOINTS}
+        self.breakers = {endpoint: CircuitBreaker(endpoint, breaker_failures, breaker_reset) for endpoint in ENDPOINTS}
+        self.in_flight = InFlightLimiter(max_in_flight)
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+
+    def retry_delay(self, attempt: int) -> float:
+        return self.backoff * 2 ** attempt * (0.5 + random.random())
+
+    def gauges(self) -> dict:
+        gauges = {("upstream_in_flight", ()): self.in_flight.in_flight}
+        for endpoint, breaker in self.breakers.items():
+            gauges[("upstream_circuit_open", (("endpoint", endpoint),))] = int(breaker.state != "closed")
+        return gauges
+
+
+default_policy = UpstreamPolicy()
+metrics_registry.add_gauge_callback(default_policy.gauges)
+
+
+class SlotStream:
+    """
+    A streamed completion that holds an in-flight slot. The slot is given back exactly once: when the stream ends
+    or fails, when it is closed, or when it is dropped without being read to the end (or read at all), so a caller
+    that never starts the stream cannot leak it the way a generator's finally block would.
+    """
+
+    def __init__(self, stream, limiter: InFlightLimiter):
+        self.stream = stream
+        self._iterator = None
+        self._limiter = limiter
+        self._released = False
+        self._lock = threading.Lock()
+        self._reading = threading.Lock()  # a close from another thread waits for the chunk being read
+
+    def _release(self):
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        self._limiter.release()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._released:
+            raise StopIteration
+        try:
+            with self._reading:
+                if self._iterator is None:
+                    self._iterator = iter(self.stream)
+                return next(self._iterator)
+        except BaseException:
+            self._release()
+            raise
+
+    def close(self):
+        """Stops reading the upstream response and gives back the slot."""
+        try:
+            close = getattr(self.stream, "close", None)
+            if close is not None:
+                with self._reading:
+                    close()
+        finally:
+            self._release()
+
+    def __del__(self):
+        self._release()
+
+
+class AsyncSlotStream(SlotStream):
+    """SlotStream for an AsyncTogether stream, closed with aclose()."""
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._released:
+            raise StopAsyncIteration
+        try:
+            if self._iterator is None:
+                self._iterator = self.stream.__aiter__()
+            return await self._iterator.__anext__()
+        except BaseException:
+            self._release()
+            raise
+
+    async def aclose(self):
+        try:
+            close = getattr(self.stream, "aclose", None) or getattr(self.stream, "close", None)
+            if close is not None:
+                result = close()
+                if inspect.isawaitable(result):
+                    await result
+        finally:
+            self._release()
+
+
+def _retry_warning(endpoint: str, attempt: int, retries: int, error: Exception, delay: float):
+    print(f"[WARNING] Together {endpoint} call failed ({type(error).__name__}: {error}), "
+          f"retry {attempt}/{retries} in {delay:.1f}s...")
+    metrics_registry.inc("upstream_retries_total", labels={"endpoint": endpoint}, help="Retried upstream calls")
+
+
+class ResilientTogether:
+    """
+    Wraps a Together client (or anything with the same surface) so that every call goes through the policy: rate
+    limit, in-flight cap, circuit breaker, retries with jittered backoff on 429/5xx and a total time budget.
+
+    Exposes embeddings.create, rerank.create and chat.completions.create with the wrapped client's signatures.
+    Streams hold their in-flight slot until they are exhausted, closed or garbage collected (see SlotStream).
+    """
+
+    def __init__(self, client, policy: UpstreamPolicy = None):
+        self.client = client
+        self.policy = policy or default_policy
+        self.embeddings = SimpleNamespace(create=partial(self.call, "embeddings", client.embeddings.create))
+        self.rerank = SimpleNamespace(create=partial(self.call, "rerank", client.rerank.create))
+        self.chat = SimpleNamespace(completions=SimpleNamespace(
+            create=partial(self.call, "completions", client.chat.completions.create)))
+
+    def _wait_turn(self, endpoint: str, deadline: float):
+        policy = self.policy
+        policy.breakers[endpoint].before_call()
+        wait = policy.buckets[endpoint].reserve()
+        if time.monotonic() + wait > deadline:
+            policy.buckets[endpoint].refund()
+            policy.breakers[endpoint].release_trial()
+            raise UpstreamUnavailable(f"Together {endpoint} rate limit exceeds the call budget", retry_after=wait)
+        return wait
+
+    def call(self, endpoint: str, func, *args, **kwargs):
+        policy = self.policy
+        breaker = policy.breakers[endpoint]
+        deadline = time.monotonic() + policy.timeout
+        attempt = 0
+        while True:
+            time.sleep(self._wait_turn(endpoint, deadline))
+            if not policy.in_flight.acquire(timeout=max(0.0, deadline - time.monotonic())):
+                breaker.release_trial()
+                raise UpstreamUnavailable(f"Too many Together calls in flight for {endpoint}", retry_after=1)
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                policy.in_flight.release()
+                if not is_retryable(e):
+                    breaker.release_trial()
+                    raise
+                breaker.record_failure()
+                attempt += 1
+                delay = policy.retry_delay(attempt - 1)
+                if attempt > policy.retries or time.monotonic() + delay > deadline:
+                    raise UpstreamUnavailable(f"Together {endpoint} failed after {attempt} attempts: "
+                                              f"{type(e).__name__} {e}", retry_after=delay) from e
+                _retry_warning(endpoint, attempt, policy.retries, e, delay)
+                time.sleep(delay)
+                continue
+            breaker.record_success()
+            if kwargs.get("stream"):
+                return SlotStream(result, policy.in_flight)
+            policy.in_flight.release()
+            return result
+
+
+class AsyncResilientTogether(ResilientTogether):
+    """Same policy for an AsyncTogether client: waits with asyncio and cancels calls that overrun the budget."""
+
+    async def call(self, endpoint: str, func, *args, **kwargs):
+        policy = self.policy
+        breaker = policy.breakers[endpoint]
+        deadline = time.monotonic() + policy.timeout
+        attempt = 0
+        while True:
+            await asyncio.sleep(self._wait_turn(endpoint, deadline))
+            if not await policy.in_flight.aacquire(timeout=max(0.0, deadline - time.monotonic())):
+                breaker.release_trial()
+                raise UpstreamUnavailable(f"Too many Together calls in flight for {endpoint}", retry_after=1)
+            try:
+                result = await asyncio.wait_for(func(*args, **kwargs), max(0.0, deadline - time.monotonic()))
+            except Exception as e:
+                policy.in_flight.release()
+                if not is_retryable(e):
+                    breaker.release_trial()
+                    raise
+                breaker.record_failure()
+                attempt += 1
+                delay = policy.retry_delay(attempt - 1)
+                if attempt > policy.retries or time.monotonic() + delay > deadline:
+                    raise UpstreamUnavailable(f"Together {endpoint} failed after {attempt} attempts: "
+                                              f"{type(e).__name__} {e}", retry_after=delay) from e
+                _retry_warning(endpoint, attempt, policy.retries, e, delay)
+                await asyncio.sleep(delay)
+                continue
+            except asyncio.CancelledError:
+                policy.in_flight.release()
+                breaker.release_trial()
+                raise
+            breaker.record_success()
+            if kwargs.get("stream"):
+                return AsyncSlotStream(result, policy.in_flight)
+            policy.in_flight.release()
+            return result
+
+
+def make_client(api_key: str, policy: UpstreamPolicy = None) -> ResilientTogether:
+    """Together client behind the shared policy. The SDK's own retries are off so attempts are only counted here."""
+    from together import Together
+    policy = policy or default_policy
+    return ResilientTogether(Together(api_key=api_key, timeout=policy.timeout, max_retries=0), policy)
+
+
+def make_async_client(api_key: str, policy: UpstreamPolicy = None) -> AsyncResilientTogether:
+    from together import AsyncTogether
+    policy = policy or default_policy
+    return AsyncResilientTogether(AsyncTogether(api_key=api_key, timeout=policy.timeout, max_retries=0), policy)
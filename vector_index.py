@@ -0,0 +1,188 @@
+import numpy as np
+
+BLOCK_ROWS = 65536  # rows scored at once when the matrix has to be upcast (float16 stores)
+
+
+def _as_queries(queries: np.ndarray) -> np.ndarray:
+    queries = np.asarray(queries, dtype=np.float32)
+    if queries.ndim == 1:
+        queries = queries[None, :]
+    norms = np.linalg.norm(queries, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return queries / norms
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return matrix / norms
+
+
+def _is_normalized(matrix: np.ndarray, tolerance: float = 1e-3) -> bool:
+    norms = np.zeros(matrix.shape[0], dtype=np.float32)
+    for start in range(0, matrix.shape[0], BLOCK_ROWS):
+        block = np.asarray(matrix[start:start + BLOCK_ROWS], dtype=np.float32)
+        norms[start:start + BLOCK_ROWS] = np.linalg.norm(block, axis=1)
+    return bool(np.all(np.abs(norms - 1) < tolerance))
+
+
+def top_k_from_scores(scores: np.ndarray, top_k: int) -> (np.ndarray, np.ndarray):
+    """
+    Partial top-k selection along the last axis: argpartition is O(n), only the k winners get sorted.
+
+    Returns:
+        (indices, scores), both of shape (n_queries, min(top_k, n)) and ordered best first.
+    """
+    n = scores.shape[-1]
+    k = min(top_k, n)
+    if k <= 0:
+        empty = np.empty((scores.shape[0], 0))
+        return empty.astype(np.int64), empty.astype(scores.dtype)
+    if k < n:
+        candidates = np.argpartition(-scores, k - 1, axis=-1)[:, :k]
+    else:
+        candidates = np.broadcast_to(np.arange(n), scores.shape)
+    candidate_scores = np.take_along_axis(scores, candidates, axis=-1)
+    order = np.argsort(-candidate_scores, axis=-1)
+    return np.take_along_axis(candidates, order, axis=-1), np.take_along_axis(candidate_scores, order, axis=-1)
+
+
+class VectorIndex:
+    """
+    Cosine-similarity index over a fixed embedding matrix.
+
+    Rows are addressed by their position in the matrix the index was built from, so results line up with the
+    knowledge base records.
+    """
+
+    def __len__(self):
+        raise NotImplementedError
+
+    def search(self, queries: np.ndarray, top_k: int = 5) -> (np.ndarray, np.ndarray):
+        """
+        Args:
+            queries: one query vector or a (n_queries, dim) batch.
+            top_k: number of neighbours per query.
+
+        Returns:
+            (indices, scores), both (n_queries, top_k), best match first.
+        """
+        raise NotImplementedError
+
+    def search_one(self, query: np.ndarray, top_k: int = 5) -> list[int]:
+        indices, _ = self.search(query, top_k)
+        return [int(i) for i in indices[0]]
+
+
+class BruteForceIndex(VectorIndex):
+    """Exact search. Already-normalized matrices (e.g. a memory-mapped store) are used in place without a copy."""
+
+    def __init__(self, embeddings: np.ndarray):
+        if embeddings.dtype == np.float32 and _is_normalized(embeddings):
+            self.matrix = embeddings
+        elif embeddings.dtype == np.float16 and _is_normalized(embeddings):
+            self.matrix = embeddings  # kept compact, upcast block by block at search time
+        else:
+            self.matrix = _normalize_rows(embeddings)
+
+    def __len__(self):
+        return self.matrix.shape[0]
+
+    def scores(self, queries: np.ndarray) -> np.ndarray:
+        queries = _as_queries(queries)
+        if self.matrix.dtype == np.float32:
+            return queries @ self.matrix.T
+        scores = np.empty((queries.shape[0], len(self)), dtype=np.float32)
+        for start in range(0, len(self), BLOCK_ROWS):
+            block = np.asarray(self.matrix[start:start + BLOCK_ROWS], dtype=np.float32)
+            scores[:, start:start + block.shape[0]] = queries @ block.T
+        return scores
+
+    def search(self, queries: np.ndarray, top_k: int = 5) -> (np.ndarray, np.ndarray):
+        return top_k_from_scores(self.scores(queries), top_k)
+
+
+class IVFIndex(VectorIndex):
+    """
+    Approximate search with an inverted file: rows are clustered with spherical k-means and a query only scores
+    the rows of its n_probe closest clusters, or of as many more as it takes to hold top_k rows.
+
+    Only the row ids are kept grouped by cluster (ascending within a list), the vectors are read from the matrix
+    the index was built from. A normalized matrix, e.g. a memory-mapped store, is used in place like
+    BruteForceIndex does, so the index does not hold a second copy of the embeddings.
+    """
+
+    def __init__(self, embeddings: np.ndarray, n_lists: int = None, n_probe: int = 8, n_iter: int = 10,
+                 sample_size: int = 50000, seed: int = 0):
+        n = embeddings.shape[0]
+        self.n_lists = n_lists or max(1, int(np.sqrt(n)))
+        self.n_probe = min(n_probe, self.n_lists)
+        rng = np.random.default_rng(seed)
+
+        sample_ids = rng.choice(n, size=min(n, max(sample_size, self.n_lists)), replace=False)
+        sample = _normalize_rows(embeddings[np.sort(sample_ids)])
+        self.centroids = self._train(sample, n_iter, rng)
+
+        assignments = np.empty(n, dtype=np.int64)
+        for start in range(0, n, BLOCK_ROWS):
+            block = _normalize_rows(embeddings[start:start + BLOCK_ROWS])
+            assignments[start:start + block.shape[0]] = np.argmax(block @ self.centroids.T, axis=1)
+
+        self.ids = np.argsort(assignments, kind="stable")
+        counts = np.bincount(assignments, minlength=self.n_lists)
+        self.offsets = np.concatenate([[0], np.cumsum(counts)])
+        normalized = embeddings.dtype in (np.float32, np.float16) and _is_normalized(embeddings)
+        self.matrix = embeddings if normalized else _normalize_rows(embeddings)
+
+    def _train(self, sample: np.ndarray, n_iter: int, rng) -> np.ndarray:
+        centroids = sample[rng.choice(sample.shape[0], size=self.n_lists, replace=False)]
+        for _ in range(n_iter):
+            assignments = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, sample)
+            empty = np.bincount(assignments, minlength=self.n_lists) == 0
+            sums[empty] = sample[rng.choice(sample.shape[0], size=int(empty.sum()))]  # reseed dead clusters
+            centroids = _normalize_rows(sums)
+        return centroids
+
+    def __len__(self):
+        return self.ids.shape[0]
+
+    def search(self, queries: np.ndarray, top_k: int = 5) -> (np.ndarray, np.ndarray):
+        queries = _as_queries(queries)
+        ranked, _ = top_k_from_scores(queries @ self.centroids.T, self.n_lists)
+        sizes = np.diff(self.offsets)
+
+        k = min(top_k, len(self))
+        indices = np.empty((queries.shape[0], k), dtype=np.int64)
+        scores = np.empty((queries.shape[0], k), dtype=np.float32)
+        for q, lists in enumerate(ranked):
+            # probe n_probe lists, or more when they hold fewer than k rows, so every query gets k real results
+            n_probe = max(self.n_probe, int(np.searchsorted(np.cumsum(sizes[lists]), k)) + 1)
+            candidate_ids = np.sort(np.concatenate([self.ids[self.offsets[l]:self.offsets[l + 1]]
+                                                    for l in lists[:n_probe]]))
+            candidates = np.asarray(self.matrix[candidate_ids], dtype=np.float32)
+            best, best_scores = top_k_from_scores((candidates @ queries[q])[None, :], k)
+            indices[q] = candidate_ids[best[0]]
+            scores[q] = best_scores[0]
+        return indices, scores
+
+
+EXACT_SEARCH_LIMIT = 50000  # below this many rows brute force is already sub-millisecond-ish and exact
+
+
+def build_index(embeddings: np.ndarray, kind: str = "auto", **kwargs) -> VectorIndex:
+    """
+    Args:
+        embeddings: (n, dim) matrix, may be a read-only memmap.
+        kind: "brute", "ivf" or "auto" (brute force up to EXACT_SEARCH_LIMIT rows, IVF above).
+        **kwargs: forwarded to the IVF backend (n_lists, n_probe, ...).
+    """
+    if kind == "auto":
+        kind = "brute" if embeddings.shape[0] <= EXACT_SEARCH_LIMIT else "ivf"
+    if kind == "brute":
+        return BruteForceIndex(embeddings)
+    if kind == "ivf":
+        return IVFIndex(embeddings, **kwargs)
+    raise ValueError(f"Unknown vector index kind: {kind}")